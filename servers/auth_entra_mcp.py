@@ -6,10 +6,9 @@ Run with: cd servers && uvicorn auth_entra_mcp:app --host 0.0.0.0 --port 8000
 
 import logging
 import os
-import uuid
 import warnings
+from contextlib import asynccontextmanager
 from datetime import date
-from enum import Enum
 from typing import Annotated
 
 import httpx
@@ -20,6 +19,29 @@ from azure.identity.aio import DefaultAzureCredential, ManagedIdentityCredential
 from azure.monitor.opentelemetry import configure_azure_monitor
 from cosmosdb_store import CosmosDBStore
 from dotenv import load_dotenv
+from expense_change_feed import ChangeFeedStatsConsumer, render_expense_statistics
+from expense_cosmos import CosmosExpenseRepository, ExpensePartitionCache, count_by_category
+from expense_dedup import DuplicateExpenseError, DuplicatePolicy
+from expense_pages import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursorError
+from expense_records import (
+    MAX_BULK_EXPENSES,
+    Category,
+    Expense,
+    ExpenseInput,
+    PaymentMethod,
+    to_cents,
+    validate_expense_inputs,
+)
+from expense_render import (
+    DEFAULT_RESPONSE_MAX_BYTES,
+    MIN_RESPONSE_TOKENS,
+    BudgetedListing,
+    render_bulk_result,
+    render_search_results,
+    render_spending_rollup,
+    response_max_bytes,
+)
+from expense_rollups import RollupPeriod
 from fastmcp import Context, FastMCP
 from fastmcp.server.auth.providers.azure import AzureProvider
 from fastmcp.server.dependencies import get_access_token
@@ -81,6 +103,16 @@ cosmos_client = CosmosClient(
 )
 cosmos_db = cosmos_client.get_database_client(os.environ["AZURE_COSMOSDB_DATABASE"])
 cosmos_container = cosmos_db.get_container_client(os.environ["AZURE_COSMOSDB_USER_CONTAINER"])
+RESPONSE_MAX_BYTES = int(os.getenv("EXPENSES_RESPONSE_MAX_BYTES", DEFAULT_RESPONSE_MAX_BYTES))
+rollup_container = cosmos_db.get_container_client(os.environ["AZURE_COSMOSDB_ROLLUP_CONTAINER"])
+expense_repository = CosmosExpenseRepository(
+    cosmos_container,
+    rollup_container,
+    DuplicatePolicy.from_env(),
+    cache=ExpensePartitionCache.from_env(cosmos_container),
+)
+# Keeps the expense statistics document in the rollup container up to date from the change feed
+stats_consumer = ChangeFeedStatsConsumer(cosmos_container, rollup_container)
 
 # Configure authentication provider
 # Azure/Entra ID authentication using AzureProvider
@@ -154,23 +186,23 @@ class UserAuthMiddleware(Middleware):
         return await call_next(context)
 
 
-# Create the MCP server
-mcp = FastMCP("Expenses Tracker", auth=auth, middleware=[OpenTelemetryMiddleware("ExpensesMCP"), UserAuthMiddleware()])
-
-
-class PaymentMethod(Enum):
-    AMEX = "amex"
-    VISA = "visa"
-    CASH = "cash"
+@asynccontextmanager
+async def lifespan(_server: FastMCP):
+    """Run the change feed consumer for as long as the server runs."""
+    stats_consumer.start()
+    try:
+        yield
+    finally:
+        await stats_consumer.stop()
 
 
-class Category(Enum):
-    FOOD = "food"
-    TRANSPORT = "transport"
-    ENTERTAINMENT = "entertainment"
-    SHOPPING = "shopping"
-    GADGET = "gadget"
-    OTHER = "other"
+# Create the MCP server
+mcp = FastMCP(
+    "Expenses Tracker",
+    auth=auth,
+    middleware=[OpenTelemetryMiddleware("ExpensesMCP"), UserAuthMiddleware()],
+    lifespan=lifespan,
+)
 
 
 @mcp.tool
@@ -194,18 +226,22 @@ async def add_user_expense(
         user_id = await ctx.get_state("user_id")
         if not user_id:
             return "Error: Authentication required (no user_id present)"
-        expense_id = str(uuid.uuid4())
-        expense_item = {
-            "id": expense_id,
-            "user_id": user_id,
-            "date": date_iso,
-            "amount": amount,
-            "category": category.value,
-            "description": description,
-            "payment_method": payment_method.value,
-        }
-        await cosmos_container.create_item(body=expense_item)
-        return f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        expense = Expense(
+            date=date,
+            cents=to_cents(amount),
+            category=category.value,
+            description=description,
+            payment_method=payment_method.value,
+        )
+        result = await expense_repository.for_user(user_id).add(expense)
+        if isinstance(result.error, DuplicateExpenseError):
+            return f"Error: Expense not added, it is a {result.error}"
+        if result.error is not None:
+            raise result.error
+        message = f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        if result.warning is not None:
+            message += f"\nWarning: it is a {result.warning}"
+        return message
 
     except Exception as e:
         logger.error(f"Error adding expense: {str(e)}")
@@ -213,35 +249,126 @@ async def add_user_expense(
 
 
 @mcp.tool
-async def get_user_expenses(ctx: Context):
-    """Get the authenticated user's expense data from Cosmos DB."""
+async def add_user_expenses(
+    expenses: Annotated[
+        list[ExpenseInput],
+        "Expenses to add, each with date (YYYY-MM-DD), positive amount, category, description and payment_method",
+    ],
+    ctx: Context,
+):
+    """Add several expenses for the authenticated user to Cosmos DB at once, such as the rows of a bank statement."""
+    if len(expenses) > MAX_BULK_EXPENSES:
+        return f"Error: At most {MAX_BULK_EXPENSES} expenses can be added at once"
+
+    valid, errors = validate_expense_inputs(expenses, Category, PaymentMethod)
+    logger.info(f"Adding {len(valid)} expenses ({len(errors)} invalid)")
 
     try:
         user_id = await ctx.get_state("user_id")
         if not user_id:
             return "Error: Authentication required (no user_id present)"
-        query = "SELECT * FROM c WHERE c.user_id = @uid ORDER BY c.date DESC"
-        parameters = [{"name": "@uid", "value": user_id}]
-        expenses_data = []
+        results = await expense_repository.for_user(user_id).add_many([expense for _, expense in valid])
+        added, duplicate_warnings = [], []
+        for (position, expense), result in zip(valid, results):
+            if result.error is not None:
+                errors.append((position, str(result.error)))
+                continue
+            added.append(expense)
+            if result.warning is not None:
+                duplicate_warnings.append((position, result.warning))
+        return render_bulk_result(added, errors, duplicate_warnings)
 
-        async for item in cosmos_container.query_items(query=query, parameters=parameters, partition_key=user_id):
-            expenses_data.append(item)
+    except Exception as e:
+        logger.error(f"Error adding expenses: {str(e)}")
+        return f"Error: Unable to add expenses - {str(e)}"
 
-        if not expenses_data:
-            return "No expenses found."
 
-        expense_summary = f"Expense data ({len(expenses_data)} entries):\n\n"
-        for expense in expenses_data:
-            expense_summary += (
-                f"Date: {expense.get('date', 'N/A')}, "
-                f"Amount: ${expense.get('amount', 0)}, "
-                f"Category: {expense.get('category', 'N/A')}, "
-                f"Description: {expense.get('description', 'N/A')}, "
-                f"Payment: {expense.get('payment_method', 'N/A')}\n"
-            )
+@mcp.tool
+async def search_user_expenses(
+    query: Annotated[str, "Words to look for in expense descriptions, such as 'coffee'; words match as prefixes"],
+    ctx: Context,
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """Search the authenticated user's expense descriptions; return the matches, newest first, with their total."""
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
 
-        return expense_summary
+    try:
+        user_id = await ctx.get_state("user_id")
+        if not user_id:
+            return "Error: Authentication required (no user_id present)"
+        logger.info(f"Searching expenses for {query!r}")
+        matches = await expense_repository.for_user(user_id).search(query)
+        return render_search_results(matches, response_max_bytes(max_tokens, RESPONSE_MAX_BYTES))
 
+    except Exception as e:
+        logger.error(f"Error searching expenses: {str(e)}")
+        return f"Error: Unable to search expenses - {str(e)}"
+
+
+@mcp.tool
+async def get_user_spending_rollup(
+    ctx: Context,
+    period: Annotated[RollupPeriod, "Group spending by day, week (starting on Monday) or month"] = RollupPeriod.MONTH,
+    start_date: Annotated[date | None, "Earliest date to include in YYYY-MM-DD format"] = None,
+    end_date: Annotated[date | None, "Latest date to include in YYYY-MM-DD format"] = None,
+    category: Annotated[Category | None, "Only include expenses in this category"] = None,
+    payment_method: Annotated[PaymentMethod | None, "Only include expenses paid this way"] = None,
+):
+    """Get the authenticated user's spending per day, week or month with totals per category, from rollups."""
+    try:
+        user_id = await ctx.get_state("user_id")
+        if not user_id:
+            return "Error: Authentication required (no user_id present)"
+        logger.info(f"Spending rollup per {period.value} from {start_date} to {end_date} (category={category})")
+        rollups = await expense_repository.for_user(user_id).rollup(
+            period,
+            start_date=start_date,
+            end_date=end_date,
+            category=category.value if category else None,
+            payment_method=payment_method.value if payment_method else None,
+        )
+        return render_spending_rollup(period, rollups, RESPONSE_MAX_BYTES)
+
+    except Exception as e:
+        logger.error(f"Error computing spending rollup: {str(e)}")
+        return f"Error: Unable to compute spending rollup - {str(e)}"
+
+
+@mcp.tool
+async def get_user_expenses(
+    ctx: Context,
+    limit: Annotated[int, "Maximum number of expenses to return"] = DEFAULT_PAGE_SIZE,
+    cursor: Annotated[str | None, "Cursor returned by a previous call, to fetch the next page"] = None,
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """
+    Get one page of the authenticated user's expense data from Cosmos DB, newest first,
+    as one "Date: ..., Amount: ..." line per expense.
+
+    Rows that do not fit in the response budget are summarized per category; request a smaller limit to list them.
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return f"Error: limit must be between 1 and {MAX_PAGE_SIZE}"
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        user_id = await ctx.get_state("user_id")
+        if not user_id:
+            return "Error: Authentication required (no user_id present)"
+        expenses, next_cursor = await expense_repository.for_user(user_id).page(cursor, limit)
+        if not expenses:
+            return "No expenses found."
+
+        listing = BudgetedListing(response_max_bytes(max_tokens, RESPONSE_MAX_BYTES))
+        for expense in expenses:
+            listing.add_expense(expense)
+        return listing.render(f"\nNext page cursor: {next_cursor}\n" if next_cursor else "")
+
+    except InvalidCursorError:
+        logger.error(f"Invalid expenses cursor: {cursor}")
+        return "Error: Invalid or expired cursor"
     except Exception as e:
         logger.error(f"Error reading expenses: {str(e)}")
         return f"Error: Unable to retrieve expense data - {str(e)}"
@@ -249,7 +376,7 @@ async def get_user_expenses(ctx: Context):
 
 @mcp.tool
 async def get_expense_stats(ctx: Context):
-    """Get a statistical summary of expenses (count per category) for all users.
+    """Get a statistical summary of expenses (count and total per category, payment method and month) for all users.
     Only accessible to users in the authorized admin group.
     """
     access_token = get_access_token()
@@ -279,20 +406,26 @@ async def get_expense_stats(ctx: Context):
         if not is_admin:
             return "Error: Unauthorized. You do not have permission to access expense statistics."
 
-        # Query Cosmos DB for stats across all users
-        # We fetch categories and aggregate in Python to avoid cross-partition GROUP BY limitations
-        query = "SELECT c.category FROM c"
-        stats = {}
-        async for item in cosmos_container.query_items(query=query):
-            category = item.get("category", "Unknown")
-            stats[category] = stats.get(category, 0) + 1
+        # The statistics materialized from the change feed cost a single point read
+        statistics = await stats_consumer.read()
+        if statistics is not None and statistics.count:
+            return render_expense_statistics(statistics)
 
-        if not stats:
+        # Until the consumer has recorded them, count per category in the database, one feed range at a time
+        stats = await count_by_category(cosmos_container)
+        if not stats.counts:
             return "No expense data found to summarize."
 
         summary = "Expense Statistics (Count per Category):\n"
-        for category, count in stats.items():
+        for category, count in sorted(stats.counts.items(), key=lambda entry: (-entry[1], entry[0])):
             summary += f"- Category {category}: {count} expenses\n"
+        summary += (
+            f"\nQueried {stats.feed_ranges} partition key ranges in {stats.elapsed_seconds * 1000:.0f} ms"
+            f" ({stats.request_charge:.2f} RU)\n"
+        )
+        logger.info(
+            f"Expense stats: {stats.feed_ranges} feed ranges, {stats.elapsed_seconds:.3f}s, {stats.request_charge} RU"
+        )
 
         return summary
 
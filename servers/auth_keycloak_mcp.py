@@ -6,10 +6,8 @@ Run with: cd servers && uvicorn auth_keycloak_mcp:app --host 0.0.0.0 --port 8000
 
 import logging
 import os
-import uuid
 import warnings
 from datetime import date
-from enum import Enum
 from typing import Annotated
 
 import logfire
@@ -18,6 +16,28 @@ from azure.cosmos.aio import CosmosClient
 from azure.identity.aio import DefaultAzureCredential, ManagedIdentityCredential
 from azure.monitor.opentelemetry import configure_azure_monitor
 from dotenv import load_dotenv
+from expense_cosmos import CosmosExpenseRepository, ExpensePartitionCache
+from expense_dedup import DuplicateExpenseError, DuplicatePolicy
+from expense_pages import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursorError
+from expense_records import (
+    MAX_BULK_EXPENSES,
+    Category,
+    Expense,
+    ExpenseInput,
+    PaymentMethod,
+    to_cents,
+    validate_expense_inputs,
+)
+from expense_render import (
+    DEFAULT_RESPONSE_MAX_BYTES,
+    MIN_RESPONSE_TOKENS,
+    BudgetedListing,
+    render_bulk_result,
+    render_search_results,
+    render_spending_rollup,
+    response_max_bytes,
+)
+from expense_rollups import RollupPeriod
 from fastmcp import Context, FastMCP
 from fastmcp.server.dependencies import get_access_token
 from fastmcp.server.middleware import Middleware, MiddlewareContext
@@ -77,6 +97,13 @@ cosmos_client = CosmosClient(
 )
 cosmos_db = cosmos_client.get_database_client(os.environ["AZURE_COSMOSDB_DATABASE"])
 cosmos_container = cosmos_db.get_container_client(os.environ["AZURE_COSMOSDB_USER_CONTAINER"])
+RESPONSE_MAX_BYTES = int(os.getenv("EXPENSES_RESPONSE_MAX_BYTES", DEFAULT_RESPONSE_MAX_BYTES))
+expense_repository = CosmosExpenseRepository(
+    cosmos_container,
+    cosmos_db.get_container_client(os.environ["AZURE_COSMOSDB_ROLLUP_CONTAINER"]),
+    DuplicatePolicy.from_env(),
+    cache=ExpensePartitionCache.from_env(cosmos_container),
+)
 
 # Configure Keycloak authentication using KeycloakAuthProvider with DCR support
 KEYCLOAK_REALM_URL = os.environ["KEYCLOAK_REALM_URL"]
@@ -126,21 +153,6 @@ class UserAuthMiddleware(Middleware):
 mcp = FastMCP("Expenses Tracker", auth=auth, middleware=[OpenTelemetryMiddleware("ExpensesMCP"), UserAuthMiddleware()])
 
 
-class PaymentMethod(Enum):
-    AMEX = "amex"
-    VISA = "visa"
-    CASH = "cash"
-
-
-class Category(Enum):
-    FOOD = "food"
-    TRANSPORT = "transport"
-    ENTERTAINMENT = "entertainment"
-    SHOPPING = "shopping"
-    GADGET = "gadget"
-    OTHER = "other"
-
-
 @mcp.tool
 async def add_user_expense(
     date: Annotated[date, "Date of the expense in YYYY-MM-DD format"],
@@ -162,18 +174,22 @@ async def add_user_expense(
         user_id = await ctx.get_state("user_id")
         if not user_id:
             return "Error: Authentication required (no user_id present)"
-        expense_id = str(uuid.uuid4())
-        expense_item = {
-            "id": expense_id,
-            "user_id": user_id,
-            "date": date_iso,
-            "amount": amount,
-            "category": category.value,
-            "description": description,
-            "payment_method": payment_method.value,
-        }
-        await cosmos_container.create_item(body=expense_item)
-        return f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        expense = Expense(
+            date=date,
+            cents=to_cents(amount),
+            category=category.value,
+            description=description,
+            payment_method=payment_method.value,
+        )
+        result = await expense_repository.for_user(user_id).add(expense)
+        if isinstance(result.error, DuplicateExpenseError):
+            return f"Error: Expense not added, it is a {result.error}"
+        if result.error is not None:
+            raise result.error
+        message = f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        if result.warning is not None:
+            message += f"\nWarning: it is a {result.warning}"
+        return message
 
     except Exception as e:
         logger.error(f"Error adding expense: {str(e)}")
@@ -181,35 +197,126 @@ async def add_user_expense(
 
 
 @mcp.tool
-async def get_user_expenses(ctx: Context):
-    """Get the authenticated user's expense data from Cosmos DB."""
+async def add_user_expenses(
+    expenses: Annotated[
+        list[ExpenseInput],
+        "Expenses to add, each with date (YYYY-MM-DD), positive amount, category, description and payment_method",
+    ],
+    ctx: Context,
+):
+    """Add several expenses for the authenticated user to Cosmos DB at once, such as the rows of a bank statement."""
+    if len(expenses) > MAX_BULK_EXPENSES:
+        return f"Error: At most {MAX_BULK_EXPENSES} expenses can be added at once"
+
+    valid, errors = validate_expense_inputs(expenses, Category, PaymentMethod)
+    logger.info(f"Adding {len(valid)} expenses ({len(errors)} invalid)")
 
     try:
         user_id = await ctx.get_state("user_id")
         if not user_id:
             return "Error: Authentication required (no user_id present)"
-        query = "SELECT * FROM c WHERE c.user_id = @uid ORDER BY c.date DESC"
-        parameters = [{"name": "@uid", "value": user_id}]
-        expenses_data = []
+        results = await expense_repository.for_user(user_id).add_many([expense for _, expense in valid])
+        added, duplicate_warnings = [], []
+        for (position, expense), result in zip(valid, results):
+            if result.error is not None:
+                errors.append((position, str(result.error)))
+                continue
+            added.append(expense)
+            if result.warning is not None:
+                duplicate_warnings.append((position, result.warning))
+        return render_bulk_result(added, errors, duplicate_warnings)
 
-        async for item in cosmos_container.query_items(query=query, parameters=parameters, partition_key=user_id):
-            expenses_data.append(item)
+    except Exception as e:
+        logger.error(f"Error adding expenses: {str(e)}")
+        return f"Error: Unable to add expenses - {str(e)}"
 
-        if not expenses_data:
-            return "No expenses found."
 
-        expense_summary = f"Expense data ({len(expenses_data)} entries):\n\n"
-        for expense in expenses_data:
-            expense_summary += (
-                f"Date: {expense.get('date', 'N/A')}, "
-                f"Amount: ${expense.get('amount', 0)}, "
-                f"Category: {expense.get('category', 'N/A')}, "
-                f"Description: {expense.get('description', 'N/A')}, "
-                f"Payment: {expense.get('payment_method', 'N/A')}\n"
-            )
+@mcp.tool
+async def search_user_expenses(
+    query: Annotated[str, "Words to look for in expense descriptions, such as 'coffee'; words match as prefixes"],
+    ctx: Context,
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """Search the authenticated user's expense descriptions; return the matches, newest first, with their total."""
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        user_id = await ctx.get_state("user_id")
+        if not user_id:
+            return "Error: Authentication required (no user_id present)"
+        logger.info(f"Searching expenses for {query!r}")
+        matches = await expense_repository.for_user(user_id).search(query)
+        return render_search_results(matches, response_max_bytes(max_tokens, RESPONSE_MAX_BYTES))
+
+    except Exception as e:
+        logger.error(f"Error searching expenses: {str(e)}")
+        return f"Error: Unable to search expenses - {str(e)}"
+
+
+@mcp.tool
+async def get_user_spending_rollup(
+    ctx: Context,
+    period: Annotated[RollupPeriod, "Group spending by day, week (starting on Monday) or month"] = RollupPeriod.MONTH,
+    start_date: Annotated[date | None, "Earliest date to include in YYYY-MM-DD format"] = None,
+    end_date: Annotated[date | None, "Latest date to include in YYYY-MM-DD format"] = None,
+    category: Annotated[Category | None, "Only include expenses in this category"] = None,
+    payment_method: Annotated[PaymentMethod | None, "Only include expenses paid this way"] = None,
+):
+    """Get the authenticated user's spending per day, week or month with totals per category, from rollups."""
+    try:
+        user_id = await ctx.get_state("user_id")
+        if not user_id:
+            return "Error: Authentication required (no user_id present)"
+        logger.info(f"Spending rollup per {period.value} from {start_date} to {end_date} (category={category})")
+        rollups = await expense_repository.for_user(user_id).rollup(
+            period,
+            start_date=start_date,
+            end_date=end_date,
+            category=category.value if category else None,
+            payment_method=payment_method.value if payment_method else None,
+        )
+        return render_spending_rollup(period, rollups, RESPONSE_MAX_BYTES)
+
+    except Exception as e:
+        logger.error(f"Error computing spending rollup: {str(e)}")
+        return f"Error: Unable to compute spending rollup - {str(e)}"
+
+
+@mcp.tool
+async def get_user_expenses(
+    ctx: Context,
+    limit: Annotated[int, "Maximum number of expenses to return"] = DEFAULT_PAGE_SIZE,
+    cursor: Annotated[str | None, "Cursor returned by a previous call, to fetch the next page"] = None,
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """
+    Get one page of the authenticated user's expense data from Cosmos DB, newest first,
+    as one "Date: ..., Amount: ..." line per expense.
+
+    Rows that do not fit in the response budget are summarized per category; request a smaller limit to list them.
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return f"Error: limit must be between 1 and {MAX_PAGE_SIZE}"
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        user_id = await ctx.get_state("user_id")
+        if not user_id:
+            return "Error: Authentication required (no user_id present)"
+        expenses, next_cursor = await expense_repository.for_user(user_id).page(cursor, limit)
+        if not expenses:
+            return "No expenses found."
 
-        return expense_summary
+        listing = BudgetedListing(response_max_bytes(max_tokens, RESPONSE_MAX_BYTES))
+        for expense in expenses:
+            listing.add_expense(expense)
+        return listing.render(f"\nNext page cursor: {next_cursor}\n" if next_cursor else "")
 
+    except InvalidCursorError:
+        logger.error(f"Invalid expenses cursor: {cursor}")
+        return "Error: Invalid or expired cursor"
     except Exception as e:
         logger.error(f"Error reading expenses: {str(e)}")
         return f"Error: Unable to retrieve expense data - {str(e)}"
@@ -1,11 +1,37 @@
-import csv
+import asyncio
 import logging
+import os
 from datetime import date
-from enum import Enum
 from pathlib import Path
 from typing import Annotated
 
-from fastmcp import FastMCP
+from expense_import import render_import_result, stream_import
+from expense_pages import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursorError
+from expense_records import (
+    MAX_BULK_EXPENSES,
+    Category,
+    Expense,
+    ExpenseInput,
+    PaymentMethod,
+    to_cents,
+    validate_expense_inputs,
+)
+from expense_render import (
+    DEFAULT_RESPONSE_MAX_BYTES,
+    MIN_RESPONSE_TOKENS,
+    expense_lines,
+    render_bulk_result,
+    render_expense_lines,
+    render_newest_expenses,
+    render_query_results,
+    render_search_results,
+    render_spending_rollup,
+    render_spending_summary,
+    response_max_bytes,
+)
+from expense_repository import create_expense_repository
+from expense_rollups import RollupPeriod
+from fastmcp import Context, FastMCP
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 logger = logging.getLogger("ExpensesMCP")
@@ -13,26 +39,17 @@ logger = logging.getLogger("ExpensesMCP")
 
 SCRIPT_DIR = Path(__file__).parent
 EXPENSES_FILE = SCRIPT_DIR / "expenses.csv"
+EXPENSES_SNAPSHOT_DIR = SCRIPT_DIR / "expenses.snapshot"
+EXPENSES_SQLITE_FILE = SCRIPT_DIR / "expenses.db"
+expense_repository = create_expense_repository(
+    os.getenv("EXPENSES_STORAGE", "csv"), EXPENSES_FILE, EXPENSES_SQLITE_FILE, EXPENSES_SNAPSHOT_DIR
+)
+RESPONSE_MAX_BYTES = int(os.getenv("EXPENSES_RESPONSE_MAX_BYTES", DEFAULT_RESPONSE_MAX_BYTES))
 
 
 mcp = FastMCP("Expenses Tracker")
 
 
-class PaymentMethod(Enum):
-    AMEX = "amex"
-    VISA = "visa"
-    CASH = "cash"
-
-
-class Category(Enum):
-    FOOD = "food"
-    TRANSPORT = "transport"
-    ENTERTAINMENT = "entertainment"
-    SHOPPING = "shopping"
-    GADGET = "gadget"
-    OTHER = "other"
-
-
 @mcp.tool
 async def add_expense(
     date: Annotated[date, "Date of the expense in YYYY-MM-DD format"],
@@ -49,44 +66,211 @@ async def add_expense(
     logger.info(f"Adding expense: ${amount} for {description} on {date_iso}")
 
     try:
-        file_exists = EXPENSES_FILE.exists()
+        result = await expense_repository.add(
+            Expense(
+                date=date,
+                cents=to_cents(amount),
+                category=category.value,
+                description=description,
+                payment_method=payment_method.value,
+            )
+        )
+        if result.error is not None:
+            return f"Error: Expense not added, it is a {result.error}"
+        message = f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        if result.warning is not None:
+            message += f"\nWarning: it is a {result.warning}"
+        return message
+
+    except Exception as e:
+        logger.error(f"Error adding expense: {str(e)}")
+        return "Error: Unable to add expense"
 
-        with open(EXPENSES_FILE, "a", newline="", encoding="utf-8") as file:
-            writer = csv.writer(file)
 
-            if not file_exists:
-                writer.writerow(["date", "amount", "category", "description", "payment_method"])
+@mcp.tool
+async def add_expenses(
+    expenses: Annotated[
+        list[ExpenseInput],
+        "Expenses to add, each with date (YYYY-MM-DD), positive amount, category, description and payment_method",
+    ],
+):
+    """Add several expenses to the expenses.csv file at once, such as the rows of a bank statement."""
+    if len(expenses) > MAX_BULK_EXPENSES:
+        return f"Error: At most {MAX_BULK_EXPENSES} expenses can be added at once"
 
-            writer.writerow([date_iso, amount, category.value, description, payment_method.value])
+    valid, errors = validate_expense_inputs(expenses, Category, PaymentMethod)
+    logger.info(f"Adding {len(valid)} expenses ({len(errors)} invalid)")
 
-        return f"Successfully added expense: ${amount} for {description} on {date_iso}"
+    try:
+        results = await expense_repository.add_many([expense for _, expense in valid])
+        added, warnings = [], []
+        for (position, expense), result in zip(valid, results):
+            if result.error is not None:
+                errors.append((position, str(result.error)))
+                continue
+            added.append(expense)
+            if result.warning is not None:
+                warnings.append((position, result.warning))
+        return render_bulk_result(added, errors, warnings)
 
     except Exception as e:
-        logger.error(f"Error adding expense: {str(e)}")
-        return "Error: Unable to add expense"
+        logger.error(f"Error adding expenses: {str(e)}")
+        return "Error: Unable to add expenses"
+
+
+@mcp.tool
+async def import_expenses(
+    path: Annotated[str, "Path of a CSV or NDJSON (.ndjson, .jsonl) file on the server"],
+    ctx: Context,
+):
+    """Import a large CSV or NDJSON file of expenses into the expenses.csv file, streaming it in chunks."""
+    file_path = Path(path).expanduser()
+    logger.info(f"Importing expenses from {file_path}")
+
+    async def write_chunk(expenses: list[Expense]) -> list[str | None]:
+        results = await expense_repository.add_many(expenses)
+        return [None if result.error is None else str(result.error) for result in results]
+
+    async def on_progress(done: int, total: int) -> None:
+        await ctx.report_progress(done, total)
+
+    try:
+        result = await stream_import(file_path, write_chunk, Category, PaymentMethod, on_progress)
+        return render_import_result(file_path, result)
+
+    except FileNotFoundError:
+        logger.error(f"Import file not found: {file_path}")
+        return f"Error: File not found: {path}"
+    except Exception as e:
+        logger.error(f"Error importing expenses: {str(e)}")
+        return "Error: Unable to import expenses"
+
+
+@mcp.tool
+async def query_expenses(
+    start_date: Annotated[date | None, "Earliest date to include in YYYY-MM-DD format"] = None,
+    end_date: Annotated[date | None, "Latest date to include in YYYY-MM-DD format"] = None,
+    category: Annotated[Category | None, "Only include expenses in this category"] = None,
+    payment_method: Annotated[PaymentMethod | None, "Only include expenses paid with this method"] = None,
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """Find expenses in a date range, optionally filtered by category and payment method, newest first, with a total."""
+    logger.info(f"Querying expenses from {start_date} to {end_date} (category={category}, payment={payment_method})")
+
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        matches = await expense_repository.query(
+            start_date=start_date,
+            end_date=end_date,
+            category=category.value if category else None,
+            payment_method=payment_method.value if payment_method else None,
+        )
+
+        return await asyncio.to_thread(
+            render_query_results, matches, response_max_bytes(max_tokens, RESPONSE_MAX_BYTES)
+        )
+
+    except FileNotFoundError:
+        logger.error("Expenses file not found")
+        return "Error: Expense data unavailable"
+    except Exception as e:
+        logger.error(f"Error querying expenses: {str(e)}")
+        return "Error: Unable to query expenses"
+
+
+@mcp.tool
+async def search_expenses(
+    query: Annotated[str, "Words to look for in expense descriptions, such as 'coffee'; words match as prefixes"],
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """Search expense descriptions and return the matching expenses, most recent first, with their total."""
+    logger.info(f"Searching expenses for {query!r}")
+
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        matches = await expense_repository.search(query)
+        return await asyncio.to_thread(
+            render_search_results, matches, response_max_bytes(max_tokens, RESPONSE_MAX_BYTES)
+        )
+
+    except FileNotFoundError:
+        logger.error("Expenses file not found")
+        return "Error: Expense data unavailable"
+    except Exception as e:
+        logger.error(f"Error searching expenses: {str(e)}")
+        return "Error: Unable to search expenses"
+
+
+async def summarize_expenses(start_date: date | None, end_date: date | None, category: str | None) -> str:
+    """Compute and render a spending summary with the repository's aggregates."""
+    summary, largest = await expense_repository.aggregate(start_date=start_date, end_date=end_date, category=category)
+    return render_spending_summary(summary, largest)
+
+
+@mcp.tool
+async def summarize_spending(
+    start_date: Annotated[date | None, "Earliest date to include in YYYY-MM-DD format"] = None,
+    end_date: Annotated[date | None, "Latest date to include in YYYY-MM-DD format"] = None,
+    category: Annotated[Category | None, "Only include expenses in this category"] = None,
+):
+    """Summarize spending: totals by category, daily/weekly averages, largest expense and payment methods."""
+    logger.info(f"Summarizing spending from {start_date} to {end_date} (category={category})")
+
+    try:
+        return await summarize_expenses(start_date, end_date, category.value if category else None)
+
+    except FileNotFoundError:
+        logger.error("Expenses file not found")
+        return "Error: Expense data unavailable"
+    except Exception as e:
+        logger.error(f"Error summarizing expenses: {str(e)}")
+        return "Error: Unable to summarize expenses"
+
+
+@mcp.tool
+async def get_spending_rollup(
+    period: Annotated[RollupPeriod, "Group spending by day, week (starting on Monday) or month"] = RollupPeriod.MONTH,
+    start_date: Annotated[date | None, "Earliest date to include in YYYY-MM-DD format"] = None,
+    end_date: Annotated[date | None, "Latest date to include in YYYY-MM-DD format"] = None,
+    category: Annotated[Category | None, "Only include expenses in this category"] = None,
+    payment_method: Annotated[PaymentMethod | None, "Only include expenses paid this way"] = None,
+):
+    """Get spending per day, week or month with totals per category, answered from precomputed rollups."""
+    logger.info(f"Spending rollup per {period.value} from {start_date} to {end_date} (category={category})")
+
+    try:
+        rollups = await expense_repository.rollup(
+            period,
+            start_date=start_date,
+            end_date=end_date,
+            category=category.value if category else None,
+            payment_method=payment_method.value if payment_method else None,
+        )
+        return render_spending_rollup(period, rollups, RESPONSE_MAX_BYTES)
+
+    except FileNotFoundError:
+        logger.error("Expenses file not found")
+        return "Error: Expense data unavailable"
+    except Exception as e:
+        logger.error(f"Error computing spending rollup: {str(e)}")
+        return "Error: Unable to compute spending rollup"
 
 
 @mcp.resource("resource://expenses")
 async def get_expenses_data():
-    """Get raw expense data from CSV file"""
+    """Get raw expense data from CSV file, most recent first, within the server's response budget"""
     logger.info("Expenses data accessed")
 
     try:
-        with open(EXPENSES_FILE, newline="", encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            expenses_data = list(reader)
-
-        csv_content = f"Expense data ({len(expenses_data)} entries):\n\n"
-        for expense in expenses_data:
-            csv_content += (
-                f"Date: {expense['date']}, "
-                f"Amount: ${expense['amount']}, "
-                f"Category: {expense['category']}, "
-                f"Description: {expense['description']}, "
-                f"Payment: {expense['payment_method']}\n"
-            )
-
-        return csv_content
+        expenses = await expense_repository.expenses()
+        expense_summary = await asyncio.to_thread(render_newest_expenses, expenses, RESPONSE_MAX_BYTES)
+        if expense_summary is None:
+            return "No expenses found."
+        return expense_summary
 
     except FileNotFoundError:
         logger.error("Expenses file not found")
@@ -96,8 +280,37 @@ async def get_expenses_data():
         return "Error: Unable to retrieve expense data"
 
 
+@mcp.resource("resource://expenses/{cursor}{?limit}")
+async def get_expenses_page(cursor: str, limit: int = DEFAULT_PAGE_SIZE):
+    """Get one page of expense data from CSV file. Use the cursor 'start' for the first page."""
+    logger.info(f"Expenses page accessed (limit={limit})")
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return f"Error: limit must be between 1 and {MAX_PAGE_SIZE}"
+
+    try:
+        expenses_data, next_cursor = await expense_repository.page(cursor, limit)
+
+        page_content = render_expense_lines(expense_lines(expenses_data), len(expenses_data))
+        if next_cursor:
+            page_content += f"\nNext page: resource://expenses/{next_cursor}?limit={limit}\n"
+        else:
+            page_content += "\nNo more expenses.\n"
+        return page_content
+
+    except InvalidCursorError:
+        logger.error(f"Invalid expenses cursor: {cursor}")
+        return "Error: Invalid or expired cursor"
+    except FileNotFoundError:
+        logger.error("Expenses file not found")
+        return "Error: Expense data unavailable"
+    except Exception as e:
+        logger.error(f"Error reading expenses page: {str(e)}")
+        return "Error: Unable to retrieve expense data"
+
+
 @mcp.prompt
-def analyze_spending_prompt(
+async def analyze_spending_prompt(
     category: str | None = None, start_date: str | None = None, end_date: str | None = None
 ) -> str:
     """Generate a prompt to analyze spending patterns with optional filters."""
@@ -112,6 +325,16 @@ def analyze_spending_prompt(
 
     filter_text = f" ({', '.join(filters)})" if filters else ""
 
+    try:
+        spending_summary = await summarize_expenses(
+            date.fromisoformat(start_date) if start_date else None,
+            date.fromisoformat(end_date) if end_date else None,
+            category,
+        )
+    except (ValueError, FileNotFoundError) as e:
+        logger.warning(f"Unable to precompute spending summary: {str(e)}")
+        spending_summary = "Summary unavailable, use the expense data instead."
+
     return f"""
     Please analyze my spending patterns{filter_text} and provide:
 
@@ -122,7 +345,9 @@ def analyze_spending_prompt(
     5. Spending trends or unusual patterns
     6. Recommendations for budget optimization
 
-    Use the expense data to generate actionable insights.
+    Items 1-4 are already computed in the summary below. Use it to generate actionable insights.
+
+{spending_summary}
     """
 
 
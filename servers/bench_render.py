@@ -0,0 +1,124 @@
+"""
+Micro-benchmark of expense listing rendering: string concatenation vs. streamed buffer.
+
+Compares the original implementation (materialize every row, then build the listing
+with `+=` in a loop) against the generator + io.StringIO pipeline in expense_render,
+reporting wall time and peak traced memory for each row count. Documents are decoded
+from JSON lazily as they are iterated, like the Cosmos DB SDK does for each page, so
+the peak memory includes whatever rows an implementation keeps alive.
+
+Note that CPython can often resize the string in place for `s += ...`, which hides the
+quadratic cost; the streamed pipeline does not rely on that implementation detail.
+
+Run with: cd servers && python bench_render.py --rows 10000 100000 1000000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+import uuid
+from collections.abc import AsyncIterator, Callable
+from datetime import date, timedelta
+from typing import Any
+
+from expense_records import to_cents
+from expense_render import BudgetedListing
+
+CATEGORIES = ["food", "transport", "entertainment", "shopping", "gadget", "other"]
+PAYMENT_METHODS = ["amex", "visa", "cash"]
+
+
+def generate_items(count: int) -> list[str]:
+    """Generate synthetic JSON expense documents shaped like the Cosmos DB items."""
+    rng = random.Random(42)
+    start = date(2020, 1, 1)
+    return [
+        json.dumps(
+            {
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "date": (start + timedelta(days=rng.randrange(2000))).isoformat(),
+                "amount": round(rng.uniform(1, 500), 2),
+                "category": rng.choice(CATEGORIES),
+                "description": f"Synthetic expense {i}",
+                "payment_method": rng.choice(PAYMENT_METHODS),
+                "_ts": 1700000000 + i,
+            }
+        )
+        for i in range(count)
+    ]
+
+
+async def iterate(items: list[str]) -> AsyncIterator[dict[str, Any]]:
+    """Decode and yield items one at a time, the way a Cosmos DB query iterator does."""
+    for item in items:
+        yield json.loads(item)
+
+
+async def render_concat(items: list[str]) -> str:
+    """The original rendering: drain the iterator into a list, then concatenate strings."""
+    expenses_data = []
+    async for item in iterate(items):
+        expenses_data.append(item)
+
+    expense_summary = f"Expense data ({len(expenses_data)} entries):\n\n"
+    for expense in expenses_data:
+        expense_summary += (
+            f"Date: {expense.get('date', 'N/A')}, "
+            f"Amount: ${expense.get('amount', 0)}, "
+            f"Category: {expense.get('category', 'N/A')}, "
+            f"Description: {expense.get('description', 'N/A')}, "
+            f"Payment: {expense.get('payment_method', 'N/A')}\n"
+        )
+    return expense_summary
+
+
+def format_item(item: dict[str, Any]) -> str:
+    """Format a Cosmos DB expense document as a single listing line."""
+    return (
+        f"Date: {item.get('date', 'N/A')}, "
+        f"Amount: ${item.get('amount', 0)}, "
+        f"Category: {item.get('category', 'N/A')}, "
+        f"Description: {item.get('description', 'N/A')}, "
+        f"Payment: {item.get('payment_method', 'N/A')}\n"
+    )
+
+
+async def render_streamed(items: list[str]) -> str:
+    """The streamed rendering used by the servers: each row is formatted into the listing as it arrives."""
+    listing = BudgetedListing()
+    async for item in iterate(items):
+        listing.add(format_item(item), item.get("category", "N/A"), to_cents(item.get("amount", 0)))
+    return listing.render()
+
+
+def measure(render: Callable[[list[str]], Any], items: list[str]) -> tuple[float, float]:
+    """Return (seconds, peak MiB) for one render; memory is traced in a separate run."""
+    start = time.perf_counter()
+    asyncio.run(render(items))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    asyncio.run(render(items))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'implementation':>15} {'seconds':>10} {'peak MiB':>10}")
+    for count in args.rows:
+        items = generate_items(count)
+        for name, render in (("concat", render_concat), ("streamed", render_streamed)):
+            elapsed, peak = measure(render, items)
+            print(f"{count:>10} {name:>15} {elapsed:>10.3f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
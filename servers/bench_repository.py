@@ -0,0 +1,191 @@
+"""
+Load test of the MCP tools against each expense repository backend.
+
+Generates a synthetic ledger, then calls the local server's tools through an in-memory
+FastMCP client with a fixed mix of operations (adds, date-range queries, summaries,
+searches and monthly rollups), keeping --concurrency calls in flight. Every backend gets
+the same ledger and the same seeded sequence of calls, and only the repository behind
+the tools changes, so the differences are the backends' own:
+- memory: MemoryExpenseRepository, which has no I/O and so measures the tool overhead.
+- csv, csv-mmap, csv-partitioned, sqlite: LocalExpenseRepository over each storage engine.
+- cosmos: the Cosmos DB container named by the AZURE_COSMOSDB_* environment variables,
+  read and written as is (the synthetic ledger is not loaded into it). Not run by default.
+
+The report shows the calls, p50 and p95 latency of each tool, and the overall throughput.
+The fsync and duplicate policies come from the environment, as in the servers.
+
+Run with: cd servers && python bench_repository.py --rows 100000 --operations 5000
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import basic_mcp_stdio
+from expense_partitions import split_csv
+from expense_records import CSV_HEADER
+from expense_repository import ExpenseRepository, LocalExpenseRepository, create_expense_repository
+from expense_storage import PartitionedExpenseStore, SqliteExpenseStore
+from fastmcp import Client
+
+CATEGORIES = ["food", "transport", "entertainment", "shopping", "gadget", "other"]
+PAYMENT_METHODS = ["amex", "visa", "cash"]
+DESCRIPTIONS = ["Lunch", "Train ticket", "Concert tickets", "Headphones", "Groceries", "Coffee beans"]
+START_DATE = date(2020, 1, 1)
+DAYS = 2000
+OPERATION_WEIGHTS = {
+    "add_expense": 20,
+    "query_expenses": 30,
+    "summarize_spending": 20,
+    "search_expenses": 15,
+    "get_spending_rollup": 15,
+}
+
+
+def generate_file(path: Path, rows: int) -> None:
+    """Write a synthetic expenses CSV file with the given number of rows."""
+    rng = random.Random(42)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(
+            (
+                (START_DATE + timedelta(days=rng.randrange(DAYS))).isoformat(),
+                rng.randrange(100, 50_000) / 100,
+                rng.choice(CATEGORIES),
+                f"{rng.choice(DESCRIPTIONS)} #{i}",
+                rng.choice(PAYMENT_METHODS),
+            )
+            for i in range(rows)
+        )
+
+
+def generate_calls(count: int) -> list[tuple[str, dict[str, Any]]]:
+    """Generate a seeded sequence of (tool name, arguments) calls following OPERATION_WEIGHTS."""
+    rng = random.Random(7)
+    names = rng.choices(list(OPERATION_WEIGHTS), weights=list(OPERATION_WEIGHTS.values()), k=count)
+    calls = []
+    for i, name in enumerate(names):
+        start = START_DATE + timedelta(days=rng.randrange(DAYS - 31))
+        if name == "add_expense":
+            arguments = {
+                "date": (START_DATE + timedelta(days=rng.randrange(DAYS))).isoformat(),
+                "amount": rng.randrange(100, 50_000) / 100,
+                "category": rng.choice(CATEGORIES),
+                "description": f"Load test expense #{i}",
+                "payment_method": rng.choice(PAYMENT_METHODS),
+            }
+        elif name == "query_expenses":
+            arguments = {"start_date": start.isoformat(), "end_date": (start + timedelta(days=30)).isoformat()}
+        elif name == "summarize_spending":
+            arguments = {"category": rng.choice(CATEGORIES)}
+        elif name == "search_expenses":
+            arguments = {"query": rng.choice(DESCRIPTIONS).split()[0].lower()}
+        else:
+            arguments = {"period": "month", "start_date": start.isoformat()}
+        calls.append((name, arguments))
+    return calls
+
+
+def create_repository(backend: str, csv_path: Path) -> ExpenseRepository:
+    """Create the repository of a backend, loaded with the ledger at csv_path (except for Cosmos DB)."""
+    if backend == "cosmos":
+        # Only needed for this backend, and not installed for the local servers
+        from azure.cosmos.aio import CosmosClient
+        from azure.identity.aio import DefaultAzureCredential
+        from expense_cosmos import CosmosExpenseRepository
+        from expense_dedup import DuplicatePolicy
+
+        cosmos_client = CosmosClient(
+            url=f"https://{os.environ['AZURE_COSMOSDB_ACCOUNT']}.documents.azure.com:443/",
+            credential=DefaultAzureCredential(),
+        )
+        cosmos_db = cosmos_client.get_database_client(os.environ["AZURE_COSMOSDB_DATABASE"])
+        return CosmosExpenseRepository(
+            cosmos_db.get_container_client(os.environ["AZURE_COSMOSDB_CONTAINER"]),
+            cosmos_db.get_container_client(os.environ["AZURE_COSMOSDB_ROLLUP_CONTAINER"]),
+            DuplicatePolicy.from_env(),
+        )
+
+    directory = csv_path.parent
+    repository = create_expense_repository(backend, csv_path, directory / "expenses.db", directory / "snapshot")
+    if isinstance(repository, LocalExpenseRepository) and isinstance(repository.store, SqliteExpenseStore):
+        repository.store.import_csv(csv_path)
+    if isinstance(repository, LocalExpenseRepository) and isinstance(repository.store, PartitionedExpenseStore):
+        split_csv(csv_path, repository.store.directory)
+    return repository
+
+
+async def run_calls(
+    repository: ExpenseRepository, calls: list[tuple[str, dict[str, Any]]], concurrency: int
+) -> tuple[dict[str, list[float]], int, float]:
+    """Make the calls through the local server's tools, returning latencies per tool, errors and elapsed seconds."""
+    basic_mcp_stdio.expense_repository = repository
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with Client(basic_mcp_stdio.mcp) as client:
+
+        async def call(name: str, arguments: dict[str, Any]) -> None:
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                result = await client.call_tool(name, arguments)
+                latencies[name].append(time.perf_counter() - start)
+                if result.content[0].text.startswith("Error"):
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(call(name, arguments) for name, arguments in calls))
+        elapsed = time.perf_counter() - start
+    await repository.close()
+    return latencies, errors, elapsed
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return the value below which `fraction` of the values fall."""
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="Expenses in the synthetic ledger")
+    parser.add_argument("--operations", type=int, default=5_000, help="Tool calls per backend")
+    parser.add_argument("--concurrency", type=int, default=16, help="Tool calls in flight at once")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["memory", "csv", "csv-mmap", "csv-partitioned", "sqlite"],
+        choices=["memory", "csv", "csv-mmap", "csv-partitioned", "sqlite", "cosmos"],
+    )
+    args = parser.parse_args()
+
+    calls = generate_calls(args.operations)
+    print(f"{'backend':>10} {'tool':>20} {'calls':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = Path(directory) / "expenses.csv"
+            generate_file(csv_path, args.rows)
+            repository = create_repository(backend, csv_path)
+            latencies, errors, elapsed = asyncio.run(run_calls(repository, calls, args.concurrency))
+
+        for name, values in sorted(latencies.items()):
+            p50, p95 = percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000
+            print(f"{backend:>10} {name:>20} {len(values):>7} {p50:>9.2f} {p95:>9.2f}")
+        print(f"{backend:>10} {'total':>20} {len(calls):>7} {len(calls) / elapsed:>9.0f} ops/s, {errors} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark of aggregating a large expenses CSV file: csv.DictReader vs. the mmap scan.
+
+Generates a synthetic ledger (10M rows by default), then sums the amounts per category
+and counts the rows of one category in three ways:
+- dictreader: csv.DictReader, building a dict of five strings per row.
+- records: parse_expenses, building an Expense record per row like the CSV cache.
+- scan: expense_scan.CsvScan, which maps the file and only parses the amount and
+  category fields (descriptions are never decoded).
+
+Each mode runs in a fresh process, and the report shows wall time and peak RSS.
+
+On a 10M-row (537 MiB) file, one run measured:
+      scan    13.2s   1119 MiB
+dictreader    45.0s     22 MiB
+   records    73.8s   3438 MiB
+The scan's peak RSS includes the mapped file's pages (537 MiB), which are page cache
+shared with other processes rather than private memory.
+
+Run with: cd servers && python bench_scan.py --rows 10000000
+"""
+
+import argparse
+import csv
+import multiprocessing
+import random
+import resource
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+from expense_records import CSV_HEADER, parse_expenses
+from expense_scan import CsvScan
+
+CATEGORIES = ["food", "transport", "entertainment", "shopping", "gadget", "other"]
+PAYMENT_METHODS = ["amex", "visa", "cash"]
+DESCRIPTIONS = ["Lunch", "Train ticket", "Concert, front row", 'The "good" headphones', "Groceries"]
+
+
+def generate_file(path: Path, rows: int) -> None:
+    """Write a synthetic expenses CSV file with the given number of rows."""
+    rng = random.Random(42)
+    start = date(2015, 1, 1)
+    dates = [(start + timedelta(days=day)).isoformat() for day in range(4000)]
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        for block in range(0, rows, 100_000):
+            writer.writerows(
+                (
+                    rng.choice(dates),
+                    rng.randrange(100, 50_000) / 100,
+                    rng.choice(CATEGORIES),
+                    f"{rng.choice(DESCRIPTIONS)} #{i}",
+                    rng.choice(PAYMENT_METHODS),
+                )
+                for i in range(block, min(rows, block + 100_000))
+            )
+
+
+def aggregate_dictreader(path: Path) -> tuple[dict[str, int], int]:
+    totals: dict[str, int] = defaultdict(int)
+    food = 0
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            totals[row["category"]] += round(float(row["amount"]) * 100)
+            food += row["category"] == "food"
+    return dict(totals), food
+
+
+def aggregate_records(path: Path) -> tuple[dict[str, int], int]:
+    totals: dict[str, int] = defaultdict(int)
+    with open(path, newline="", encoding="utf-8") as file:
+        expenses = parse_expenses(file, str(path))
+    for expense in expenses:
+        totals[expense.category] += expense.cents
+    return dict(totals), sum(expense.category == "food" for expense in expenses)
+
+
+def aggregate_scan(path: Path) -> tuple[dict[str, int], int]:
+    scan = CsvScan(path)
+    categories, names = scan.categories()
+    totals = np.bincount(categories, weights=scan.cents(), minlength=len(names))
+    food = int((categories == names.index("food")).sum())
+    return {name: int(round(totals[code])) for code, name in enumerate(names)}, food
+
+
+MODES = {"dictreader": aggregate_dictreader, "records": aggregate_records, "scan": aggregate_scan}
+
+
+def run_mode(mode: str, path: Path, results: multiprocessing.Queue) -> None:
+    start = time.perf_counter()
+    totals, food = MODES[mode](path)
+    elapsed = time.perf_counter() - start
+    peak_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((elapsed, peak_mib, sum(totals.values()), food))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Rows in the generated file")
+    parser.add_argument("--path", type=Path, help="Existing or generated file (default: a temporary file)")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    path = args.path or Path(tempfile.gettempdir()) / f"expenses-bench-{args.rows}.csv"
+    if not path.exists():
+        print(f"Generating {args.rows:,} rows into {path}...")
+        generate_file(path, args.rows)
+    print(f"{path}: {path.stat().st_size / 2**20:,.0f} MiB\n")
+
+    print(f"{'mode':>10} {'time':>9} {'peak RSS':>10} {'total':>16} {'food rows':>10}")
+    for mode in args.modes:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_mode, args=(mode, path, results))
+        process.start()
+        elapsed, peak_mib, total_cents, food = results.get()
+        process.join()
+        print(f"{mode:>10} {elapsed:>8.2f}s {peak_mib:>6.0f} MiB {total_cents / 100:>16,.2f} {food:>10,}")
+
+
+if __name__ == "__main__":
+    main()
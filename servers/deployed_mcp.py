@@ -2,9 +2,7 @@
 
 import logging
 import os
-import uuid
 from datetime import date
-from enum import Enum
 from typing import Annotated
 
 import logfire
@@ -13,6 +11,28 @@ from azure.cosmos.aio import CosmosClient
 from azure.identity.aio import DefaultAzureCredential, ManagedIdentityCredential
 from azure.monitor.opentelemetry import configure_azure_monitor
 from dotenv import load_dotenv
+from expense_cosmos import CosmosExpenseRepository
+from expense_dedup import DuplicateExpenseError, DuplicatePolicy
+from expense_pages import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursorError
+from expense_records import (
+    MAX_BULK_EXPENSES,
+    Category,
+    Expense,
+    ExpenseInput,
+    PaymentMethod,
+    to_cents,
+    validate_expense_inputs,
+)
+from expense_render import (
+    DEFAULT_RESPONSE_MAX_BYTES,
+    MIN_RESPONSE_TOKENS,
+    BudgetedListing,
+    render_bulk_result,
+    render_search_results,
+    render_spending_rollup,
+    response_max_bytes,
+)
+from expense_rollups import RollupPeriod
 from fastmcp import FastMCP
 from opentelemetry.instrumentation.starlette import StarletteInstrumentor
 from starlette.responses import JSONResponse
@@ -43,7 +63,10 @@ elif opentelemetry_platform == "logfire" and os.getenv("LOGFIRE_TOKEN"):
 AZURE_COSMOSDB_ACCOUNT = os.environ["AZURE_COSMOSDB_ACCOUNT"]
 AZURE_COSMOSDB_DATABASE = os.environ["AZURE_COSMOSDB_DATABASE"]
 AZURE_COSMOSDB_CONTAINER = os.environ["AZURE_COSMOSDB_CONTAINER"]
+AZURE_COSMOSDB_ROLLUP_CONTAINER = os.environ["AZURE_COSMOSDB_ROLLUP_CONTAINER"]
 AZURE_CLIENT_ID = os.getenv("AZURE_CLIENT_ID", "")
+RESPONSE_MAX_BYTES = int(os.getenv("EXPENSES_RESPONSE_MAX_BYTES", DEFAULT_RESPONSE_MAX_BYTES))
+DUPLICATE_POLICY = DuplicatePolicy.from_env()
 
 
 # Configure Cosmos DB client and container for expenses data
@@ -58,27 +81,19 @@ cosmos_client = CosmosClient(
 )
 cosmos_db = cosmos_client.get_database_client(AZURE_COSMOSDB_DATABASE)
 cosmos_container = cosmos_db.get_container_client(AZURE_COSMOSDB_CONTAINER)
+# The expenses container is partitioned by /category
+expense_repository = CosmosExpenseRepository(
+    cosmos_container,
+    cosmos_db.get_container_client(AZURE_COSMOSDB_ROLLUP_CONTAINER),
+    DUPLICATE_POLICY,
+    partition_key="category",
+)
 logger.info(f"Connected to Cosmos DB: {AZURE_COSMOSDB_ACCOUNT}")
 
 # Create the MCP server with OpenTelemetry middleware
 mcp = FastMCP("Expenses Tracker", middleware=[OpenTelemetryMiddleware("ExpensesMCP")])
 
 
-class PaymentMethod(Enum):
-    AMEX = "amex"
-    VISA = "visa"
-    CASH = "cash"
-
-
-class Category(Enum):
-    FOOD = "food"
-    TRANSPORT = "transport"
-    ENTERTAINMENT = "entertainment"
-    SHOPPING = "shopping"
-    GADGET = "gadget"
-    OTHER = "other"
-
-
 @mcp.tool
 async def add_expense(
     date: Annotated[date, "Date of the expense in YYYY-MM-DD format"],
@@ -95,18 +110,22 @@ async def add_expense(
     logger.info(f"Adding expense: ${amount} for {description} on {date_iso}")
 
     try:
-        expense_id = str(uuid.uuid4())
-        expense_item = {
-            "id": expense_id,
-            "date": date_iso,
-            "amount": amount,
-            "category": category.value,
-            "description": description,
-            "payment_method": payment_method.value,
-        }
-
-        await cosmos_container.create_item(body=expense_item)
-        return f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        expense = Expense(
+            date=date,
+            cents=to_cents(amount),
+            category=category.value,
+            description=description,
+            payment_method=payment_method.value,
+        )
+        result = await expense_repository.add(expense)
+        if isinstance(result.error, DuplicateExpenseError):
+            return f"Error: Expense not added, it is a {result.error}"
+        if result.error is not None:
+            raise result.error
+        message = f"Successfully added expense: ${amount} for {description} on {date_iso}"
+        if result.warning is not None:
+            message += f"\nWarning: it is a {result.warning}"
+        return message
 
     except Exception as e:
         logger.error(f"Error adding expense: {str(e)}")
@@ -114,32 +133,113 @@ async def add_expense(
 
 
 @mcp.tool
-async def get_expenses_data():
-    """Get raw expense data from Cosmos DB as CSV text."""
-    logger.info("Expenses data accessed")
+async def add_expenses(
+    expenses: Annotated[
+        list[ExpenseInput],
+        "Expenses to add, each with date (YYYY-MM-DD), positive amount, category, description and payment_method",
+    ],
+):
+    """Add several expenses to Cosmos DB at once, such as the rows of a bank statement."""
+    if len(expenses) > MAX_BULK_EXPENSES:
+        return f"Error: At most {MAX_BULK_EXPENSES} expenses can be added at once"
+
+    valid, errors = validate_expense_inputs(expenses, Category, PaymentMethod)
+    logger.info(f"Adding {len(valid)} expenses ({len(errors)} invalid)")
 
     try:
-        query = "SELECT * FROM c ORDER BY c.date DESC"
-        expenses_data = []
+        results = await expense_repository.add_many([expense for _, expense in valid])
+        added, warnings = [], []
+        for (position, expense), result in zip(valid, results):
+            if result.error is not None:
+                errors.append((position, str(result.error)))
+                continue
+            added.append(expense)
+            if result.warning is not None:
+                warnings.append((position, result.warning))
+        return render_bulk_result(added, errors, warnings)
 
-        async for item in cosmos_container.query_items(query=query):
-            expenses_data.append(item)
+    except Exception as e:
+        logger.error(f"Error adding expenses: {str(e)}")
+        return f"Error: Unable to add expenses - {str(e)}"
 
-        if not expenses_data:
-            return "No expenses found."
 
-        expense_summary = f"Expense data ({len(expenses_data)} entries):\n\n"
-        for expense in expenses_data:
-            expense_summary += (
-                f"Date: {expense.get('date', 'N/A')}, "
-                f"Amount: ${expense.get('amount', 0)}, "
-                f"Category: {expense.get('category', 'N/A')}, "
-                f"Description: {expense.get('description', 'N/A')}, "
-                f"Payment: {expense.get('payment_method', 'N/A')}\n"
-            )
+@mcp.tool
+async def search_expenses(
+    query: Annotated[str, "Words to look for in expense descriptions, such as 'coffee'; words match as prefixes"],
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """Search expense descriptions and return the matching expenses, most recent first, with their total."""
+    logger.info(f"Searching expenses for {query!r}")
+
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        matches = await expense_repository.search(query)
+        return render_search_results(matches, response_max_bytes(max_tokens, RESPONSE_MAX_BYTES))
+
+    except Exception as e:
+        logger.error(f"Error searching expenses: {str(e)}")
+        return f"Error: Unable to search expenses - {str(e)}"
+
+
+@mcp.tool
+async def get_spending_rollup(
+    period: Annotated[RollupPeriod, "Group spending by day, week (starting on Monday) or month"] = RollupPeriod.MONTH,
+    start_date: Annotated[date | None, "Earliest date to include in YYYY-MM-DD format"] = None,
+    end_date: Annotated[date | None, "Latest date to include in YYYY-MM-DD format"] = None,
+    category: Annotated[Category | None, "Only include expenses in this category"] = None,
+    payment_method: Annotated[PaymentMethod | None, "Only include expenses paid this way"] = None,
+):
+    """Get spending per day, week or month with totals per category, answered from precomputed rollups."""
+    logger.info(f"Spending rollup per {period.value} from {start_date} to {end_date} (category={category})")
+
+    try:
+        rollups = await expense_repository.rollup(
+            period,
+            start_date=start_date,
+            end_date=end_date,
+            category=category.value if category else None,
+            payment_method=payment_method.value if payment_method else None,
+        )
+        return render_spending_rollup(period, rollups, RESPONSE_MAX_BYTES)
+
+    except Exception as e:
+        logger.error(f"Error computing spending rollup: {str(e)}")
+        return f"Error: Unable to compute spending rollup - {str(e)}"
+
+
+@mcp.tool
+async def get_expenses_data(
+    limit: Annotated[int, "Maximum number of expenses to return"] = DEFAULT_PAGE_SIZE,
+    cursor: Annotated[str | None, "Cursor returned by a previous call, to fetch the next page"] = None,
+    max_tokens: Annotated[int | None, "Approximate token budget of the response (default: the server's limit)"] = None,
+):
+    """
+    Get one page of raw expense data from Cosmos DB, newest first, as one "Date: ..., Amount: ..." line per expense.
+
+    Rows that do not fit in the response budget are summarized per category; request a smaller limit to list them.
+    """
+    logger.info(f"Expenses data accessed (limit={limit}, max_tokens={max_tokens})")
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return f"Error: limit must be between 1 and {MAX_PAGE_SIZE}"
+    if max_tokens is not None and max_tokens < MIN_RESPONSE_TOKENS:
+        return f"Error: max_tokens must be at least {MIN_RESPONSE_TOKENS}"
+
+    try:
+        expenses, next_cursor = await expense_repository.page(cursor, limit)
+        if not expenses:
+            return "No expenses found."
 
-        return expense_summary
+        listing = BudgetedListing(response_max_bytes(max_tokens, RESPONSE_MAX_BYTES))
+        for expense in expenses:
+            listing.add_expense(expense)
+        return listing.render(f"\nNext page cursor: {next_cursor}\n" if next_cursor else "")
 
+    except InvalidCursorError:
+        logger.error(f"Invalid expenses cursor: {cursor}")
+        return "Error: Invalid or expired cursor"
     except Exception as e:
         logger.error(f"Error reading expenses: {str(e)}")
         return f"Error: Unable to retrieve expense data - {str(e)}"
@@ -0,0 +1,286 @@
+"""
+In-memory cache of the expenses CSV file shared by the local MCP servers.
+
+The CSV file is parsed once and kept in memory as a compact ExpenseTable.
+Every read compares the file's inode, size and modification time against the
+values seen at the last read. When they changed, the cache first assumes rows
+were appended: it checks that the bytes it already parsed are unchanged, against
+a running CRC-32 of them kept up to date on every load and append, and parses only
+the bytes after the last parsed offset. A read after another process appended thus
+checksums the file once, which is much cheaper than parsing it, and parses only the
+new rows. Only when the file was replaced, truncated or rewritten (different inode,
+smaller size or any different byte) is it fully re-parsed. Appends made through the
+cache update the in-memory records and the checksum directly.
+
+If a columnar snapshot of the file is available (see expense_snapshot), loading
+memory-maps it and only parses the CSV rows appended after the snapshot was taken.
+
+Several processes (for example uvicorn workers) can share the file: appends take an
+exclusive advisory lock and write whole rows with a single write, and loads take a
+shared lock (see expense_locks). The (inode, size, mtime) signature is the change
+signal between processes: each read stats the file, which is cheap, and a worker
+parses the rows appended by other workers on its next read.
+
+Derived structures (such as the date index in expense_index) can be registered with
+the cache; they are rebuilt whenever the file is re-parsed and updated row by row
+on every append, so they always describe exactly the cached records.
+"""
+
+import csv
+import io
+import logging
+import os
+import threading
+import zlib
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Protocol, overload
+
+from expense_locks import file_lock
+from expense_records import CSV_HEADER, Expense, iter_expenses, parse_expenses
+from expense_snapshot import ExpenseSnapshot, prefix_checksum
+from expense_table import ExpenseTable
+
+logger = logging.getLogger(__name__)
+
+_HEADER_LINE = (",".join(CSV_HEADER) + "\r\n").encode("utf-8")
+
+
+class CacheIndex(Protocol):
+    """A derived structure kept in sync with the records of an ExpenseCache."""
+
+    def rebuild(self, expenses: "ExpenseLog") -> None:
+        """Rebuild the structure from scratch after the file was (re)loaded."""
+        ...
+
+    def add(self, row_id: int, expense: Expense) -> None:
+        """Add one appended expense, where row_id is its position in the cached records."""
+        ...
+
+
+class ExpenseLog(Sequence[Expense]):
+    """The cached expenses: an immutable base (such as a snapshot) followed by a table of parsed and appended rows."""
+
+    def __init__(self, base: Sequence[Expense] = (), tail: ExpenseTable | None = None):
+        self.base = base
+        self.tail = tail if tail is not None else ExpenseTable()
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.tail)
+
+    @overload
+    def __getitem__(self, index: int) -> Expense: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Expense]: ...
+
+    def __getitem__(self, index: int | slice) -> Expense | list[Expense]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < len(self.base):
+            return self.base[index]
+        return self.tail[index - len(self.base)]
+
+    def __iter__(self) -> Iterator[Expense]:
+        yield from self.base
+        yield from self.tail
+
+    def append(self, expense: Expense) -> None:
+        self.tail.append(expense)
+
+
+def file_signature(stat: os.stat_result) -> tuple[int, int, int]:
+    """Return the (inode, size, mtime) triple used to detect changes to the file."""
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def append_expenses(
+    path: Path, expenses: list[Expense], fsync: bool = False
+) -> tuple[tuple[int, int, int], tuple[int, int, int], bytes]:
+    """
+    Append expenses to a CSV file with a single write under an exclusive lock, writing the header if it is empty.
+
+    If the file is removed while waiting for the lock (such as a compacted month partition,
+    see expense_partitions), the expenses are appended to a new file at the same path instead.
+
+    Returns:
+        The file's signature before and after the write, and the bytes written.
+    """
+    buffer = io.StringIO(newline="")
+    csv.writer(buffer).writerows(expense.to_row() for expense in expenses)
+    rows = buffer.getvalue().encode("utf-8")
+
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            result = _append_locked(fd, rows, fsync)
+        finally:
+            os.close(fd)
+        if result is not None:
+            return result
+
+
+def _append_locked(
+    fd: int, rows: bytes, fsync: bool
+) -> tuple[tuple[int, int, int], tuple[int, int, int], bytes] | None:
+    """Append rows to an open file under an exclusive lock, or return None if the file was removed meanwhile."""
+    # Other processes may append to the same file, so the size is only meaningful under the lock
+    with file_lock(fd, exclusive=True):
+        stat = os.fstat(fd)
+        if stat.st_nlink == 0:
+            return None
+        before = file_signature(stat)
+        data = rows if before[1] else _HEADER_LINE + rows
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+        if fsync:
+            os.fsync(fd)
+        after = file_signature(os.fstat(fd))
+    return before, after, data
+
+
+class ExpenseCache:
+    """
+    Process-wide cache of the expenses stored in a CSV file.
+
+    Usage:
+        expense_cache = ExpenseCache(Path("expenses.csv"), snapshot_dir=Path("expenses.snapshot"))
+        expenses = expense_cache.expenses()
+        expense_cache.append(Expense(...))
+        expense_cache.append_many([Expense(...), Expense(...)], fsync=True)
+
+        # Query registered indexes while holding the cache lock
+        with expense_cache.locked() as expenses:
+            matches = [expenses[row_id] for row_id in date_index.query(...)]
+    """
+
+    def __init__(self, path: Path, indexes: Sequence[CacheIndex] = (), snapshot_dir: Path | None = None):
+        self.path = path
+        self.indexes = list(indexes)
+        self.snapshot_dir = snapshot_dir
+        self._lock = threading.Lock()
+        self._expenses = ExpenseLog()
+        self._signature: tuple[int, int, int] | None = None
+        # How far the file has been parsed, and the CRC-32 of the bytes up to there
+        self._offset = 0
+        self._checksum = 0
+
+    def expenses(self) -> ExpenseLog:
+        """
+        Return all cached expenses, reading the file first if it changed on disk.
+
+        Raises:
+            FileNotFoundError: If the CSV file does not exist.
+        """
+        with self.locked() as expenses:
+            return expenses
+
+    @contextmanager
+    def locked(self) -> Iterator[ExpenseLog]:
+        """
+        Refresh the cache and hold its lock, so registered indexes can be queried consistently.
+
+        Raises:
+            FileNotFoundError: If the CSV file does not exist.
+        """
+        with self._lock:
+            stat = os.stat(self.path)
+            if file_signature(stat) != self._signature and not self._read_appended(stat):
+                self._load()
+            yield self._expenses
+
+    def append(self, expense: Expense) -> None:
+        """Append an expense to the CSV file and to the in-memory records."""
+        self.append_many([expense])
+
+    def append_many(self, expenses: list[Expense], fsync: bool = False) -> None:
+        """
+        Append expenses to the CSV file with a single write and add them to the in-memory records.
+
+        Args:
+            expenses: The expenses to append, in order.
+            fsync: Whether to flush the file to stable storage before returning.
+        """
+        with self._lock:
+            before, after, data = append_expenses(self.path, expenses, fsync)
+
+            if before[1] == 0:
+                self._replace(ExpenseLog(tail=ExpenseTable(expenses)), after)
+                self._advance(data)
+            elif before == self._signature and before[1] == self._offset:
+                # The file was unchanged since our last read, so the in-memory copy stays exact
+                self._add(expenses)
+                self._signature = after
+                self._advance(data)
+            # Otherwise someone else appended first; the next read parses their rows and ours
+
+    def _read_appended(self, stat: os.stat_result) -> bool:
+        """
+        Parse only the rows appended since the last read.
+
+        Returns:
+            False if the file was truncated or rewritten since the last read, so it must be fully reloaded.
+        """
+        if self._signature is None or stat.st_ino != self._signature[0] or stat.st_size < self._offset:
+            return False
+        with open(self.path, "rb") as file, file_lock(file):
+            if prefix_checksum(file, self._offset) != self._checksum:
+                return False
+            file.seek(self._offset)
+            appended = file.read()
+            signature = file_signature(os.fstat(file.fileno()))
+
+        # Rows written without the lock may still be incomplete; leave them for the next read
+        appended = appended[: appended.rfind(b"\n") + 1]
+        expenses = parse_expenses(io.StringIO(appended.decode("utf-8"), newline=""), str(self.path), has_header=False)
+        self._add(expenses)
+        self._signature = signature
+        self._advance(appended)
+        if expenses:
+            logger.debug(f"Read {len(expenses)} appended expenses from {self.path}")
+        return True
+
+    def _load(self) -> None:
+        """Load the CSV file into memory, starting from the snapshot when one is available."""
+        snapshot = ExpenseSnapshot.open(self.snapshot_dir, self.path) if self.snapshot_dir else None
+        with open(self.path, "rb") as file, file_lock(file):
+            start = snapshot.csv_offset if snapshot is not None else 0
+            file.seek(start)
+            text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+            tail = ExpenseTable(iter_expenses(text, str(self.path), has_header=snapshot is None))
+            # Taken under the lock, so they match exactly the bytes parsed
+            signature = file_signature(os.fstat(file.fileno()))
+            checksum = prefix_checksum(file, signature[1], start, snapshot.csv_checksum if snapshot is not None else 0)
+
+        self._replace(ExpenseLog(snapshot if snapshot is not None else (), tail), signature)
+        self._offset = signature[1]
+        self._checksum = checksum
+        if snapshot is not None:
+            logger.info(f"Loaded {len(snapshot)} expenses from snapshot and {len(tail)} from {self.path}")
+        else:
+            logger.info(f"Loaded {len(tail)} expenses from {self.path}")
+
+    def _add(self, expenses: list[Expense]) -> None:
+        """Add expenses to the in-memory records and every registered index."""
+        for expense in expenses:
+            for index in self.indexes:
+                index.add(len(self._expenses), expense)
+            self._expenses.append(expense)
+
+    def _advance(self, data: bytes) -> None:
+        """Record that `data` was parsed from the current offset."""
+        self._offset += len(data)
+        self._checksum = zlib.crc32(data, self._checksum)
+
+    def _replace(self, expenses: ExpenseLog, signature: tuple[int, int, int]) -> None:
+        """Replace the cached records and rebuild every registered index."""
+        self._expenses = expenses
+        self._signature = signature
+        self._offset = 0
+        self._checksum = 0
+        for index in self.indexes:
+            index.rebuild(expenses)
@@ -0,0 +1,241 @@
+"""
+Expense statistics materialized from the Cosmos DB change feed.
+
+A background consumer reads the expense items created in the expenses container from
+its change feed, page by page, and folds them into a single statistics document: the
+count and total cents of the expenses per category, per month and per payment method.
+Tools that need these statistics read that one document with a point read, so their
+cost stays constant however many expenses and users there are, instead of scanning the
+container on every call.
+
+The document also holds the change feed continuation token of the last page folded into
+it, and both are written together, so a restarted consumer resumes right after the last
+page it recorded. Every server replica can run a consumer: each page is written back
+with the document's etag as a precondition, so when two replicas read the same page only
+the first write wins, and the other reloads the document and goes on from there. No
+page is counted twice.
+
+Expense items are only ever created, so counting each item the change feed delivers is
+exact; items updated in place would be counted again.
+
+Only the Entra server runs a consumer. The statistics span every user's expenses, and
+the Entra server is the one that can restrict them to an admin group (get_expense_stats);
+when the Keycloak server shares its expenses container, its expenses are counted too.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from typing import Any
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from expense_cosmos import expense_from_item
+from expense_records import Expense, format_cents
+
+logger = logging.getLogger(__name__)
+
+STATS_DOCUMENT_ID = "expense-stats"
+STATS_SCOPE = "stats"
+CHANGE_FEED_POLL_SECONDS = 5.0
+CHANGE_FEED_PAGE_SIZE = 1000
+
+
+def _normalize(value: str) -> str:
+    """Normalize a category or payment method so 'AMEX' and 'amex' share a total."""
+    return value.strip().casefold()
+
+
+def _add(totals: dict[str, list[int]], key: str, cents: int) -> None:
+    counts = totals.setdefault(key, [0, 0])
+    counts[0] += 1
+    counts[1] += cents
+
+
+@dataclass
+class ExpenseStatistics:
+    """Expense counts and totals maintained from the change feed. Totals are [count, cents] pairs."""
+
+    by_category: dict[str, list[int]] = field(default_factory=dict)
+    by_month: dict[str, list[int]] = field(default_factory=dict)
+    by_payment_method: dict[str, list[int]] = field(default_factory=dict)
+    continuation: str | None = None
+    """Change feed continuation token after the last page folded in, or None to start from the beginning."""
+    updated_at: str | None = None
+    etag: str | None = None
+    """The document's etag when it was read, or None if it does not exist yet."""
+
+    @property
+    def count(self) -> int:
+        return sum(count for count, _ in self.by_category.values())
+
+    @property
+    def total_cents(self) -> int:
+        return sum(cents for _, cents in self.by_category.values())
+
+    def add(self, expense: Expense) -> None:
+        """Count one expense in its category, month and payment method."""
+        _add(self.by_category, _normalize(expense.category), expense.cents)
+        _add(self.by_month, f"{expense.date:%Y-%m}", expense.cents)
+        _add(self.by_payment_method, _normalize(expense.payment_method), expense.cents)
+
+    def to_item(self) -> dict[str, Any]:
+        """Convert the statistics to the body of the statistics document."""
+        return {
+            "id": STATS_DOCUMENT_ID,
+            "scope": STATS_SCOPE,
+            "by_category": self.by_category,
+            "by_month": self.by_month,
+            "by_payment_method": self.by_payment_method,
+            "continuation": self.continuation,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_item(cls, item: dict[str, Any]) -> "ExpenseStatistics":
+        """Read the statistics from the statistics document."""
+        return cls(
+            by_category=item.get("by_category", {}),
+            by_month=item.get("by_month", {}),
+            by_payment_method=item.get("by_payment_method", {}),
+            continuation=item.get("continuation"),
+            updated_at=item.get("updated_at"),
+            etag=item.get("_etag"),
+        )
+
+
+def render_expense_statistics(statistics: ExpenseStatistics) -> str:
+    """Render the statistics per category, payment method and month, with when they were last updated."""
+    lines = [
+        f"Expense Statistics ({statistics.count} expenses, ${format_cents(statistics.total_cents)} total,"
+        f" updated {statistics.updated_at}):"
+    ]
+    for title, totals, order in (
+        ("Per category", statistics.by_category, lambda entry: (-entry[1][0], entry[0])),
+        ("Per payment method", statistics.by_payment_method, lambda entry: (-entry[1][0], entry[0])),
+        ("Per month", statistics.by_month, lambda entry: entry[0]),
+    ):
+        lines.append(f"\n{title}:")
+        lines.extend(
+            f"- {key}: {count} expenses, ${format_cents(cents)}"
+            for key, (count, cents) in sorted(totals.items(), key=order)
+        )
+    return "\n".join(lines) + "\n"
+
+
+class ChangeFeedStatsConsumer:
+    """
+    Keeps the statistics document in the stats container up to date from the expenses container's change feed.
+
+    Usage:
+        stats_consumer = ChangeFeedStatsConsumer(cosmos_container, rollup_container)
+        stats_consumer.start()
+        statistics = await stats_consumer.read()
+        await stats_consumer.stop()
+    """
+
+    def __init__(
+        self,
+        container,
+        stats_container,
+        poll_seconds: float = CHANGE_FEED_POLL_SECONDS,
+        page_size: int = CHANGE_FEED_PAGE_SIZE,
+    ):
+        self.container = container
+        self.stats_container = stats_container
+        self.poll_seconds = poll_seconds
+        self.page_size = page_size
+        self._task: asyncio.Task | None = None
+
+    async def read(self) -> ExpenseStatistics | None:
+        """Return the current statistics with a point read, or None if nothing has been recorded yet."""
+        try:
+            item = await self.stats_container.read_item(item=STATS_DOCUMENT_ID, partition_key=STATS_SCOPE)
+        except CosmosResourceNotFoundError:
+            return None
+        return ExpenseStatistics.from_item(item)
+
+    async def poll(self) -> int:
+        """
+        Fold every change since the last checkpoint into the statistics document, one page at a time.
+
+        Returns:
+            The number of expense items counted by this call.
+        """
+        statistics = await self.read() or ExpenseStatistics()
+        if statistics.continuation is not None:
+            feed = self.container.query_items_change_feed(
+                continuation=statistics.continuation, max_item_count=self.page_size
+            )
+        else:
+            feed = self.container.query_items_change_feed(start_time="Beginning", max_item_count=self.page_size)
+
+        counted = 0
+        pages = feed.by_page()
+        async for page in pages:
+            items = [item async for item in page]
+            for item in items:
+                try:
+                    statistics.add(expense_from_item(item))
+                except ValueError as e:
+                    logger.warning(f"Skipping malformed expense item in the change feed: {e}")
+            statistics.continuation = pages.continuation_token
+            statistics.updated_at = datetime.now(UTC).isoformat()
+            if not await self._checkpoint(statistics):
+                logger.info("Expense statistics were advanced by another consumer, reloading")
+                return counted
+            counted += len(items)
+        return counted
+
+    def start(self) -> None:
+        """Start polling the change feed in a background task, unless it is already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="expense-stats-consumer")
+
+    async def stop(self) -> None:
+        """Stop the background task and wait for it to finish."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """Poll the change feed until the task is cancelled, waiting poll_seconds after catching up."""
+        while True:
+            try:
+                counted = await self.poll()
+                if counted:
+                    logger.info(f"Counted {counted} expenses from the change feed")
+            except Exception as e:
+                logger.error(f"Error reading the expenses change feed: {str(e)}")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _checkpoint(self, statistics: ExpenseStatistics) -> bool:
+        """
+        Write the statistics and their continuation token, if nobody else wrote the document since it was read.
+
+        Returns:
+            False if another consumer wrote it first, in which case these statistics are discarded.
+        """
+        try:
+            if statistics.etag is None:
+                item = await self.stats_container.create_item(body=statistics.to_item())
+            else:
+                item = await self.stats_container.replace_item(
+                    item=STATS_DOCUMENT_ID,
+                    body=statistics.to_item(),
+                    etag=statistics.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+        except (CosmosAccessConditionFailedError, CosmosResourceExistsError):
+            return False
+        statistics.etag = item.get("_etag")
+        return True
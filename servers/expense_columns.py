@@ -0,0 +1,236 @@
+"""
+Columnar, NumPy-backed copy of the cached expenses for vectorized aggregation.
+
+Each expense is stored across four parallel arrays: the date as a day ordinal, the amount
+in integer cents, and dictionary-encoded category and payment method codes. Spending
+summaries are computed with boolean masks and np.bincount over those arrays, so every
+aggregate is a handful of vectorized passes instead of a Python loop over row objects.
+The arrays grow by doubling, so appending one expense is amortized O(1), and columns
+loaded from a snapshot are copied array to array without materializing any records.
+"""
+
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import date
+
+import numpy as np
+from expense_cache import ExpenseLog
+from expense_records import Expense
+from expense_snapshot import ExpenseSnapshot
+from expense_table import ExpenseTable
+
+_INITIAL_CAPACITY = 1024
+
+
+@dataclass
+class SpendingSummary:
+    """Aggregates over the expenses matching a set of filters. Amounts are in cents."""
+
+    count: int
+    total_cents: int
+    first_date: date | None
+    last_date: date | None
+    daily_average_cents: float
+    weekly_average_cents: float
+    largest_row_id: int | None
+    by_category: dict[str, int] = field(default_factory=dict)
+    by_payment_method: dict[str, tuple[int, int]] = field(default_factory=dict)
+
+
+def _normalize(value: str) -> str:
+    """Normalize a category or payment method before dictionary-encoding it."""
+    return value.strip().casefold()
+
+
+class ExpenseColumns:
+    """
+    Struct-of-arrays view of the cached expenses.
+
+    Register it with an ExpenseCache to keep it in sync with the cached records:
+        expense_columns = ExpenseColumns()
+        expense_cache = ExpenseCache(EXPENSES_FILE, indexes=[expense_columns])
+    """
+
+    def __init__(self):
+        self._category_codes: dict[str, int] = {}
+        self._payment_method_codes: dict[str, int] = {}
+        self._allocate(0)
+
+    def rebuild(self, expenses: Sequence[Expense]) -> None:
+        """Rebuild every column from scratch, copying snapshot columns directly when available."""
+        self._category_codes = {}
+        self._payment_method_codes = {}
+        self._allocate(len(expenses))
+
+        rows = expenses
+        if isinstance(expenses, ExpenseLog) and isinstance(expenses.base, ExpenseSnapshot):
+            self._copy_snapshot(expenses.base)
+            rows = expenses.tail
+        if isinstance(rows, ExpenseTable):
+            self._copy_table(rows)
+            return
+
+        start, count = self._size, len(rows)
+        end = start + count
+        self._days[start:end] = np.fromiter((e.date.toordinal() for e in rows), np.int32, count)
+        self._cents[start:end] = np.fromiter((e.cents for e in rows), np.int64, count)
+        self._categories[start:end] = np.fromiter(
+            (_encode(self._category_codes, e.category) for e in rows), np.int16, count
+        )
+        self._payment_methods[start:end] = np.fromiter(
+            (_encode(self._payment_method_codes, e.payment_method) for e in rows), np.int16, count
+        )
+        self._size = end
+
+    def add(self, row_id: int, expense: Expense) -> None:
+        """Append one expense, doubling the column capacity when it is full."""
+        if self._size == len(self._days):
+            self._grow(max(_INITIAL_CAPACITY, 2 * self._size))
+        self._days[self._size] = expense.date.toordinal()
+        self._cents[self._size] = expense.cents
+        self._categories[self._size] = _encode(self._category_codes, expense.category)
+        self._payment_methods[self._size] = _encode(self._payment_method_codes, expense.payment_method)
+        self._size += 1
+
+    def summarize(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> SpendingSummary:
+        """
+        Compute spending aggregates over the expenses matching the given filters.
+
+        Daily and weekly averages are taken over the requested date range, or over the
+        span between the first and last matching expense when a bound is not given.
+        """
+        days = self._days[: self._size]
+        cents = self._cents[: self._size]
+        categories = self._categories[: self._size]
+        payment_methods = self._payment_methods[: self._size]
+
+        mask = np.ones(self._size, dtype=bool)
+        if start_date is not None:
+            mask &= days >= start_date.toordinal()
+        if end_date is not None:
+            mask &= days <= end_date.toordinal()
+        if category is not None:
+            code = self._category_codes.get(_normalize(category))
+            if code is None:
+                mask[:] = False
+            else:
+                mask &= categories == code
+
+        row_ids = np.flatnonzero(mask)
+        if not len(row_ids):
+            return SpendingSummary(0, 0, None, None, 0.0, 0.0, None)
+
+        days, cents = days[row_ids], cents[row_ids]
+        total_cents = int(cents.sum())
+        first_ordinal = start_date.toordinal() if start_date is not None else int(days.min())
+        last_ordinal = end_date.toordinal() if end_date is not None else int(days.max())
+        day_span = max(1, last_ordinal - first_ordinal + 1)
+
+        category_totals = np.bincount(categories[row_ids], weights=cents, minlength=len(self._category_codes))
+        payment_counts = np.bincount(payment_methods[row_ids], minlength=len(self._payment_method_codes))
+        payment_totals = np.bincount(payment_methods[row_ids], weights=cents, minlength=len(self._payment_method_codes))
+
+        return SpendingSummary(
+            count=len(row_ids),
+            total_cents=total_cents,
+            first_date=date.fromordinal(int(days.min())),
+            last_date=date.fromordinal(int(days.max())),
+            daily_average_cents=total_cents / day_span,
+            weekly_average_cents=total_cents * 7 / day_span,
+            largest_row_id=int(row_ids[np.argmax(cents)]),
+            by_category={
+                name: int(round(category_totals[code]))
+                for name, code in self._category_codes.items()
+                if category_totals[code]
+            },
+            by_payment_method={
+                name: (int(payment_counts[code]), int(round(payment_totals[code])))
+                for name, code in self._payment_method_codes.items()
+                if payment_counts[code]
+            },
+        )
+
+    def load(
+        self,
+        days: np.ndarray,
+        cents: np.ndarray,
+        categories: np.ndarray,
+        category_names: Sequence[str],
+        payment_methods: np.ndarray,
+        payment_method_names: Sequence[str],
+    ) -> None:
+        """Replace every column with already-encoded arrays, such as the columns of a CSV scan."""
+        self._category_codes = {}
+        self._payment_method_codes = {}
+        self._allocate(len(days))
+        self._copy_columns(days, cents, categories, category_names, payment_methods, payment_method_names)
+
+    def _copy_snapshot(self, snapshot: ExpenseSnapshot) -> None:
+        """Copy the snapshot's memory-mapped columns."""
+        self._copy_columns(
+            snapshot.days,
+            snapshot.cents,
+            snapshot.categories,
+            snapshot.category_names,
+            snapshot.payment_methods,
+            snapshot.payment_method_names,
+        )
+
+    def _copy_table(self, table: ExpenseTable) -> None:
+        """Copy the array columns of an expense table."""
+        self._copy_columns(
+            np.frombuffer(table.days, dtype=np.int32),
+            np.frombuffer(table.cents, dtype=np.int64),
+            np.frombuffer(table.categories, dtype=np.int16),
+            table.category_codes.names,
+            np.frombuffer(table.payment_methods, dtype=np.int16),
+            table.payment_method_codes.names,
+        )
+
+    def _copy_columns(
+        self,
+        days: np.ndarray,
+        cents: np.ndarray,
+        categories: np.ndarray,
+        category_names: Sequence[str],
+        payment_methods: np.ndarray,
+        payment_method_names: Sequence[str],
+    ) -> None:
+        """Copy encoded columns after the current rows, re-encoding their category and payment codes."""
+        start, end = self._size, self._size + len(days)
+        category_lookup = np.array([_encode(self._category_codes, name) for name in category_names], dtype=np.int16)
+        payment_method_lookup = np.array(
+            [_encode(self._payment_method_codes, name) for name in payment_method_names], dtype=np.int16
+        )
+        self._days[start:end] = days
+        self._cents[start:end] = cents
+        self._categories[start:end] = category_lookup[categories]
+        self._payment_methods[start:end] = payment_method_lookup[payment_methods]
+        self._size = end
+
+    def _allocate(self, capacity: int) -> None:
+        """Allocate empty columns with room for at least `capacity` rows."""
+        capacity = max(_INITIAL_CAPACITY, capacity)
+        self._days = np.empty(capacity, dtype=np.int32)
+        self._cents = np.empty(capacity, dtype=np.int64)
+        self._categories = np.empty(capacity, dtype=np.int16)
+        self._payment_methods = np.empty(capacity, dtype=np.int16)
+        self._size = 0
+
+    def _grow(self, capacity: int) -> None:
+        """Copy the columns into larger arrays."""
+        for name in ("_days", "_cents", "_categories", "_payment_methods"):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[: self._size] = column[: self._size]
+            setattr(self, name, grown)
+
+
+def _encode(codes: dict[str, int], value: str) -> int:
+    """Return the dictionary code for a value, assigning the next free code to new values."""
+    return codes.setdefault(_normalize(value), len(codes))
@@ -0,0 +1,828 @@
+"""
+Cosmos DB helpers shared by the deployed and authenticated expense servers.
+
+Items store the amount as a JSON number; expense_to_item and expense_from_item convert
+between items and Expense records (with integer cents) at the edge. Added expenses are
+created with their fingerprint as the item id, so a duplicate fails on the server with
+a conflict instead of needing a query (see expense_dedup and create_expense_items).
+Items are created in transactional batches per partition key value, so adding many
+expenses costs one round-trip per hundred items of a partition instead of one per item.
+
+The authenticated servers' reads of one user's expenses are served from an in-process
+copy of the user's partition, updated write-through by adds and reloaded after a
+bounded staleness (see ExpensePartitionCache). Other searches push their terms into
+the query, so Cosmos DB only returns descriptions containing every term.
+
+Spending rollups are persisted in their own container, so period questions read a few
+rollup documents instead of every expense, and no server replica has to rescan the
+expenses to answer them (see CosmosExpenseRollups).
+
+CosmosExpenseRepository puts these together behind the ExpenseRepository interface the
+tools use (see expense_repository), for a whole container or for one user's partition.
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, TypeVar
+
+from azure.cosmos.exceptions import (
+    CosmosBatchOperationError,
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from expense_columns import ExpenseColumns, SpendingSummary
+from expense_dedup import DuplicateExpenseError, DuplicatePolicy, expense_fingerprint
+from expense_pages import FIRST_PAGE_CURSOR, InvalidCursorError, decode_cursor, encode_cursor
+from expense_records import Expense, to_cents
+from expense_repository import AddResult, ExpenseRepository, MemoryExpenseRepository, duplicate_result
+from expense_rollups import RollupPeriod, SpendingRollup, group_rollups
+from expense_search import matches, tokenize
+from expense_table import ExpenseTable
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MAX_CONCURRENT_WRITES = 16
+MAX_BATCH_OPERATIONS = 100
+MAX_CONCURRENT_RANGE_QUERIES = 8
+MAX_WRITE_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 0.1
+RETRY_MAX_SECONDS = 5.0
+# Throttled, timed out, retry with (write conflict) and service unavailable
+TRANSIENT_STATUS_CODES = frozenset({408, 429, 449, 503})
+PARTITION_CACHE_MAX_STALENESS_SECONDS = 300
+PARTITION_CACHE_MAX_PARTITIONS = 128
+PARTITION_CACHE_MAX_EXPENSES = 1_000_000
+_EXPENSE_FIELDS = "SELECT c.date, c.amount, c.category, c.description, c.payment_method FROM c"
+SHARED_ROLLUP_SCOPE = "all"
+BACKFILL_MARKER_ID = "backfill"
+ROLLED_UP_FIELD = "rolled_up"
+ROLLUP_WARNING = "new expense missing from the spending rollups, which could not be updated"
+_CATEGORY_COUNTS = "SELECT c.category, COUNT(1) AS count FROM c GROUP BY c.category"
+_ROLLUP_FIELDS = "SELECT c.date, c.category, c.count, c.cents FROM c WHERE c.scope = @scope AND IS_DEFINED(c.date)"
+
+
+def expense_to_item(expense: Expense, user_id: str | None = None, item_id: str | None = None) -> dict[str, Any]:
+    """
+    Convert an expense to a new Cosmos DB item, owned by user_id when the container is partitioned by user.
+
+    The item gets item_id as its id, or a random UUID if it is None.
+    """
+    item = {
+        "id": item_id or str(uuid.uuid4()),
+        "date": expense.date.isoformat(),
+        "amount": expense.amount,
+        "category": expense.category,
+        "description": expense.description,
+        "payment_method": expense.payment_method,
+    }
+    if user_id is not None:
+        item["user_id"] = user_id
+    return item
+
+
+def expense_from_item(item: dict[str, Any]) -> Expense:
+    """
+    Convert a Cosmos DB item to an expense.
+
+    Raises:
+        ValueError: If a field is missing or malformed.
+    """
+    try:
+        return Expense(
+            date=date.fromisoformat(item["date"]),
+            cents=to_cents(item["amount"]),
+            category=str(item["category"]),
+            description=str(item.get("description", "")),
+            payment_method=str(item["payment_method"]),
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"malformed expense item: {e!r}") from e
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed Cosmos DB request is worth retrying as is (see TRANSIENT_STATUS_CODES)."""
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds to wait before another attempt: the server's retry-after hint if any, else jittered backoff."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers["x-ms-retry-after-ms"]) / 1000
+    except (KeyError, TypeError, ValueError):
+        return min(RETRY_BASE_SECONDS * 2**attempt, RETRY_MAX_SECONDS) * random.uniform(0.5, 1)
+
+
+async def with_retries(request: Callable[[], Awaitable[T]]) -> T:
+    """Send a Cosmos DB request, retrying it up to MAX_WRITE_ATTEMPTS times while it fails transiently."""
+    for attempt in range(MAX_WRITE_ATTEMPTS - 1):
+        try:
+            return await request()
+        except CosmosHttpResponseError as e:
+            if not is_transient(e):
+                raise
+            await asyncio.sleep(retry_delay(e, attempt))
+    return await request()
+
+
+async def create_items(container, items: list[dict[str, Any]], partition_key: str) -> list[Exception | None]:
+    """
+    Create items in transactional batches, one partition key value at a time.
+
+    Items are grouped by the value of their partition_key field, and each group is created
+    with execute_item_batch in batches of at most MAX_BATCH_OPERATIONS, one after the other,
+    while the batches of different partition key values run concurrently with at most
+    MAX_CONCURRENT_WRITES in flight. A batch is all or nothing, so when one of its items fails
+    (such as a duplicate whose id already exists), that item gets the error and the batch is
+    retried without it. A batch that fails transiently (throttled, timed out or unable to
+    connect) is sent again after a backoff, or the server's retry-after hint, up to
+    MAX_WRITE_ATTEMPTS times before its items get the error.
+
+    Returns:
+        For each item, None if it was created or the exception that prevented it. Conflicts
+        (CosmosResourceExistsError) are left to the caller to report.
+    """
+    results: list[Exception | None] = [None] * len(items)
+    groups: dict[Any, list[int]] = {}
+    for position, item in enumerate(items):
+        groups.setdefault(item.get(partition_key), []).append(position)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+    async def create_batch(key: Any, positions: list[int]) -> None:
+        failures = 0
+        while positions:
+            operations = [("create", (items[position],)) for position in positions]
+            try:
+                async with semaphore:
+                    await container.execute_item_batch(batch_operations=operations, partition_key=key)
+                return
+            except CosmosBatchOperationError as e:
+                response = e.operation_responses[e.error_index]
+                status = response.get("statusCode")
+                if status in TRANSIENT_STATUS_CODES and failures < MAX_WRITE_ATTEMPTS - 1:
+                    # Nothing of the batch was written, so all of it is sent again
+                    retry_after_ms = response.get("retryAfterMilliseconds")
+                    delay = float(retry_after_ms) / 1000 if retry_after_ms else retry_delay(e, failures)
+                    failures += 1
+                    await asyncio.sleep(delay)
+                    continue
+                position = positions.pop(e.error_index)
+                results[position] = (
+                    CosmosResourceExistsError(status_code=status, message=f"Item {items[position]['id']} exists")
+                    if status == 409
+                    else e
+                )
+            except Exception as e:
+                # Throttling, timeouts and connection errors fail the whole request; other errors are not retried.
+                # A batch that was written before its connection failed conflicts with itself when sent again.
+                retryable = is_transient(e) or not isinstance(e, CosmosHttpResponseError)
+                if retryable and failures < MAX_WRITE_ATTEMPTS - 1:
+                    failures += 1
+                    await asyncio.sleep(retry_delay(e, failures - 1))
+                    continue
+                for position in positions:
+                    results[position] = e
+                return
+
+    async def create_group(key: Any, positions: list[int]) -> None:
+        for start in range(0, len(positions), MAX_BATCH_OPERATIONS):
+            await create_batch(key, positions[start : start + MAX_BATCH_OPERATIONS])
+
+    await asyncio.gather(*(create_group(key, positions) for key, positions in groups.items()))
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, CosmosResourceExistsError):
+            logger.error(f"Error creating expense item: {str(result)}")
+    return results
+
+
+async def create_expense_items(
+    container,
+    expenses: list[Expense],
+    duplicate_policy: DuplicatePolicy,
+    user_id: str | None = None,
+    partition_key: str = "user_id",
+) -> tuple[list[Exception | None], list[bool]]:
+    """
+    Create items for expenses with their fingerprint as id, so the server detects duplicates.
+
+    An expense whose item conflicts with an existing one is a duplicate. Under the reject
+    policy it fails with DuplicateExpenseError; otherwise it is created again under a random id.
+    partition_key names the item field the container is partitioned by (see create_items).
+    The items are marked as rolled up, since the repository adds them to the spending
+    rollups as soon as they are created (see CosmosExpenseRollups).
+
+    Returns:
+        For each expense, None if it was created or the exception that prevented it, and
+        for each expense, whether it is a duplicate.
+    """
+    items = [expense_to_item(expense, user_id, item_id=expense_fingerprint(expense)) for expense in expenses]
+    for item in items:
+        item[ROLLED_UP_FIELD] = True
+    results = await create_items(container, items, partition_key)
+    duplicates = [isinstance(result, CosmosResourceExistsError) for result in results]
+    positions = [position for position, duplicate in enumerate(duplicates) if duplicate]
+    if duplicate_policy is DuplicatePolicy.REJECT:
+        for position in positions:
+            results[position] = DuplicateExpenseError()
+    elif positions:
+        retried_items = [expense_to_item(expenses[position], user_id) for position in positions]
+        for item in retried_items:
+            item[ROLLED_UP_FIELD] = True
+        retried = await create_items(container, retried_items, partition_key)
+        for position, result in zip(positions, retried):
+            results[position] = result
+    return results, duplicates
+
+
+@dataclass
+class CategoryCounts:
+    """Number of expenses per category, with what it cost to count them."""
+
+    counts: dict[str, int]
+    feed_ranges: int
+    request_charge: float
+    elapsed_seconds: float
+
+
+async def count_by_category(container, max_concurrency: int = MAX_CONCURRENT_RANGE_QUERIES) -> CategoryCounts:
+    """
+    Count the expenses of every category across the whole container.
+
+    The GROUP BY runs in the database, once per feed range (partition key range), so only
+    one row per category and range comes back instead of every item. The ranges are queried
+    concurrently, with at most max_concurrency queries in flight, and merged here.
+    """
+    started = time.perf_counter()
+    charges: list[float] = []
+
+    def record_charge(headers, _result) -> None:
+        charges.append(float(headers.get("x-ms-request-charge", 0)))
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def count_range(feed_range: dict[str, Any]) -> list[dict[str, Any]]:
+        async with semaphore:
+            items = container.query_items(query=_CATEGORY_COUNTS, feed_range=feed_range, response_hook=record_charge)
+            return [item async for item in items]
+
+    feed_ranges = [feed_range async for feed_range in container.read_feed_ranges()]
+    counts: dict[str, int] = {}
+    for items in await asyncio.gather(*(count_range(feed_range) for feed_range in feed_ranges)):
+        for item in items:
+            category = item.get("category", "Unknown")
+            counts[category] = counts.get(category, 0) + item["count"]
+    return CategoryCounts(counts, len(feed_ranges), sum(charges), time.perf_counter() - started)
+
+
+@dataclass
+class _CachedPartition:
+    expenses: MemoryExpenseRepository
+    loaded_at: float
+
+
+class ExpensePartitionCache:
+    """
+    In-process copies of the expenses of Cosmos DB partitions, loaded lazily and cached per user.
+
+    The first read of a partition loads its expenses (only the fields needed) into a
+    MemoryExpenseRepository, whose indexes answer later queries, pages and searches without
+    a request to Cosmos DB. Expenses added through this server are written through to the
+    cached copy with add(). Other server replicas can add expenses too, so a copy is
+    reloaded once it is older than max_staleness_seconds; 0 disables caching reads.
+    The least recently used partitions are evicted beyond max_partitions, or when the
+    cached partitions hold more than max_expenses expenses together.
+
+    Usage:
+        expense_cache = ExpensePartitionCache.from_env(cosmos_container)
+        expenses = await expense_cache.partition(user_id)
+        with expense_cache.writing(user_id):
+            ...  # create the expense items
+            await expense_cache.add([expense], user_id)
+    """
+
+    def __init__(
+        self,
+        container,
+        max_staleness_seconds: float = PARTITION_CACHE_MAX_STALENESS_SECONDS,
+        max_partitions: int = PARTITION_CACHE_MAX_PARTITIONS,
+        max_expenses: int = PARTITION_CACHE_MAX_EXPENSES,
+    ):
+        self.container = container
+        self.max_staleness_seconds = max_staleness_seconds
+        self.max_partitions = max_partitions
+        self.max_expenses = max_expenses
+        self._partitions: OrderedDict[str | None, _CachedPartition] = OrderedDict()
+        self._loading: dict[str | None, asyncio.Future[_CachedPartition]] = {}
+        # Writes started or finished per partition, and those in progress, to tell whether a load raced with one
+        self._writes: dict[str | None, int] = {}
+        self._pending_writes: dict[str | None, int] = {}
+
+    @classmethod
+    def from_env(cls, container) -> "ExpensePartitionCache":
+        """Create a cache bounded by the EXPENSES_CACHE_* environment variables, or the defaults."""
+        return cls(
+            container,
+            max_staleness_seconds=float(
+                os.getenv("EXPENSES_CACHE_MAX_STALENESS_SECONDS", PARTITION_CACHE_MAX_STALENESS_SECONDS)
+            ),
+            max_partitions=int(os.getenv("EXPENSES_CACHE_MAX_USERS", PARTITION_CACHE_MAX_PARTITIONS)),
+            max_expenses=int(os.getenv("EXPENSES_CACHE_MAX_EXPENSES", PARTITION_CACHE_MAX_EXPENSES)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Whether reads may be served from the cache at all."""
+        return self.max_staleness_seconds > 0
+
+    async def partition(self, user_id: str | None = None) -> MemoryExpenseRepository:
+        """Return the expenses of the user (or of the whole container), loading them first if needed."""
+        partition = self._partitions.get(user_id)
+        if partition is None or self._expired(partition):
+            # Concurrent reads of the same user wait for one load instead of each reading the partition.
+            # It is forgotten only once done, so no caller can start a second load while it runs.
+            load = self._loading.get(user_id)
+            if load is None:
+                load = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+                load.add_done_callback(lambda _: self._loading.pop(user_id, None))
+            # Shielded, so a cancelled caller does not cancel the load for the others
+            partition = await asyncio.shield(load)
+        if user_id in self._partitions:
+            self._partitions.move_to_end(user_id)
+        return partition.expenses
+
+    async def search(self, text: str, user_id: str | None = None) -> list[Expense]:
+        """Return the expenses of the user (or of the whole container) matching the search, ordered by date."""
+        return await (await self.partition(user_id)).search(text)
+
+    @contextmanager
+    def writing(self, user_id: str | None = None) -> Iterator[None]:
+        """
+        Mark a write to the partition as in progress, from before its items are created until after they are added.
+
+        A load that overlaps a write in any way may or may not include the written items, so
+        it is used once and not kept; the next read loads the partition again.
+        """
+        self._writes[user_id] = self._writes.get(user_id, 0) + 1
+        self._pending_writes[user_id] = self._pending_writes.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._writes[user_id] += 1
+            self._pending_writes[user_id] -= 1
+            if not self._pending_writes[user_id]:
+                del self._pending_writes[user_id]
+
+    async def add(self, expenses: list[Expense], user_id: str | None = None) -> None:
+        """Add expenses that were just created to the partition's copy, if it is cached. Call it inside writing()."""
+        partition = self._partitions.get(user_id)
+        if partition is not None and expenses:
+            await partition.expenses.add_many(expenses)
+            self._evict()
+
+    def _expired(self, partition: _CachedPartition) -> bool:
+        return time.monotonic() - partition.loaded_at >= self.max_staleness_seconds
+
+    async def _load(self, user_id: str | None) -> _CachedPartition:
+        """Read every expense of the user, or of the whole container when user_id is None, and cache them."""
+        loaded_at = time.monotonic()
+        writes = self._writes.get(user_id, 0)
+        if user_id is None:
+            items = self.container.query_items(query=_EXPENSE_FIELDS)
+        else:
+            items = self.container.query_items(
+                query=f"{_EXPENSE_FIELDS} WHERE c.user_id = @uid",
+                parameters=[{"name": "@uid", "value": user_id}],
+                partition_key=user_id,
+            )
+
+        expenses = ExpenseTable()
+        async for expense in _expenses(items):
+            expenses.append(expense)
+        partition = _CachedPartition(MemoryExpenseRepository(expenses, DuplicatePolicy.ALLOW), loaded_at)
+        logger.info(f"Loaded {len(expenses)} expenses into the partition cache")
+
+        # An expense written during the load may be missing from it, or be added to it twice, so such a load is
+        # used once and not kept
+        if self.enabled and self._writes.get(user_id, 0) == writes and user_id not in self._pending_writes:
+            self._partitions[user_id] = partition
+            self._evict()
+        else:
+            self._partitions.pop(user_id, None)
+        return partition
+
+    def _evict(self) -> None:
+        """Evict the least recently used partitions until the cache is within its bounds."""
+        total = sum(len(partition.expenses) for partition in self._partitions.values())
+        while self._partitions and (len(self._partitions) > self.max_partitions or total > self.max_expenses):
+            _, partition = self._partitions.popitem(last=False)
+            total -= len(partition.expenses)
+
+
+class CosmosExpenseRollups:
+    """
+    Daily spending rollups persisted in a Cosmos DB container partitioned by /scope.
+
+    Each document holds the count and total cents of the expenses with one date, category
+    and payment method in one scope (a user id, or SHARED_ROLLUP_SCOPE for a container
+    shared by everyone), under a deterministic id. Adding expenses increments the matching
+    documents with patch operations, creating them on first use, so replicas never overwrite
+    each other's counts. Queries read the daily documents of one scope and add them up into
+    days, weeks or months.
+
+    Expense items created through create_expense_items are marked as rolled up. The items
+    of a scope that are not (created before rollups were kept) are counted once by
+    backfill(), which ensure_backfilled() runs on the first query of a scope without a
+    backfill marker document. The backfill writes absolute totals to documents of its own,
+    so running it again, or on two replicas at once, gives the same result; delete a scope's
+    marker document to recount its unmarked items.
+
+    Usage:
+        expense_rollups = CosmosExpenseRollups(rollup_container)
+        await expense_rollups.add([expense], user_id)
+        await expense_rollups.ensure_backfilled(user_id, unmarked_expenses)
+        months = await expense_rollups.query(RollupPeriod.MONTH, scope=user_id)
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self._backfilled: set[str] = set()
+
+    async def add(self, expenses: list[Expense], scope: str = SHARED_ROLLUP_SCOPE) -> list[bool]:
+        """
+        Add expenses that were just created to their daily rollups.
+
+        Throttled and timed-out increments are retried (see with_retries). Other failures
+        are logged rather than raised, since the expenses themselves were already created.
+
+        Returns:
+            For each expense, whether its rollup was updated.
+        """
+        totals = _daily_totals(expenses)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+        async def increment(key: tuple[date, str, str], count: int, cents: int) -> None:
+            async with semaphore:
+                await self._increment(scope, *key, count, cents)
+
+        keys = list(totals)
+        results = await asyncio.gather(
+            *(increment(key, count, cents) for key, (count, cents) in totals.items()), return_exceptions=True
+        )
+        failed = set()
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error updating spending rollup: {str(result)}")
+                failed.add(key)
+        return [_rollup_key(expense) not in failed for expense in expenses]
+
+    async def ensure_backfilled(self, scope: str, unmarked: Callable[[], AsyncIterator[Expense]]) -> None:
+        """
+        Backfill the scope's rollups from unmarked(), unless its backfill marker document exists.
+
+        The marker is read once per scope and process; unmarked() is only called for a backfill.
+        """
+        if scope in self._backfilled:
+            return
+        try:
+            await self.container.read_item(item=BACKFILL_MARKER_ID, partition_key=scope)
+        except CosmosResourceNotFoundError:
+            await self.backfill(scope, unmarked())
+        self._backfilled.add(scope)
+
+    async def backfill(self, scope: str, expenses: AsyncIterator[Expense]) -> int:
+        """
+        Count expenses whose items are not marked as rolled up into the scope's rollups.
+
+        Their daily totals replace the scope's backfill documents, then the backfill marker
+        document is written. An error is raised before the marker is written, so the next
+        query of the scope retries.
+
+        Returns:
+            The number of expenses counted.
+        """
+        totals = _daily_totals([expense async for expense in expenses])
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+        async def replace(key: tuple[date, str, str], count: int, cents: int) -> None:
+            item = _rollup_item(f"{BACKFILL_MARKER_ID}:{_rollup_id(*key)}", scope, *key, count, cents)
+            async with semaphore:
+                await with_retries(lambda: self.container.upsert_item(body=item))
+
+        await asyncio.gather(*(replace(key, count, cents) for key, (count, cents) in totals.items()))
+        count = sum(count for count, _ in totals.values())
+        await with_retries(
+            lambda: self.container.upsert_item(body={"id": BACKFILL_MARKER_ID, "scope": scope, "expenses": count})
+        )
+        logger.info(f"Backfilled the spending rollups of {count} expenses in scope {scope}")
+        return count
+
+    async def query(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+        scope: str = SHARED_ROLLUP_SCOPE,
+    ) -> list[SpendingRollup]:
+        """Return the spending per day, week or month of the matching expenses in the scope, ordered by period."""
+        query = _ROLLUP_FIELDS
+        parameters: list[dict[str, Any]] = [{"name": "@scope", "value": scope}]
+        filters = (
+            ("c.date >= @start_date", "@start_date", start_date.isoformat() if start_date else None),
+            ("c.date <= @end_date", "@end_date", end_date.isoformat() if end_date else None),
+            ("c.category = @category", "@category", category.strip().casefold() if category else None),
+            (
+                "c.payment_method = @payment_method",
+                "@payment_method",
+                payment_method.strip().casefold() if payment_method else None,
+            ),
+        )
+        for clause, name, value in filters:
+            if value is not None:
+                query += f" AND {clause}"
+                parameters.append({"name": name, "value": value})
+
+        rows = []
+        async for item in self.container.query_items(query=query, parameters=parameters, partition_key=scope):
+            rows.append((date.fromisoformat(item["date"]), item["category"], item["count"], item["cents"]))
+        return group_rollups(rows, period)
+
+    async def _increment(
+        self, scope: str, day: date, category: str, payment_method: str, count: int, cents: int
+    ) -> None:
+        """Increment one daily rollup document, creating it if it does not exist yet."""
+        item_id = _rollup_id(day, category, payment_method)
+        operations = [
+            {"op": "incr", "path": "/count", "value": count},
+            {"op": "incr", "path": "/cents", "value": cents},
+        ]
+
+        async def patch() -> None:
+            await self.container.patch_item(item=item_id, partition_key=scope, patch_operations=operations)
+
+        try:
+            await with_retries(patch)
+            return
+        except CosmosResourceNotFoundError:
+            pass
+        item = _rollup_item(item_id, scope, day, category, payment_method, count, cents)
+        try:
+            await with_retries(lambda: self.container.create_item(body=item))
+        except CosmosResourceExistsError:
+            # Another request created the document first, so increment it instead
+            await with_retries(patch)
+
+
+def _rollup_key(expense: Expense) -> tuple[date, str, str]:
+    """The date, case-folded category and case-folded payment method an expense is rolled up by."""
+    return expense.date, expense.category.strip().casefold(), expense.payment_method.strip().casefold()
+
+
+def _daily_totals(expenses: list[Expense]) -> dict[tuple[date, str, str], list[int]]:
+    """Add up the count and cents of the expenses per rollup key."""
+    totals: dict[tuple[date, str, str], list[int]] = {}
+    for expense in expenses:
+        counts = totals.setdefault(_rollup_key(expense), [0, 0])
+        counts[0] += 1
+        counts[1] += expense.cents
+    return totals
+
+
+def _rollup_id(day: date, category: str, payment_method: str) -> str:
+    return f"{day.isoformat()}:{category}:{payment_method}"
+
+
+def _rollup_item(
+    item_id: str, scope: str, day: date, category: str, payment_method: str, count: int, cents: int
+) -> dict[str, Any]:
+    return {
+        "id": item_id,
+        "scope": scope,
+        "date": day.isoformat(),
+        "category": category,
+        "payment_method": payment_method,
+        "count": count,
+        "cents": cents,
+    }
+
+
+class CosmosExpenseRepository(ExpenseRepository):
+    """
+    Expenses in a Cosmos DB container, with reads and rollups cached as described above.
+
+    Without a user id the repository covers the whole container, whose rollups use
+    SHARED_ROLLUP_SCOPE. For a container partitioned by user, for_user() returns a view of
+    one user's partition that shares the caches, so every query is a single-partition query.
+    A user's queries, summaries and pages are then served from the partition cache when it
+    is enabled, so repeated reads cost no request units. Reads only fetch the expense fields
+    and skip malformed items. partition_key names the item field the container is partitioned
+    by, which groups added expenses into transactional batches.
+
+    Usage:
+        expense_repository = CosmosExpenseRepository(cosmos_container, rollup_container, DuplicatePolicy.REJECT)
+        result = await expense_repository.for_user(user_id).add(Expense(...))
+    """
+
+    def __init__(
+        self,
+        container,
+        rollup_container,
+        duplicate_policy: DuplicatePolicy,
+        user_id: str | None = None,
+        cache: ExpensePartitionCache | None = None,
+        partition_key: str = "user_id",
+    ):
+        self.container = container
+        self.duplicate_policy = duplicate_policy
+        self.user_id = user_id
+        self.partition_key = partition_key
+        self.cache = cache if cache is not None else ExpensePartitionCache(container)
+        self.rollups = CosmosExpenseRollups(rollup_container)
+
+    def for_user(self, user_id: str) -> "CosmosExpenseRepository":
+        """Return a repository of the expenses in one user's partition."""
+        repository = copy.copy(self)
+        repository.user_id = user_id
+        return repository
+
+    @property
+    def scope(self) -> str:
+        """The rollup scope of the repository's expenses."""
+        return self.user_id if self.user_id is not None else SHARED_ROLLUP_SCOPE
+
+    async def add_many(self, expenses: list[Expense]) -> list[AddResult]:
+        if not expenses:
+            return []
+        with self.cache.writing(self.user_id):
+            results, duplicates = await create_expense_items(
+                self.container, expenses, self.duplicate_policy, self.user_id, self.partition_key
+            )
+            created = [expense for expense, result in zip(expenses, results) if result is None]
+            await self.cache.add(created, self.user_id)
+        rolled_up = iter(await self.rollups.add(created, self.scope))
+        added = []
+        for result, duplicate in zip(results, duplicates):
+            if result is not None:
+                added.append(AddResult(error=result))
+                continue
+            outcome = duplicate_result(duplicate, self.duplicate_policy)
+            if not next(rolled_up):
+                outcome.warning = " and a ".join(filter(None, (outcome.warning, ROLLUP_WARNING)))
+            added.append(outcome)
+        return added
+
+    async def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        if self._cached:
+            return await (await self.cache.partition(self.user_id)).query(
+                start_date, end_date, category, payment_method
+            )
+        items = self._query_items(_filters(start_date, end_date, category, payment_method), " ORDER BY c.date")
+        return [expense async for expense in _expenses(items)]
+
+    async def aggregate(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        if self._cached:
+            return await (await self.cache.partition(self.user_id)).aggregate(start_date, end_date, category)
+        # Only the matching expenses are read, into compact columns, and aggregated like the local stores
+        expenses = ExpenseTable()
+        async for expense in _expenses(self._query_items(_filters(start_date, end_date, category, None))):
+            expenses.append(expense)
+        columns = ExpenseColumns()
+        columns.rebuild(expenses)
+        # The dates are passed again so the averages span the requested range, like the other backends
+        summary = columns.summarize(start_date, end_date)
+        largest = expenses[summary.largest_row_id] if summary.largest_row_id is not None else None
+        return summary, largest
+
+    async def stream(self, newest_first: bool = False) -> AsyncIterator[Expense]:
+        if self._cached:
+            async for expense in (await self.cache.partition(self.user_id)).stream(newest_first):
+                yield expense
+            return
+        items = self._query_items([], " ORDER BY c.date DESC" if newest_first else "")
+        async for expense in _expenses(items):
+            yield expense
+
+    async def page(self, cursor: str | None, limit: int) -> tuple[list[Expense], str | None]:
+        if self._cached:
+            return await self._cached_page(cursor, limit)
+        continuation = None
+        if cursor and cursor != FIRST_PAGE_CURSOR:
+            continuation = decode_cursor(cursor).get("continuation")
+            if not isinstance(continuation, str):
+                raise InvalidCursorError(f"Malformed cursor: {cursor}")
+        # At most `limit` items are fetched per round-trip, and only the expense fields
+        pages = self._query_items([], " ORDER BY c.date DESC", max_item_count=limit).by_page(continuation)
+        expenses = []
+        async for page in pages:
+            expenses = [expense async for expense in _expenses(page)]
+            if expenses:
+                break  # Cross-partition queries can return empty pages before the last one
+        next_cursor = encode_cursor({"continuation": pages.continuation_token}) if pages.continuation_token else None
+        return expenses, next_cursor
+
+    async def search(self, text: str) -> list[Expense]:
+        if self._cached:
+            return await self.cache.search(text, self.user_id)
+        terms = tokenize(text)
+        if not terms:
+            return []
+        # A term that prefixes a word of the description is also a substring of it, so Cosmos DB returns a
+        # superset of the matches and the exact word-prefix match is checked here. Cosmos DB ignores case by
+        # lowercasing rather than case folding, so only ASCII terms are pushed down; even then, a description
+        # whose case folding differs from its lowercase form (such as "ß" folding to "ss") can be missed.
+        filters = [
+            (f"CONTAINS(c.description, @term{i}, true)", f"@term{i}", term)
+            for i, term in enumerate(terms)
+            if term.isascii()
+        ]
+        items = self._query_items(filters, " ORDER BY c.date")
+        return [expense async for expense in _expenses(items) if matches(terms, expense.description)]
+
+    async def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        # Items created before rollups were kept are counted once, on the first query of the scope
+        unmarked = [(f"IS_DEFINED(c.{ROLLED_UP_FIELD}) = @rolled_up", "@rolled_up", False)]
+        await self.rollups.ensure_backfilled(self.scope, lambda: _expenses(self._query_items(unmarked)))
+        return await self.rollups.query(period, start_date, end_date, category, payment_method, scope=self.scope)
+
+    @property
+    def _cached(self) -> bool:
+        """Whether reads are served from the partition cache: only for one user's partition, when enabled."""
+        return self.user_id is not None and self.cache.enabled
+
+    async def _cached_page(self, cursor: str | None, limit: int) -> tuple[list[Expense], str | None]:
+        """Return one page of the cached partition newest first, with the offset of the next page as cursor."""
+        partition = await self.cache.partition(self.user_id)
+        offset = 0
+        if cursor and cursor != FIRST_PAGE_CURSOR:
+            offset = decode_cursor(cursor).get("offset")
+            if not isinstance(offset, int) or not 0 <= offset <= len(partition):
+                raise InvalidCursorError(f"Malformed cursor: {cursor}")
+        expenses = partition.newest(offset, limit)
+        if offset + limit >= len(partition):
+            return expenses, None
+        return expenses, encode_cursor({"offset": offset + limit})
+
+    def _query_items(self, filters: list[tuple[str, str, Any]], order_by: str = "", **options):
+        """Query the expense fields of the items matching every (clause, parameter name, value) filter."""
+        if self.user_id is not None:
+            filters = [("c.user_id = @uid", "@uid", self.user_id), *filters]
+            options["partition_key"] = self.user_id
+        query = _EXPENSE_FIELDS
+        if filters:
+            query += " WHERE " + " AND ".join(clause for clause, _, _ in filters)
+        parameters = [{"name": name, "value": value} for _, name, value in filters]
+        return self.container.query_items(query=query + order_by, parameters=parameters, **options)
+
+
+def _filters(
+    start_date: date | None, end_date: date | None, category: str | None, payment_method: str | None
+) -> list[tuple[str, str, Any]]:
+    """Build the query filters of the given expense filters, matching category and payment method ignoring case."""
+    filters = (
+        ("c.date >= @start_date", "@start_date", start_date.isoformat() if start_date else None),
+        ("c.date <= @end_date", "@end_date", end_date.isoformat() if end_date else None),
+        ("StringEquals(c.category, @category, true)", "@category", category),
+        ("StringEquals(c.payment_method, @payment_method, true)", "@payment_method", payment_method),
+    )
+    return [(clause, name, value) for clause, name, value in filters if value is not None]
+
+
+async def _expenses(items) -> AsyncIterator[Expense]:
+    """Convert queried items to expenses, skipping malformed ones."""
+    async for item in items:
+        try:
+            yield expense_from_item(item)
+        except ValueError as e:
+            logger.warning(f"Skipping malformed expense item: {e}")
@@ -0,0 +1,129 @@
+"""
+Duplicate detection for added expenses.
+
+Agents retry tool calls and users repeat themselves, so the same expense can be added
+twice. Every expense has a fingerprint: a SHA-256 hash of its date, amount in cents,
+category and normalized description (case-folded, with runs of whitespace collapsed).
+The payment method is left out, since a repeated expense is often logged with another card.
+
+The local storage engines keep the fingerprints of the stored expenses in a hash index
+(ExpenseFingerprints for the CSV engines, an indexed column in SQLite), so checking an
+added expense does not scan the ledger. Cosmos DB items use the fingerprint as their id,
+so creating a duplicate fails cheaply on the server with a conflict.
+
+What happens to duplicates is set by the EXPENSES_DUPLICATE_POLICY environment variable:
+- warn (default): duplicates are added, and the tools report them as warnings.
+- reject: duplicates are not added, and the tools report them as errors.
+- allow: duplicates are added silently.
+Legitimate repeats (two identical coffees on the same day) are common, so by default
+nothing is dropped and the agent can decide what to do from the warning.
+
+With the local engines, the check is exact within one server process, but not between
+processes sharing the same storage (see expense_writer).
+"""
+
+import hashlib
+import os
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import date
+from enum import Enum
+
+from expense_cache import ExpenseLog
+from expense_records import Expense
+
+DUPLICATE_MESSAGE = "duplicate of an existing expense with the same date, amount, category and description"
+
+
+class DuplicatePolicy(Enum):
+    REJECT = "reject"
+    WARN = "warn"
+    ALLOW = "allow"
+
+    @classmethod
+    def from_env(cls) -> "DuplicatePolicy":
+        """Read the policy from the EXPENSES_DUPLICATE_POLICY environment variable."""
+        return cls(os.getenv("EXPENSES_DUPLICATE_POLICY", cls.WARN.value).lower())
+
+
+class DuplicateExpenseError(ValueError):
+    """Raised for an expense that was not added because it duplicates an existing one."""
+
+    def __init__(self):
+        super().__init__(DUPLICATE_MESSAGE)
+
+
+def expense_fingerprint(expense: Expense) -> str:
+    """Return the hex SHA-256 fingerprint of an expense's date, cents, category and normalized description."""
+    return _fingerprint(expense.date, expense.cents, expense.category, expense.description)
+
+
+def fingerprint_key(fingerprint: str) -> int:
+    """Shorten a fingerprint to a 60-bit integer, which fits a SQLite INTEGER and is cheap to keep in a set."""
+    return int(fingerprint[:15], 16)
+
+
+def _fingerprint(day: date, cents: int, category: str, description: str) -> str:
+    key = f"{day.isoformat()}|{cents}|{category.strip().casefold()}|{' '.join(description.casefold().split())}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ExpenseFingerprints:
+    """
+    Hash index of the fingerprints of the stored expenses.
+
+    Register it with an ExpenseCache to keep it in sync with the cached records:
+        fingerprints = ExpenseFingerprints()
+        expense_cache = ExpenseCache(EXPENSES_FILE, indexes=[fingerprints])
+        with expense_cache.locked():
+            duplicates = fingerprints.find_duplicates(expenses)
+    """
+
+    def __init__(self):
+        self._expenses: Sequence[Expense] = ()
+        self._stale = False
+        self._keys: set[int] = set()
+
+    def rebuild(self, expenses: Sequence[Expense]) -> None:
+        """Mark the index for a rebuild, which is deferred until the first lookup."""
+        self._expenses = expenses
+        self._stale = True
+
+    def add(self, row_id: int, expense: Expense) -> None:
+        """Index the fingerprint of one appended expense."""
+        if self._stale:
+            # The pending rebuild reads the live records, which will include this expense
+            return
+        self._keys.add(fingerprint_key(expense_fingerprint(expense)))
+
+    def extend(self, expenses: Iterable[Expense]) -> None:
+        """Index the fingerprints of more expenses, such as rows appended since the index was built."""
+        self._keys.update(fingerprint_key(expense_fingerprint(expense)) for expense in expenses)
+
+    def index_fingerprints(self, fingerprints: Iterable[str]) -> None:
+        """Replace the index with the given fingerprints."""
+        self._stale = False
+        self._expenses = ()
+        self._keys = {fingerprint_key(fingerprint) for fingerprint in fingerprints}
+
+    def find_duplicates(self, expenses: Iterable[Expense]) -> list[bool]:
+        """For each expense, whether it duplicates an indexed expense or an earlier one of `expenses`."""
+        if self._stale:
+            self.index_fingerprints(_fingerprints(self._expenses))
+        duplicates, seen = [], set()
+        for expense in expenses:
+            key = fingerprint_key(expense_fingerprint(expense))
+            duplicates.append(key in self._keys or key in seen)
+            seen.add(key)
+        return duplicates
+
+
+def _fingerprints(expenses: Sequence[Expense]) -> Iterator[str]:
+    """Yield the fingerprint of every row, reading table columns directly when possible."""
+    if not isinstance(expenses, ExpenseLog):
+        yield from map(expense_fingerprint, expenses)
+        return
+    yield from map(expense_fingerprint, expenses.base)
+    tail = expenses.tail
+    category_names = tail.category_codes.names
+    for day, cents, category, description in zip(tail.days, tail.cents, tail.categories, tail.descriptions):
+        yield _fingerprint(date.fromordinal(day), cents, category_names[category], description)
@@ -0,0 +1,203 @@
+"""
+Streaming bulk import of expenses from CSV or NDJSON files.
+
+The file is read by a generator pipeline: rows are parsed one at a time, grouped into
+chunks, validated against the server's Category/PaymentMethod enums and handed to a
+writer one chunk at a time. Only the current chunk is held in memory, so importing years
+of card exports takes constant memory. Progress is reported after every chunk as the
+number of bytes consumed out of the file size.
+
+CSV files need a header row with the CSV_HEADER columns. NDJSON files (.ndjson or .jsonl)
+hold one JSON object per line with the same keys.
+
+The local MCP servers expose this as the import_expenses tool; the HTTP server only reads
+files inside the directory named by EXPENSES_IMPORT_DIR, since its clients are remote. It
+can also be run from the command line against the local storage engine (selected by
+EXPENSES_STORAGE):
+    cd servers && python expense_import.py statement.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+from collections.abc import Awaitable, Callable, Iterator
+from dataclasses import dataclass, field
+from enum import Enum
+from itertools import islice
+from pathlib import Path
+from typing import Any
+
+from expense_dedup import DUPLICATE_MESSAGE
+from expense_records import Expense, validate_expense_inputs
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+NDJSON_SUFFIXES = {".ndjson", ".jsonl"}
+
+
+class ImportPathError(ValueError):
+    """Raised when a server is asked to import a file outside its import directory."""
+
+
+def resolve_import_path(path: str, import_dir: Path | None) -> Path:
+    """
+    Resolve a client-supplied import path, which must be inside the server's import directory.
+
+    Relative paths are taken from import_dir. Symlinks and '..' are resolved before the check,
+    so a client cannot make the server read any other file.
+
+    Raises:
+        ImportPathError: If no import directory is configured, or the path resolves outside it.
+    """
+    if import_dir is None:
+        raise ImportPathError("Importing files is disabled on this server; set EXPENSES_IMPORT_DIR to enable it")
+    root = import_dir.expanduser().resolve()
+    file_path = (root / path).resolve()
+    if not file_path.is_relative_to(root):
+        raise ImportPathError(f"Import files must be inside the import directory {root}")
+    return file_path
+
+
+@dataclass
+class ImportResult:
+    """Counts of an import, plus the first MAX_REPORTED_ERRORS error messages by row position."""
+
+    rows: int = 0
+    imported: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+    def add_errors(self, errors: list[tuple[int, str]]) -> None:
+        self.invalid += len(errors)
+        self.errors.extend(errors[: MAX_REPORTED_ERRORS - len(self.errors)])
+
+
+def _csv_rows(text: io.TextIOWrapper) -> Iterator[dict[str, Any]]:
+    """Parse CSV rows into expense inputs, converting amounts to numbers where possible."""
+    for row in csv.DictReader(text):
+        try:
+            row["amount"] = float(row["amount"])
+        except (KeyError, TypeError, ValueError):
+            pass
+        yield row
+
+
+def _ndjson_rows(text: io.TextIOWrapper) -> Iterator[Any]:
+    """Parse NDJSON lines into expense inputs, yielding None for lines that are not valid JSON."""
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+
+
+async def stream_import(
+    path: Path,
+    write_chunk: Callable[[list[Expense]], Awaitable[list[str | None]]],
+    categories: type[Enum],
+    payment_methods: type[Enum],
+    on_progress: Callable[[int, int], Awaitable[None]] | None = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> ImportResult:
+    """
+    Stream expenses from a CSV or NDJSON file into a storage backend, one chunk at a time.
+
+    Args:
+        path: The file to import.
+        write_chunk: Writes one chunk of valid expenses and returns, for each expense, None if it was
+            written or why it was not (DUPLICATE_MESSAGE for a rejected duplicate).
+        categories: The server's Category enum.
+        payment_methods: The server's PaymentMethod enum.
+        on_progress: Called after every chunk with the bytes consumed and the file size.
+        chunk_size: Number of rows parsed, validated and written at a time.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    result = ImportResult()
+    with open(path, "rb") as file:
+        total_bytes = os.fstat(file.fileno()).st_size
+        text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+        rows = _ndjson_rows(text) if path.suffix.lower() in NDJSON_SUFFIXES else _csv_rows(text)
+
+        while True:
+            # Parsing is blocking file I/O, so it runs in a worker thread like the store writes
+            chunk = await asyncio.to_thread(lambda: list(islice(rows, chunk_size)))
+            if not chunk:
+                break
+            valid, errors = validate_expense_inputs(chunk, categories, payment_methods, start=result.rows + 1)
+            result.rows += len(chunk)
+            result.add_errors(errors)
+
+            expenses = [expense for _, expense in valid]
+            for outcome in await write_chunk(expenses) if expenses else []:
+                if outcome is None:
+                    result.imported += 1
+                elif outcome == DUPLICATE_MESSAGE:
+                    result.duplicates += 1
+                else:
+                    result.failed += 1
+
+            if on_progress is not None:
+                await on_progress(min(file.tell(), total_bytes), total_bytes)
+    return result
+
+
+def render_import_result(path: Path, result: ImportResult) -> str:
+    """Render the outcome of an import as a short report."""
+    buffer = io.StringIO()
+    buffer.write(f"Imported {result.imported} of {result.rows} rows from {path.name}\n")
+    if result.invalid:
+        buffer.write(f"Skipped {result.invalid} invalid rows\n")
+    if result.duplicates:
+        buffer.write(f"Skipped {result.duplicates} duplicate rows\n")
+    if result.failed:
+        buffer.write(f"Failed to write {result.failed} rows\n")
+    if result.errors:
+        buffer.write(f"\nFirst {len(result.errors)} errors:\n")
+        for position, error in result.errors:
+            buffer.write(f"- Row {position}: {error}\n")
+    return buffer.getvalue()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Import expenses from a CSV or NDJSON file into the local store.")
+    parser.add_argument("path", type=Path, help="CSV or NDJSON (.ndjson, .jsonl) file to import")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="Rows written at a time")
+    args = parser.parse_args()
+
+    # Use the same repository, enums and duplicate policy as the local MCP servers
+    from basic_mcp_stdio import Category, PaymentMethod, expense_repository
+
+    async def write_chunk(expenses: list[Expense]) -> list[str | None]:
+        results = await expense_repository.add_many(expenses)
+        return [None if result.error is None else str(result.error) for result in results]
+
+    async def on_progress(done: int, total: int) -> None:
+        logger.info(f"Imported {done * 100 // max(total, 1)}% of {args.path}")
+
+    async def run() -> ImportResult:
+        try:
+            return await stream_import(
+                args.path, write_chunk, Category, PaymentMethod, on_progress, chunk_size=args.chunk_size
+            )
+        finally:
+            await expense_repository.close()
+
+    result = asyncio.run(run())
+    print(render_import_result(args.path, result), end="")
+
+
+if __name__ == "__main__":
+    main()
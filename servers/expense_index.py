@@ -0,0 +1,136 @@
+"""
+Date-sorted index over the cached expenses for range queries.
+
+Every expense is stored as a (date ordinal, row id) key in one sorted list covering all
+rows, plus one sorted posting list per category and per payment method. A query picks
+the smallest applicable list, finds the date range with two binary searches and walks
+only the k keys inside it, so lookups cost O(log n + k). Appends insert a key into each
+list with bisect.insort, keeping the index up to date without a rebuild. After the cache
+reloads, the rebuild is deferred to the first query so startup does not pay for it.
+"""
+
+import bisect
+from collections import defaultdict
+from collections.abc import Iterator, Sequence
+from datetime import date
+
+from expense_cache import ExpenseLog
+from expense_records import Expense
+from expense_snapshot import ExpenseSnapshot
+from expense_table import ExpenseTable
+
+_Key = tuple[int, int]
+
+
+def _normalize(value: str) -> str:
+    """Normalize a category or payment method so 'AMEX' and 'amex' share a posting list."""
+    return value.strip().casefold()
+
+
+class ExpenseDateIndex:
+    """
+    Sorted date index with per-category and per-payment-method posting lists.
+
+    Register it with an ExpenseCache to keep it in sync with the cached records:
+        date_index = ExpenseDateIndex()
+        expense_cache = ExpenseCache(EXPENSES_FILE, indexes=[date_index])
+    """
+
+    def __init__(self):
+        self._expenses: Sequence[Expense] = ()
+        self._stale = False
+        self._all: list[_Key] = []
+        self._by_category: dict[str, list[_Key]] = defaultdict(list)
+        self._by_payment_method: dict[str, list[_Key]] = defaultdict(list)
+
+    def rebuild(self, expenses: Sequence[Expense]) -> None:
+        """Mark the index for a rebuild, which is deferred until the first query."""
+        self._expenses = expenses
+        self._stale = True
+
+    def add(self, row_id: int, expense: Expense) -> None:
+        """Insert one appended expense into every list it belongs to."""
+        if self._stale:
+            # The pending rebuild reads the live records, which will include this expense
+            return
+        key = (expense.date.toordinal(), row_id)
+        bisect.insort(self._all, key)
+        bisect.insort(self._by_category[_normalize(expense.category)], key)
+        bisect.insort(self._by_payment_method[_normalize(expense.payment_method)], key)
+
+    def _build(self) -> None:
+        """Build all lists from scratch with one sort each."""
+        self._all = []
+        self._by_category = defaultdict(list)
+        self._by_payment_method = defaultdict(list)
+        for row_id, (ordinal, category, payment_method) in enumerate(_index_fields(self._expenses)):
+            key = (ordinal, row_id)
+            self._all.append(key)
+            self._by_category[_normalize(category)].append(key)
+            self._by_payment_method[_normalize(payment_method)].append(key)
+
+        self._all.sort()
+        for postings in (*self._by_category.values(), *self._by_payment_method.values()):
+            postings.sort()
+        self._stale = False
+
+    def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[int]:
+        """
+        Find the row ids of expenses matching every given filter, ordered by date.
+
+        Args:
+            start_date: Earliest date to include, or None for no lower bound.
+            end_date: Latest date to include, or None for no upper bound.
+            category: Only include expenses in this category.
+            payment_method: Only include expenses paid with this payment method.
+        """
+        if self._stale:
+            self._build()
+
+        filters = []
+        if category is not None:
+            filters.append(self._by_category.get(_normalize(category), []))
+        if payment_method is not None:
+            filters.append(self._by_payment_method.get(_normalize(payment_method), []))
+        postings = min([self._all, *filters], key=len)
+
+        low = 0 if start_date is None else bisect.bisect_left(postings, (start_date.toordinal(),))
+        high = len(postings) if end_date is None else bisect.bisect_left(postings, (end_date.toordinal() + 1,))
+        keys = postings[low:high]
+
+        # Keys are unique per row, so the remaining filters are checked with a binary search each
+        for other in filters:
+            if other is not postings:
+                keys = [key for key in keys if _contains(other, key)]
+
+        return [row_id for _, row_id in keys]
+
+
+def _index_fields(expenses: Sequence[Expense]) -> Iterator[tuple[int, str, str]]:
+    """Yield (date ordinal, category, payment method) per row, reading snapshot columns directly."""
+    rows = expenses
+    if isinstance(expenses, ExpenseLog) and isinstance(expenses.base, ExpenseSnapshot):
+        snapshot = expenses.base
+        categories = [snapshot.category_names[code] for code in snapshot.categories.tolist()]
+        payment_methods = [snapshot.payment_method_names[code] for code in snapshot.payment_methods.tolist()]
+        yield from zip(snapshot.days.tolist(), categories, payment_methods)
+        rows = expenses.tail
+    if isinstance(rows, ExpenseTable):
+        categories = map(rows.category_codes.names.__getitem__, rows.categories)
+        payment_methods = map(rows.payment_method_codes.names.__getitem__, rows.payment_methods)
+        yield from zip(rows.days, categories, payment_methods)
+        return
+    for expense in rows:
+        yield expense.date.toordinal(), expense.category, expense.payment_method
+
+
+def _contains(postings: list[_Key], key: _Key) -> bool:
+    """Check whether a sorted posting list contains a key with a binary search."""
+    position = bisect.bisect_left(postings, key)
+    return position < len(postings) and postings[position] == key
@@ -0,0 +1,38 @@
+"""
+Advisory locking of the expenses CSV file across processes.
+
+Writers hold an exclusive lock while appending and readers hold a shared lock while
+reading, so several server processes (such as uvicorn workers) can share one file
+without interleaving rows or reading half-written ones. The locks are flock() locks,
+which only coordinate processes that take them. On platforms without fcntl (Windows)
+locking is a no-op, and a single server process must own the file.
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import IO
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def file_lock(file: int | IO, exclusive: bool = False) -> Iterator[None]:
+    """
+    Hold an advisory lock on an open file for the duration of the block.
+
+    Args:
+        file: An open file object or file descriptor.
+        exclusive: Take an exclusive (writer) lock instead of a shared (reader) lock.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = file if isinstance(file, int) else file.fileno()
+    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
@@ -0,0 +1,112 @@
+"""
+Cursor-based pagination of expense listings.
+
+Cursors are opaque to clients: they are URL-safe base64 encoded JSON objects, so they
+can be embedded in resource URIs and passed back verbatim. The CSV backend stores the
+byte offset of the next row (plus the file's inode, so a rewritten file invalidates old
+cursors), which lets each page be read by seeking straight to it. The Cosmos DB backend
+wraps the SDK's continuation token.
+"""
+
+import base64
+import binascii
+import csv
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+
+from expense_locks import file_lock
+from expense_records import Expense
+
+logger = logging.getLogger(__name__)
+
+FIRST_PAGE_CURSOR = "start"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a cursor cannot be decoded or no longer matches the underlying data."""
+
+
+def encode_cursor(state: dict[str, Any]) -> str:
+    """Encode pagination state as an opaque, URL-safe cursor."""
+    payload = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise InvalidCursorError(f"Malformed cursor: {cursor}") from e
+    if not isinstance(state, dict):
+        raise InvalidCursorError(f"Malformed cursor: {cursor}")
+    return state
+
+
+def read_csv_page(path: Path, cursor: str, limit: int) -> tuple[list[Expense], str | None]:
+    """
+    Read one page of expenses from a CSV file, starting at the position encoded in the cursor.
+
+    Only the rows of the requested page are read and parsed.
+
+    Args:
+        path: The expenses CSV file.
+        cursor: FIRST_PAGE_CURSOR, or a cursor returned by a previous call.
+        limit: Maximum number of expenses to return.
+
+    Returns:
+        The expenses on the page and the cursor of the next page, or None if this was the last page.
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed or the file was replaced since it was issued.
+    """
+    with open(path, "rb") as file, file_lock(file):
+        stat = os.fstat(file.fileno())
+        if cursor == FIRST_PAGE_CURSOR:
+            file.readline()  # Skip the header row
+        else:
+            state = decode_cursor(cursor)
+            offset = state.get("offset")
+            if state.get("inode") != stat.st_ino or not isinstance(offset, int) or not 0 < offset <= stat.st_size:
+                raise InvalidCursorError("Cursor does not match the current expenses file")
+            file.seek(offset)
+
+        expenses = []
+        while len(expenses) < limit:
+            record = _read_record(file)
+            if not record:
+                break
+            row = next(csv.reader([record.decode("utf-8")]), None)
+            if not row:
+                continue
+            try:
+                expenses.append(Expense.from_row(row))
+            except ValueError as e:
+                logger.warning(f"Skipping malformed row in {path}: {e}")
+
+        position = file.tell()
+        if position >= stat.st_size:
+            return expenses, None
+        return expenses, encode_cursor({"offset": position, "inode": stat.st_ino})
+
+
+def _read_record(file) -> bytes:
+    """Read one CSV record, following quoted fields that span multiple lines."""
+    record = file.readline()
+    while record.count(b'"') % 2:
+        line = file.readline()
+        if not line:
+            break
+        record += line
+    return record
@@ -0,0 +1,236 @@
+"""
+Month-partitioned layout of the expenses ledger.
+
+Expenses are stored in one CSV file per month, named after it (expenses/2024-08.csv), so
+a date-bounded read only opens the months overlapping its range and its cost scales
+with the queried window instead of the ledger's age. Added expenses are appended to the
+file of their month.
+
+Closed months can be compacted into a compressed archive (2024-08.csv.gz, or
+2024-08.csv.zst when the zstandard package is installed), which reads decompress
+transparently. Expenses added to a month after it was compacted go to a new plain file,
+which is read together with the archive and folded into it by the next compaction.
+
+Compaction holds the exclusive lock of the month's plain file while it replaces the
+archive and removes the plain file, and readers hold the shared lock while they read
+both, so they never see a row twice or miss one. Writers that were waiting for the lock
+of a removed file append to a new one instead (see append_expenses). If compaction is
+interrupted after replacing the archive but before removing the plain file, that file's
+rows are in both; the archive is replaced atomically, so rows are never lost.
+
+Split an existing ledger into partitions and compress the closed months with:
+    cd servers && python expense_storage.py partition-csv
+    cd servers && python expense_storage.py compress-partitions --codec gzip
+"""
+
+import gzip
+import io
+import logging
+import os
+import re
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import date
+from pathlib import Path
+
+from expense_cache import append_expenses, file_signature
+from expense_locks import file_lock
+from expense_records import Expense, iter_expenses, parse_expenses
+
+try:
+    import zstandard
+except ImportError:  # Optional, gzip is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+PARTITION_SUFFIX = ".csv"
+ARCHIVE_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+SPLIT_CHUNK_SIZE = 100_000
+_PARTITION_NAME = re.compile(r"^(\d{4})-(\d{2})\.csv(\.gz|\.zst)?$")
+
+_Signature = tuple[tuple[int, int, int] | None, tuple[int, int, int] | None]
+
+
+def partition_month(day: date) -> date:
+    """Return the month of the partition holding `day`, as its first day."""
+    return day.replace(day=1)
+
+
+def partition_path(directory: Path, month: date) -> Path:
+    """Return the path of a month's plain CSV file, which takes the appended expenses."""
+    return directory / f"{month:%Y-%m}{PARTITION_SUFFIX}"
+
+
+def archive_path(directory: Path, month: date, codec: str) -> Path:
+    """Return the path of a month's archive compressed with `codec`."""
+    return directory / f"{month:%Y-%m}{PARTITION_SUFFIX}{ARCHIVE_SUFFIXES[codec]}"
+
+
+def find_archive(directory: Path, month: date) -> Path | None:
+    """Return the path of a month's archive, or None if the month was never compacted."""
+    for codec in ARCHIVE_SUFFIXES:
+        path = archive_path(directory, month, codec)
+        if path.exists():
+            return path
+    return None
+
+
+def list_months(directory: Path) -> list[date]:
+    """Return the months that have a plain file or an archive in the directory, in order."""
+    months = set()
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return []
+    for entry in entries:
+        match = _PARTITION_NAME.match(entry.name)
+        if match:
+            months.add(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def partition_signature(directory: Path, month: date) -> _Signature:
+    """Return the signatures of a month's plain file and archive (None for a missing one), to detect changes."""
+    signatures = []
+    for path in (partition_path(directory, month), find_archive(directory, month)):
+        try:
+            signatures.append(file_signature(os.stat(path)) if path is not None else None)
+        except FileNotFoundError:
+            signatures.append(None)
+    return signatures[0], signatures[1]
+
+
+def read_partition(directory: Path, month: date) -> tuple[list[Expense], _Signature]:
+    """
+    Read every expense of a month: the archived ones first, then the appended ones.
+
+    Returns:
+        The expenses in order, and the signature of the files they were read from.
+    """
+    plain = partition_path(directory, month)
+    while True:
+        with ExitStack() as stack:
+            # The plain file is locked first, so compaction cannot move its rows into the archive mid-read
+            try:
+                file = stack.enter_context(open(plain, "rb"))
+            except FileNotFoundError:
+                file = None
+            plain_signature = None
+            if file is not None:
+                stack.enter_context(file_lock(file))
+                stat = os.fstat(file.fileno())
+                if stat.st_nlink == 0:
+                    continue  # Compacted while we waited for the lock
+                plain_signature = file_signature(stat)
+
+            expenses, archive_signature = [], None
+            archive = find_archive(directory, month)
+            if archive is not None:
+                with open(archive, "rb") as archive_file:
+                    archive_signature = file_signature(os.fstat(archive_file.fileno()))
+                    data = _decompress(archive, archive_file.read())
+                expenses = parse_expenses(io.StringIO(data.decode("utf-8"), newline=""), str(archive))
+            if file is not None:
+                text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+                expenses.extend(iter_expenses(text, str(plain)))
+            return expenses, (plain_signature, archive_signature)
+
+
+def compact_partition(directory: Path, month: date, codec: str) -> tuple[int, int]:
+    """
+    Fold a month's plain file into its archive, creating the archive with `codec` if there is none.
+
+    A month that already has an archive keeps its codec.
+
+    Returns:
+        The size in bytes of the month's files before and after, or (0, 0) if it had no plain file.
+
+    Raises:
+        ValueError: If the codec is unknown or its package is not installed.
+    """
+    if codec not in ARCHIVE_SUFFIXES:
+        raise ValueError(f"Unknown compression codec: {codec} (expected 'gzip' or 'zstd')")
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+
+    plain = partition_path(directory, month)
+    try:
+        file = open(plain, "rb")
+    except FileNotFoundError:
+        return 0, 0
+    with file, file_lock(file, exclusive=True):
+        if os.fstat(file.fileno()).st_nlink == 0:
+            return 0, 0  # Another compaction got there first
+        data = file.read()
+        header, rows = data[: data.find(b"\n") + 1], data[data.find(b"\n") + 1 :]
+
+        archive = find_archive(directory, month)
+        before = len(data)
+        if archive is not None:
+            archived = archive.read_bytes()
+            before += len(archived)
+            data = _decompress(archive, archived) + rows
+            target = archive
+        else:
+            data = header + rows
+            target = archive_path(directory, month, codec)
+
+        compressed = _compress(target, data)
+        temporary = target.with_name(target.name + ".tmp")
+        with open(temporary, "wb") as out:
+            out.write(compressed)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temporary, target)
+        os.unlink(plain)
+    return before, len(compressed)
+
+
+def split_csv(csv_path: Path, directory: Path) -> int:
+    """
+    Split a single-file ledger into month partitions, keeping the order of the rows within each month.
+
+    Returns:
+        The number of expenses written.
+
+    Raises:
+        ValueError: If the directory already holds partitions, which would end up with duplicates.
+    """
+    if list_months(directory):
+        raise ValueError(f"{directory} already holds expense partitions")
+    directory.mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    pending: dict[date, list[Expense]] = defaultdict(list)
+
+    def flush() -> None:
+        for month, expenses in pending.items():
+            append_expenses(partition_path(directory, month), expenses)
+        pending.clear()
+
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        for expense in iter_expenses(file, str(csv_path)):
+            pending[partition_month(expense.date)].append(expense)
+            count += 1
+            if count % SPLIT_CHUNK_SIZE == 0:
+                flush()
+    flush()
+    return count
+
+
+def _compress(path: Path, data: bytes) -> bytes:
+    if path.suffix == ARCHIVE_SUFFIXES["zstd"]:
+        if zstandard is None:
+            raise ValueError(f"Reading {path} needs the zstandard package")
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+
+def _decompress(path: Path, data: bytes) -> bytes:
+    if path.suffix == ARCHIVE_SUFFIXES["zstd"]:
+        if zstandard is None:
+            raise ValueError(f"Reading {path} needs the zstandard package")
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+            return reader.read()
+    return gzip.decompress(data)
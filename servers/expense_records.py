@@ -0,0 +1,177 @@
+"""
+Typed expense records, CSV parsing and input validation shared by the expense servers.
+
+Amounts are kept in integer cents everywhere inside the servers. They are converted
+from and to decimal text (or JSON numbers) only at the edges: when parsing CSV rows and
+tool inputs, and when writing CSV rows, Cosmos DB items and listings.
+"""
+
+import csv
+import logging
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from datetime import date
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+from enum import Enum
+from typing import TypedDict
+
+logger = logging.getLogger(__name__)
+
+CSV_HEADER = ["date", "amount", "category", "description", "payment_method"]
+MAX_BULK_EXPENSES = 1000
+
+
+class PaymentMethod(Enum):
+    AMEX = "amex"
+    VISA = "visa"
+    CASH = "cash"
+
+
+class Category(Enum):
+    FOOD = "food"
+    TRANSPORT = "transport"
+    ENTERTAINMENT = "entertainment"
+    SHOPPING = "shopping"
+    GADGET = "gadget"
+    OTHER = "other"
+
+
+def to_cents(amount: str | float) -> int:
+    """
+    Convert a decimal amount, as text or a number, to integer cents, rounding half to even.
+
+    Raises:
+        ValueError: If the amount is not a finite number.
+    """
+    try:
+        cents = Decimal(str(amount).strip()).scaleb(2).to_integral_value(ROUND_HALF_EVEN)
+    except InvalidOperation:
+        raise ValueError(f"invalid amount: {amount!r}") from None
+    if not cents.is_finite():
+        raise ValueError(f"invalid amount: {amount!r}")
+    return int(cents)
+
+
+def format_cents(cents: int) -> str:
+    """Format integer cents as a decimal amount with two decimals, such as 12.30."""
+    sign = "-" if cents < 0 else ""
+    units, fraction = divmod(abs(cents), 100)
+    return f"{sign}{units}.{fraction:02d}"
+
+
+@dataclass(frozen=True, slots=True)
+class Expense:
+    """A single typed expense row, with the amount in integer cents."""
+
+    date: date
+    cents: int
+    category: str
+    description: str
+    payment_method: str
+
+    @property
+    def amount(self) -> float:
+        """The amount in currency units, for display and JSON output."""
+        return self.cents / 100
+
+    @classmethod
+    def from_row(cls, row: list[str]) -> "Expense":
+        """Build an expense from a CSV row in CSV_HEADER column order."""
+        date_str, amount, category, description, payment_method = row
+        return cls(
+            date=date.fromisoformat(date_str),
+            cents=to_cents(amount),
+            category=category,
+            description=description,
+            payment_method=payment_method,
+        )
+
+    def to_row(self) -> list[str | float]:
+        """Convert the expense to a CSV row in CSV_HEADER column order."""
+        return [self.date.isoformat(), format_cents(self.cents), self.category, self.description, self.payment_method]
+
+
+def parse_expenses(lines: Iterable[str], source: str, has_header: bool = True) -> list[Expense]:
+    """
+    Parse CSV text into expenses, skipping blank and malformed rows.
+
+    Args:
+        lines: The CSV text, such as an open file or a list of lines.
+        source: Name of the data source, used in log messages.
+        has_header: Whether the first row is the CSV header.
+    """
+    return list(iter_expenses(lines, source, has_header))
+
+
+def iter_expenses(lines: Iterable[str], source: str, has_header: bool = True) -> Iterator[Expense]:
+    """Parse CSV text into expenses one row at a time, like parse_expenses, for callers that store them compactly."""
+    reader = csv.reader(lines)
+    if has_header:
+        header = next(reader, None)
+        if header != CSV_HEADER:
+            logger.warning(f"Unexpected header in {source}: {header}")
+    for row in reader:
+        if not row:
+            continue
+        try:
+            expense = Expense.from_row(row)
+        except ValueError as e:
+            logger.warning(f"Skipping malformed row {reader.line_num} in {source}: {e}")
+            continue
+        yield expense
+
+
+class ExpenseInput(TypedDict):
+    """One expense passed to a bulk tool. Values are validated per item by validate_expense_inputs."""
+
+    date: str
+    amount: float
+    category: str
+    description: str
+    payment_method: str
+
+
+def validate_expense_inputs(
+    items: Iterable[ExpenseInput], categories: type[Enum], payment_methods: type[Enum], start: int = 1
+) -> tuple[list[tuple[int, Expense]], list[tuple[int, str]]]:
+    """
+    Validate bulk expense inputs in one pass against the server's category and payment method enums.
+
+    Args:
+        items: The inputs to validate.
+        categories: The server's Category enum.
+        payment_methods: The server's PaymentMethod enum.
+        start: Position of the first item, when validating a chunk of a larger input.
+
+    Returns:
+        The valid expenses and the error messages of the invalid ones, each with its position in the input.
+    """
+    category_values = {member.value for member in categories}
+    payment_method_values = {member.value for member in payment_methods}
+    valid, errors = [], []
+    for position, item in enumerate(items, start=start):
+        if not isinstance(item, dict):
+            errors.append((position, "expense must be an object"))
+            continue
+        try:
+            expense_date = date.fromisoformat(item["date"])
+        except (KeyError, TypeError, ValueError):
+            errors.append((position, "date must be in YYYY-MM-DD format"))
+            continue
+        amount = item.get("amount")
+        try:
+            cents = to_cents(amount) if isinstance(amount, int | float) else 0
+        except ValueError:  # inf or nan
+            cents = 0
+        category = str(item.get("category", "")).lower()
+        payment_method = str(item.get("payment_method", "")).lower()
+        if cents <= 0:
+            errors.append((position, "amount must be positive"))
+        elif category not in category_values:
+            errors.append((position, f"category must be one of {', '.join(sorted(category_values))}"))
+        elif payment_method not in payment_method_values:
+            errors.append((position, f"payment_method must be one of {', '.join(sorted(payment_method_values))}"))
+        else:
+            expense = Expense(expense_date, cents, category, str(item.get("description", "")), payment_method)
+            valid.append((position, expense))
+    return valid, errors
@@ -0,0 +1,306 @@
+"""
+Text rendering of expense listings shared by the MCP servers.
+
+Rows are formatted one at a time by generators and written into an io.StringIO
+buffer, so rendering cost is linear in the number of rows and no intermediate
+list of formatted lines (or of the source rows) has to be kept around.
+
+Listings that can grow without bound are rendered within a response budget: rows are
+added most relevant first and shown while they fit in the budget's byte size, and the
+rows that do not fit are replaced by a summary of their count and total per category.
+The header, footer and summary are counted too, so a response never exceeds the budget.
+Token budgets are converted to bytes at BYTES_PER_TOKEN, which is an estimate.
+"""
+
+import heapq
+import io
+from collections.abc import Iterable, Iterator
+from datetime import date
+from typing import Protocol, runtime_checkable
+
+from expense_columns import SpendingSummary
+from expense_records import Expense, format_cents
+from expense_rollups import RollupPeriod, SpendingRollup
+
+DEFAULT_RESPONSE_MAX_BYTES = 32_000
+BYTES_PER_TOKEN = 4
+MIN_RESPONSE_TOKENS = 200
+
+
+def format_expense(expense: Expense) -> str:
+    """Format a typed expense as a single listing line."""
+    return (
+        f"Date: {expense.date.isoformat()}, "
+        f"Amount: ${format_cents(expense.cents)}, "
+        f"Category: {expense.category}, "
+        f"Description: {expense.description}, "
+        f"Payment: {expense.payment_method}\n"
+    )
+
+
+# The shortest line format_expense can produce, so a budget never fits more rows than max_bytes // this
+MIN_EXPENSE_LINE_BYTES = len(format_expense(Expense(date.min, 0, "", "", "")).encode("utf-8"))
+
+
+def expense_lines(expenses: Iterable[Expense]) -> Iterator[str]:
+    """Lazily format typed expenses as listing lines."""
+    for expense in expenses:
+        yield format_expense(expense)
+
+
+def render_expense_lines(lines: Iterable[str], count: int) -> str:
+    """Render an expense listing from pre-formatted lines when the row count is known up front."""
+    buffer = io.StringIO()
+    buffer.write(f"Expense data ({count} entries):\n\n")
+    buffer.writelines(lines)
+    return buffer.getvalue()
+
+
+def response_max_bytes(max_tokens: int | None, default_max_bytes: int) -> int:
+    """Return the byte budget of a response: the server default, lowered to fit max_tokens when given."""
+    if max_tokens is None:
+        return default_max_bytes
+    return min(default_max_bytes, max_tokens * BYTES_PER_TOKEN)
+
+
+class BudgetedListing:
+    """
+    Expense listing that shows rows, in the order they are added, while they fit in a byte budget.
+
+    Usage:
+        listing = BudgetedListing(max_bytes=32_000)
+        for expense in sorted(expenses, key=lambda expense: expense.date, reverse=True):
+            listing.add_expense(expense)
+        text = listing.render(footer="...")
+    """
+
+    def __init__(self, max_bytes: int | None = None):
+        self.max_bytes = max_bytes
+        self.count = 0
+        self._lines: list[tuple[str, str, int]] = []
+        self._size = 0
+        self._omitted: dict[str, list[int]] = {}
+
+    def add(self, line: str, category: str, cents: int) -> None:
+        """Add one formatted row, or count it in the omitted summary once the budget is full."""
+        self.count += 1
+        size = len(line.encode("utf-8"))
+        if not self._omitted and (self.max_bytes is None or self._size + size <= self.max_bytes):
+            self._lines.append((line, category, cents))
+            self._size += size
+        else:
+            self._omit(category, cents)
+
+    def add_expense(self, expense: Expense) -> None:
+        if self._omitted:
+            # Every row after the first omitted one is omitted too, so skip formatting it
+            self.count += 1
+            self._omit(expense.category, expense.cents)
+        else:
+            self.add(format_expense(expense), expense.category, expense.cents)
+
+    def add_omitted(self, category: str, count: int, cents: int) -> None:
+        """Count rows in the omitted summary without formatting them, once the budget is full."""
+        self.count += count
+        totals = self._omitted.setdefault(category, [0, 0])
+        totals[0] += count
+        totals[1] += cents
+
+    def render(self, footer: str = "") -> str:
+        """Render the header, the rows that fit, the omitted summary and the footer within the budget."""
+        while True:
+            header, summary = self._header(), self._summary()
+            size = len(header.encode("utf-8")) + self._size + len(summary.encode("utf-8")) + len(footer.encode("utf-8"))
+            if self.max_bytes is None or size <= self.max_bytes or not self._lines:
+                break
+            # The summary and footer did not fit, so give up rows from the end until they do
+            line, category, cents = self._lines.pop()
+            self._size -= len(line.encode("utf-8"))
+            self._omit(category, cents)
+
+        buffer = io.StringIO()
+        buffer.write(header)
+        buffer.writelines(line for line, _, _ in self._lines)
+        buffer.write(summary)
+        buffer.write(footer)
+        return _truncate(buffer.getvalue(), self.max_bytes)
+
+    def _header(self) -> str:
+        if not self._omitted:
+            return f"Expense data ({self.count} entries):\n\n"
+        return f"Expense data ({len(self._lines)} of {self.count} entries shown):\n\n"
+
+    def _summary(self) -> str:
+        if not self._omitted:
+            return ""
+        count = sum(count for count, _ in self._omitted.values())
+        total_cents = sum(cents for _, cents in self._omitted.values())
+        buffer = io.StringIO()
+        buffer.write(f"\nOmitted {count} more expenses (${format_cents(total_cents)}) to fit the response budget:\n")
+        for category, (count, cents) in sorted(self._omitted.items(), key=lambda item: -item[1][1]):
+            buffer.write(f"- {category}: {count} expenses, ${format_cents(cents)}\n")
+        return buffer.getvalue()
+
+    def _omit(self, category: str, cents: int) -> None:
+        totals = self._omitted.setdefault(category, [0, 0])
+        totals[0] += 1
+        totals[1] += cents
+
+
+def _truncate(text: str, max_bytes: int | None) -> str:
+    """Cut text at the last full line within max_bytes, as a last resort for budgets too small for any summary."""
+    data = text.encode("utf-8")
+    if max_bytes is None or len(data) <= max_bytes:
+        return text
+    data = data[:max_bytes]
+    return data[: data.rfind(b"\n") + 1].decode("utf-8", errors="ignore")
+
+
+@runtime_checkable
+class ColumnarExpenses(Protocol):
+    """Expenses that can pick their newest rows and total their categories without materializing every row."""
+
+    def newest(self, count: int | None = None) -> list[Expense]: ...
+
+    def category_totals(self) -> dict[str, list[int]]: ...
+
+
+def render_newest_expenses(expenses: Iterable[Expense], max_bytes: int | None = None, footer: str = "") -> str | None:
+    """
+    Render expenses most recent first, sorting and formatting only the rows that can fit in the budget.
+
+    The newest rows are picked with heapq.nlargest, in one pass that also totals every
+    category, so the rest of the expenses are only counted in the omitted summary. Columnar
+    expenses (such as the memory-mapped store's) pick them from their columns instead, so
+    only the rows that can be shown are materialized. This is CPU-bound on large ledgers,
+    so servers run it in a worker thread.
+
+    Args:
+        expenses: The expenses, in any order.
+        max_bytes: The response budget, or None for no limit.
+        footer: Text to end the listing with; it counts toward the budget.
+
+    Returns:
+        The rendered listing, or None if there were no expenses.
+    """
+    limit = None if max_bytes is None else max_bytes // MIN_EXPENSE_LINE_BYTES + 1
+    totals: dict[str, list[int]] = {}
+
+    def tally() -> Iterator[Expense]:
+        for expense in expenses:
+            counts = totals.setdefault(expense.category, [0, 0])
+            counts[0] += 1
+            counts[1] += expense.cents
+            yield expense
+
+    columnar = isinstance(expenses, ColumnarExpenses)
+    if columnar:
+        totals = expenses.category_totals()
+        newest = expenses.newest(limit)
+    elif limit is None:
+        newest = sorted(tally(), key=lambda expense: expense.date, reverse=True)
+    else:
+        newest = heapq.nlargest(limit, tally(), key=lambda expense: expense.date)
+    if not newest:
+        return None
+
+    listing = BudgetedListing(max_bytes)
+    for expense in newest:
+        listing.add_expense(expense)
+        # Columnar category totals are keyed by normalized name
+        counts = totals[expense.category.strip().casefold() if columnar else expense.category]
+        counts[0] -= 1
+        counts[1] -= expense.cents
+    for category, (count, cents) in totals.items():
+        if count:
+            listing.add_omitted(category, count, cents)
+    return listing.render(footer)
+
+
+def render_query_results(expenses: list[Expense], max_bytes: int | None = None) -> str:
+    """Render the expenses matching a query, most recent first, with their total amount."""
+    if not expenses:
+        return "No matching expenses found."
+
+    # Newest first, so a listing cut by the budget summarizes the oldest matches rather than the latest
+    total_cents = sum(expense.cents for expense in expenses)
+    return render_newest_expenses(expenses, max_bytes, f"\nTotal: ${format_cents(total_cents)}\n") or ""
+
+
+def render_search_results(expenses: list[Expense], max_bytes: int | None = None) -> str:
+    """Render the expenses matching a search, most recent first, with their total amount."""
+    if not expenses:
+        return "No matching expenses found."
+
+    total_cents = sum(expense.cents for expense in expenses)
+    footer = f"\nTotal: ${format_cents(total_cents)} across {len(expenses)} matching expenses\n"
+    return render_newest_expenses(expenses, max_bytes, footer) or ""
+
+
+def render_spending_summary(summary: SpendingSummary, largest: Expense | None) -> str:
+    """Render a spending summary and its largest expense as a compact text report."""
+    if not summary.count:
+        return "No matching expenses found."
+
+    buffer = io.StringIO()
+    buffer.write(f"Spending summary ({summary.count} expenses, {summary.first_date} to {summary.last_date}):\n\n")
+    buffer.write(f"Total: ${summary.total_cents / 100:.2f}\n")
+    buffer.write(f"Average per day: ${summary.daily_average_cents / 100:.2f}\n")
+    buffer.write(f"Average per week: ${summary.weekly_average_cents / 100:.2f}\n")
+    if largest is not None:
+        buffer.write(f"Largest expense: {format_expense(largest)}")
+
+    buffer.write("\nBy category:\n")
+    for category, cents in sorted(summary.by_category.items(), key=lambda item: -item[1]):
+        buffer.write(f"- {category}: ${cents / 100:.2f}\n")
+
+    buffer.write("\nBy payment method:\n")
+    for payment_method, (count, cents) in sorted(summary.by_payment_method.items(), key=lambda item: -item[1][1]):
+        buffer.write(f"- {payment_method}: {count} expenses, ${cents / 100:.2f}\n")
+
+    return buffer.getvalue()
+
+
+def render_spending_rollup(period: RollupPeriod, rollups: list[SpendingRollup], max_bytes: int | None = None) -> str:
+    """Render spending per period with its total per category, the grand total first, cut to max_bytes."""
+    if not rollups:
+        return "No matching expenses found."
+
+    count = sum(rollup.count for rollup in rollups)
+    total_cents = sum(rollup.total_cents for rollup in rollups)
+    buffer = io.StringIO()
+    buffer.write(
+        f"Spending per {period.value} ({len(rollups)} {period.value}s, {count} expenses, "
+        f"${format_cents(total_cents)} total):\n\n"
+    )
+    for rollup in rollups:
+        if period is RollupPeriod.MONTH:
+            label = rollup.period_start.strftime("%Y-%m")
+        elif period is RollupPeriod.WEEK:
+            label = f"Week of {rollup.period_start}"
+        else:
+            label = rollup.period_start.isoformat()
+        categories = ", ".join(
+            f"{category} ${format_cents(cents)}"
+            for category, cents in sorted(rollup.by_category.items(), key=lambda item: -item[1])
+        )
+        buffer.write(f"- {label}: {rollup.count} expenses, ${format_cents(rollup.total_cents)} ({categories})\n")
+    return _truncate(buffer.getvalue(), max_bytes)
+
+
+def render_bulk_result(
+    added: list[Expense], errors: list[tuple[int, str]], warnings: list[tuple[int, str]] | None = None
+) -> str:
+    """
+    Render the outcome of a bulk add: how many expenses were added, why the others (by position) were not,
+    and warnings about added ones (such as duplicates that were added anyway).
+    """
+    total_cents = sum(expense.cents for expense in added)
+    buffer = io.StringIO()
+    buffer.write(f"Added {len(added)} of {len(added) + len(errors)} expenses (${format_cents(total_cents)} total)\n")
+    for title, messages in (("Errors", errors), ("Warnings", warnings or [])):
+        if messages:
+            buffer.write(f"\n{title}:\n")
+            for position, message in sorted(messages):
+                buffer.write(f"- Item {position}: {message}\n")
+    return buffer.getvalue()
@@ -0,0 +1,309 @@
+"""
+Async repository interface the MCP tools use to store and read expenses.
+
+Tools only talk to an ExpenseRepository, so the same tool code runs against any backend,
+and a load test can compare backends (or measure tool overhead on its own) fairly:
+- LocalExpenseRepository: an ExpenseStore (the CSV file, memory-mapped CSV or SQLite,
+  see expense_storage), written through the group-commit ExpenseWriter. Blocking store
+  calls run in worker threads, so the event loop stays free.
+- MemoryExpenseRepository: expenses kept only in memory, with the same indexes as the
+  CSV cache and no I/O, for benchmarks and tests.
+- CosmosExpenseRepository (in expense_cosmos): a Cosmos DB container, optionally scoped
+  to one user's partition.
+
+Adding expenses reports an AddResult per expense: why it was not added (such as a
+rejected duplicate), or a warning about it (see expense_dedup).
+
+Run the load test with: cd servers && python bench_repository.py
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Iterable, Sequence
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+from expense_columns import ExpenseColumns, SpendingSummary
+from expense_dedup import DUPLICATE_MESSAGE, DuplicateExpenseError, DuplicatePolicy, ExpenseFingerprints
+from expense_index import ExpenseDateIndex
+from expense_pages import FIRST_PAGE_CURSOR, InvalidCursorError, decode_cursor, encode_cursor
+from expense_records import Expense, parse_expenses
+from expense_rollups import ExpenseRollups, RollupPeriod, SpendingRollup
+from expense_search import ExpenseSearchIndex
+from expense_storage import ExpenseStore, create_expense_store
+from expense_table import ExpenseTable
+from expense_writer import ExpenseWriter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AddResult:
+    """Outcome of adding one expense."""
+
+    error: Exception | None = None
+    """Why the expense was not added (DuplicateExpenseError for a rejected duplicate), or None if it was."""
+    warning: str | None = None
+    """A warning about an added expense, such as being a duplicate under the warn policy."""
+
+
+def duplicate_result(duplicate: bool, policy: DuplicatePolicy) -> AddResult:
+    """Return the outcome of an expense checked for duplicates under a policy."""
+    if not duplicate or policy is DuplicatePolicy.ALLOW:
+        return AddResult()
+    if policy is DuplicatePolicy.REJECT:
+        return AddResult(error=DuplicateExpenseError())
+    return AddResult(warning=DUPLICATE_MESSAGE)
+
+
+class ExpenseRepository(ABC):
+    """Async interface shared by the expense backends."""
+
+    async def add(self, expense: Expense) -> AddResult:
+        """Add one expense."""
+        return (await self.add_many([expense]))[0]
+
+    @abstractmethod
+    async def add_many(self, expenses: list[Expense]) -> list[AddResult]:
+        """Add expenses together (in one write where the backend allows it), checking them for duplicates."""
+
+    @abstractmethod
+    async def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        """Return the expenses matching every given filter, ordered by date."""
+
+    @abstractmethod
+    async def aggregate(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        """Return spending aggregates over the matching expenses, and the largest of them."""
+
+    @abstractmethod
+    def stream(self, newest_first: bool = False) -> AsyncIterator[Expense]:
+        """Yield every expense, in insertion order or newest first."""
+
+    async def expenses(self) -> Sequence[Expense]:
+        """Return every expense in insertion order, without copying them where the backend allows it."""
+        return [expense async for expense in self.stream()]
+
+    @abstractmethod
+    async def page(self, cursor: str | None, limit: int) -> tuple[list[Expense], str | None]:
+        """
+        Return one page of expenses and the cursor of the next page, starting at the first page for None.
+
+        Local backends page in insertion order, Cosmos DB newest first.
+
+        Raises:
+            InvalidCursorError: If the cursor is malformed or no longer valid.
+        """
+
+    @abstractmethod
+    async def search(self, text: str) -> list[Expense]:
+        """Return the expenses whose description matches every word of `text` as a prefix, ordered by date."""
+
+    @abstractmethod
+    async def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        """Return the spending per day, week or month of the matching expenses, ordered by period."""
+
+    async def close(self) -> None:
+        """Release any resources held by the repository."""
+
+
+class LocalExpenseRepository(ExpenseRepository):
+    """Expenses in a local ExpenseStore, appended through a group-commit writer."""
+
+    def __init__(self, store: ExpenseStore, writer: ExpenseWriter):
+        self.store = store
+        self.writer = writer
+
+    async def add_many(self, expenses: list[Expense]) -> list[AddResult]:
+        duplicates = await self.writer.submit_many(expenses) if expenses else []
+        return [duplicate_result(duplicate, self.writer.duplicate_policy) for duplicate in duplicates]
+
+    async def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        return await asyncio.to_thread(self.store.query, start_date, end_date, category, payment_method)
+
+    async def aggregate(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        return await asyncio.to_thread(self.store.summarize, start_date, end_date, category)
+
+    async def stream(self, newest_first: bool = False) -> AsyncIterator[Expense]:
+        expenses = await asyncio.to_thread(self.store.expenses)
+        if newest_first:
+            expenses = sorted(expenses, key=lambda expense: expense.date, reverse=True)
+        for expense in expenses:
+            yield expense
+
+    async def expenses(self) -> Sequence[Expense]:
+        return await asyncio.to_thread(self.store.expenses)
+
+    async def page(self, cursor: str | None, limit: int) -> tuple[list[Expense], str | None]:
+        return await asyncio.to_thread(self.store.page, cursor or FIRST_PAGE_CURSOR, limit)
+
+    async def search(self, text: str) -> list[Expense]:
+        return await asyncio.to_thread(self.store.search, text)
+
+    async def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        return await asyncio.to_thread(self.store.rollup, period, start_date, end_date, category, payment_method)
+
+    async def close(self) -> None:
+        self.store.close()
+
+
+class MemoryExpenseRepository(ExpenseRepository):
+    """
+    Expenses kept only in memory, indexed like the CSV cache but without any I/O.
+
+    Usage:
+        expense_repository = MemoryExpenseRepository(parse_expenses(...))
+        result = await expense_repository.add(Expense(...))
+    """
+
+    def __init__(self, expenses: Iterable[Expense] = (), duplicate_policy: DuplicatePolicy = DuplicatePolicy.WARN):
+        self.duplicate_policy = duplicate_policy
+        self._expenses = ExpenseTable(expenses)
+        self._date_index = ExpenseDateIndex()
+        self._columns = ExpenseColumns()
+        self._search_index = ExpenseSearchIndex()
+        self._rollups = ExpenseRollups()
+        self._fingerprints = ExpenseFingerprints()
+        self._indexes = [self._date_index, self._columns, self._search_index, self._rollups, self._fingerprints]
+        for index in self._indexes:
+            index.rebuild(self._expenses)
+
+    def __len__(self) -> int:
+        return len(self._expenses)
+
+    def newest(self, offset: int, limit: int) -> list[Expense]:
+        """Return up to `limit` expenses starting at `offset` in newest-first order, found with the date index."""
+        row_ids = self._date_index.query()
+        end = len(row_ids) - offset
+        return [self._expenses[row_id] for row_id in reversed(row_ids[max(0, end - limit) : max(0, end)])]
+
+    async def add_many(self, expenses: list[Expense]) -> list[AddResult]:
+        if self.duplicate_policy is DuplicatePolicy.ALLOW:
+            duplicates = [False] * len(expenses)
+        else:
+            duplicates = self._fingerprints.find_duplicates(expenses)
+        results = []
+        for expense, duplicate in zip(expenses, duplicates):
+            result = duplicate_result(duplicate, self.duplicate_policy)
+            if result.error is None:
+                row_id = len(self._expenses)
+                self._expenses.append(expense)
+                for index in self._indexes:
+                    index.add(row_id, expense)
+            results.append(result)
+        return results
+
+    async def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        row_ids = self._date_index.query(start_date, end_date, category, payment_method)
+        return [self._expenses[row_id] for row_id in row_ids]
+
+    async def aggregate(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        summary = self._columns.summarize(start_date, end_date, category)
+        largest = self._expenses[summary.largest_row_id] if summary.largest_row_id is not None else None
+        return summary, largest
+
+    async def stream(self, newest_first: bool = False) -> AsyncIterator[Expense]:
+        expenses = self._expenses[:]
+        if newest_first:
+            expenses.sort(key=lambda expense: expense.date, reverse=True)
+        for expense in expenses:
+            yield expense
+
+    async def expenses(self) -> Sequence[Expense]:
+        # The table is append-only, so readers in other threads see a consistent prefix of it
+        return self._expenses
+
+    async def page(self, cursor: str | None, limit: int) -> tuple[list[Expense], str | None]:
+        offset = 0
+        if cursor and cursor != FIRST_PAGE_CURSOR:
+            offset = decode_cursor(cursor).get("offset")
+            if not isinstance(offset, int) or not 0 <= offset <= len(self._expenses):
+                raise InvalidCursorError(f"Malformed cursor: {cursor}")
+        expenses = self._expenses[offset : offset + limit]
+        if offset + limit >= len(self._expenses):
+            return expenses, None
+        return expenses, encode_cursor({"offset": offset + limit})
+
+    async def search(self, text: str) -> list[Expense]:
+        matches = [self._expenses[row_id] for row_id in self._search_index.search(text)]
+        return sorted(matches, key=lambda expense: expense.date)
+
+    async def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        return self._rollups.query(period, start_date, end_date, category, payment_method)
+
+
+def create_expense_repository(
+    storage: str, csv_path: Path, sqlite_path: Path, snapshot_dir: Path | None
+) -> ExpenseRepository:
+    """
+    Create the repository for the storage engine named by `storage`.
+
+    "memory" loads the CSV file into a MemoryExpenseRepository once, and never writes it back.
+    The other names select an ExpenseStore (see create_expense_store), written through an
+    ExpenseWriter configured from the environment.
+
+    Raises:
+        ValueError: If the storage engine name is unknown.
+    """
+    if storage.lower() == "memory":
+        logger.info(f"Using in-memory expense storage, loaded from {csv_path}")
+        with open(csv_path, newline="", encoding="utf-8") as file:
+            expenses = parse_expenses(file, str(csv_path))
+        return MemoryExpenseRepository(expenses, DuplicatePolicy.from_env())
+    store = create_expense_store(storage, csv_path, sqlite_path, snapshot_dir)
+    return LocalExpenseRepository(store, ExpenseWriter.from_env(store))
@@ -0,0 +1,237 @@
+"""
+Daily, weekly and monthly spending rollups maintained incrementally.
+
+Rollup tables map (period start, category, payment method) to the count and total
+cents of the matching expenses, with one table per period. Every appended expense
+updates one key in each table, so maintaining the rollups costs O(1) per expense, and
+answering a period question reads a few hundred keys instead of every row. Weeks start
+on Monday.
+
+Date bounds do not have to fall on period boundaries: periods that are only partly
+inside the requested range are added up from the daily table, so results are exact.
+
+Register ExpenseRollups with an ExpenseCache to keep it in sync with the cached records;
+after the cache reloads the rebuild is deferred to the first query, like the date index.
+"""
+
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from enum import Enum
+
+import numpy as np
+from expense_cache import ExpenseLog
+from expense_records import Expense
+
+_Key = tuple[int, str, str]
+
+
+class RollupPeriod(Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+@dataclass
+class SpendingRollup:
+    """Spending in one period. Amounts are in cents."""
+
+    period_start: date
+    count: int = 0
+    total_cents: int = 0
+    by_category: dict[str, int] = field(default_factory=dict)
+
+
+def period_start(day: date, period: RollupPeriod) -> date:
+    """Return the first day of the period containing `day`."""
+    if period is RollupPeriod.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period is RollupPeriod.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def period_end(start: date, period: RollupPeriod) -> date:
+    """Return the last day of the period starting on `start`."""
+    if period is RollupPeriod.WEEK:
+        return start + timedelta(days=6)
+    if period is RollupPeriod.MONTH:
+        next_month = start.replace(day=28) + timedelta(days=4)
+        return next_month - timedelta(days=next_month.day)
+    return start
+
+
+def group_rollups(
+    rows: Iterable[tuple[date, str, int, int]],
+    period: RollupPeriod,
+) -> list[SpendingRollup]:
+    """Add up (day or period start, category, count, cents) rows into rollups of `period`, ordered by period."""
+    rollups: dict[date, SpendingRollup] = {}
+    for day, category, count, cents in rows:
+        start = period_start(day, period)
+        rollup = rollups.get(start)
+        if rollup is None:
+            rollup = rollups[start] = SpendingRollup(start)
+        rollup.count += count
+        rollup.total_cents += cents
+        rollup.by_category[category] = rollup.by_category.get(category, 0) + cents
+    return [rollups[start] for start in sorted(rollups)]
+
+
+def merge_rollups(groups: Iterable[list[SpendingRollup]]) -> list[SpendingRollup]:
+    """Add up rollups of the same periods computed over disjoint sets of expenses, ordered by period."""
+    merged: dict[date, SpendingRollup] = {}
+    for rollups in groups:
+        for rollup in rollups:
+            total = merged.get(rollup.period_start)
+            if total is None:
+                total = merged[rollup.period_start] = SpendingRollup(rollup.period_start)
+            total.count += rollup.count
+            total.total_cents += rollup.total_cents
+            for category, cents in rollup.by_category.items():
+                total.by_category[category] = total.by_category.get(category, 0) + cents
+    return [merged[start] for start in sorted(merged)]
+
+
+def _normalize(value: str) -> str:
+    """Normalize a category or payment method so 'AMEX' and 'amex' share a rollup."""
+    return value.strip().casefold()
+
+
+class ExpenseRollups:
+    """
+    Rollup tables of spending per day, week and month, by category and payment method.
+
+    Register it with an ExpenseCache to keep it in sync with the cached records:
+        expense_rollups = ExpenseRollups()
+        expense_cache = ExpenseCache(EXPENSES_FILE, indexes=[expense_rollups])
+    """
+
+    def __init__(self):
+        self._expenses: Sequence[Expense] = ()
+        self._stale = False
+        self._tables: dict[RollupPeriod, dict[_Key, list[int]]] = {period: {} for period in RollupPeriod}
+
+    def rebuild(self, expenses: Sequence[Expense]) -> None:
+        """Mark the rollups for a rebuild, which is deferred until the first query."""
+        self._expenses = expenses
+        self._stale = True
+
+    def add(self, row_id: int, expense: Expense) -> None:
+        """Add one appended expense to its day, week and month."""
+        if self._stale:
+            # The pending rebuild reads the live records, which will include this expense
+            return
+        self._add(expense.date, expense.category, expense.payment_method, 1, expense.cents)
+
+    def load(
+        self,
+        days: np.ndarray,
+        cents: np.ndarray,
+        categories: np.ndarray,
+        category_names: Sequence[str],
+        payment_methods: np.ndarray,
+        payment_method_names: Sequence[str],
+    ) -> None:
+        """Replace the rollups with already-encoded columns, such as the columns of a CSV scan."""
+        self._clear()
+        self._add_columns(days, cents, categories, category_names, payment_methods, payment_method_names)
+
+    def query(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        """Return the spending per period within the date range, ordered by period."""
+        if self._stale:
+            self._rebuild()
+        category = _normalize(category) if category is not None else None
+        payment_method = _normalize(payment_method) if payment_method is not None else None
+        low = start_date.toordinal() if start_date is not None else None
+        high = end_date.toordinal() if end_date is not None else None
+
+        def rows(period: RollupPeriod, inside) -> Iterable[tuple[date, str, int, int]]:
+            for (start, row_category, row_payment_method), (count, cents) in self._tables[period].items():
+                if (
+                    inside(start)
+                    and (category is None or row_category == category)
+                    and (payment_method is None or row_payment_method == payment_method)
+                ):
+                    yield date.fromordinal(start), row_category, count, cents
+
+        def whole(start: int) -> bool:
+            end = period_end(date.fromordinal(start), period).toordinal()
+            return (low is None or start >= low) and (high is None or end <= high)
+
+        def partial_day(day: int) -> bool:
+            in_range = (low is None or day >= low) and (high is None or day <= high)
+            return in_range and not whole(period_start(date.fromordinal(day), period).toordinal())
+
+        # Whole periods come from their own table, periods cut by the date bounds from the daily table
+        rollup_rows = list(rows(period, whole))
+        if period is not RollupPeriod.DAY and (low is not None or high is not None):
+            rollup_rows.extend(rows(RollupPeriod.DAY, partial_day))
+        return group_rollups(rollup_rows, period)
+
+    def _rebuild(self) -> None:
+        expenses = self._expenses
+        self._clear()
+        if not isinstance(expenses, ExpenseLog):
+            for expense in expenses:
+                self._add(expense.date, expense.category, expense.payment_method, 1, expense.cents)
+            return
+        for expense in expenses.base:
+            self._add(expense.date, expense.category, expense.payment_method, 1, expense.cents)
+        # Group the table columns with NumPy instead of adding the rows one by one
+        tail = expenses.tail
+        self._add_columns(
+            np.frombuffer(tail.days, dtype=np.int32),
+            np.frombuffer(tail.cents, dtype=np.int64),
+            np.frombuffer(tail.categories, dtype=np.int16),
+            tail.category_codes.names,
+            np.frombuffer(tail.payment_methods, dtype=np.int16),
+            tail.payment_method_codes.names,
+        )
+
+    def _add_columns(
+        self,
+        days: np.ndarray,
+        cents: np.ndarray,
+        categories: np.ndarray,
+        category_names: Sequence[str],
+        payment_methods: np.ndarray,
+        payment_method_names: Sequence[str],
+    ) -> None:
+        """Add encoded columns, one group of rows with the same day, category and payment method at a time."""
+        if not len(days):
+            return
+        keys = (days.astype(np.int64) * len(category_names) + categories) * len(payment_method_names) + payment_methods
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique_keys))
+        totals = np.zeros(len(unique_keys), dtype=np.int64)
+        np.add.at(totals, inverse, cents)
+        for key, count, total in zip(unique_keys.tolist(), counts.tolist(), totals.tolist()):
+            key, payment_method = divmod(key, len(payment_method_names))
+            day, category = divmod(key, len(category_names))
+            self._add(
+                date.fromordinal(day), category_names[category], payment_method_names[payment_method], count, total
+            )
+
+    def _add(self, day: date, category: str, payment_method: str, count: int, cents: int) -> None:
+        category, payment_method = _normalize(category), _normalize(payment_method)
+        for period, table in self._tables.items():
+            key = (period_start(day, period).toordinal(), category, payment_method)
+            totals = table.get(key)
+            if totals is None:
+                table[key] = [count, cents]
+            else:
+                totals[0] += count
+                totals[1] += cents
+
+    def _clear(self) -> None:
+        self._stale = False
+        self._expenses = ()
+        self._tables = {period: {} for period in RollupPeriod}
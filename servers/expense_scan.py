@@ -0,0 +1,401 @@
+"""
+Memory-mapped, vectorized scanning of the expenses CSV file.
+
+For ledgers too large to keep as Expense records in memory, the file is mapped with mmap
+and scanned as a NumPy byte array. Record boundaries are the newlines outside quoted
+fields (quote parity is only tracked when the chunk contains quotes at all), and field
+boundaries come from the commas of each record: the date, amount and category are the
+fields before the first three commas and the payment method is the field after the last
+one, so descriptions (the only field that may contain commas, quotes or newlines) are
+never decoded. Each column is parsed on first use with vectorized gathers, so a filter
+on category or a sum over amounts touches only those bytes, and matching rows are
+materialized individually with the csv module. Descriptions are decoded from their own
+byte slices when a search index needs them.
+
+The file is processed in row-aligned chunks, so temporary arrays stay bounded no matter
+how large the file is.
+"""
+
+import csv
+import logging
+import mmap
+import os
+from collections.abc import Callable, Iterator, Sequence
+from datetime import date
+from pathlib import Path
+from typing import overload
+
+import numpy as np
+from expense_cache import file_signature
+from expense_locks import file_lock
+from expense_records import Expense
+
+logger = logging.getLogger(__name__)
+
+SCAN_CHUNK_SIZE = 64 * 1024 * 1024
+_PARSE_BLOCK_ROWS = 65536
+_AMOUNT_WIDTH = 32
+_NAME_WIDTH = 64
+_UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_NEWLINE, _CARRIAGE_RETURN, _QUOTE, _COMMA = ord("\n"), ord("\r"), ord('"'), ord(",")
+
+
+def _gather(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray, width: int) -> np.ndarray:
+    """Copy the byte ranges [start, end) into a zero-padded (rows, width) array."""
+    if not len(starts):
+        return np.zeros((0, width), dtype=np.uint8)
+    # Every row is a slice of a strided view of the buffer, so no per-byte index array is needed
+    inside = starts <= len(buffer) - width
+    if inside.all():
+        fields = np.lib.stride_tricks.sliding_window_view(buffer, width)[starts]
+    else:
+        fields = np.zeros((len(starts), width), dtype=np.uint8)
+        if len(buffer) >= width:
+            fields[inside] = np.lib.stride_tricks.sliding_window_view(buffer, width)[starts[inside]]
+        for row in np.flatnonzero(~inside).tolist():
+            tail = buffer[starts[row] : starts[row] + width]
+            fields[row, : len(tail)] = tail
+    fields[np.arange(width) >= (ends - starts)[:, None]] = 0
+    return fields
+
+
+def _encode_fields(fields: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the distinct rows of a zero-padded (rows, width) byte array.
+
+    Rows are hashed to one uint64 each, so only the hashes are sorted rather than the bytes.
+
+    Returns:
+        The distinct rows and, for each input row, the index of its distinct row.
+    """
+    width = -(-fields.shape[1] // 8) * 8
+    padded = np.zeros((len(fields), width), dtype=np.uint8)
+    padded[:, : fields.shape[1]] = fields
+    words = padded.view(np.uint64)
+    hashes = np.zeros(len(fields), dtype=np.uint64)
+    for column in range(words.shape[1]):
+        hashes = hashes * np.uint64(0x100000001B3) ^ words[:, column]
+    _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    distinct = fields[first]
+    if not np.array_equal(distinct[inverse], fields):
+        # Hash collision: fall back to comparing the bytes themselves
+        distinct, inverse = np.unique(fields, axis=0, return_inverse=True)
+    return distinct, inverse.ravel()
+
+
+def _parse_days(fields: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Parse zero-padded YYYY-MM-DD fields into day ordinals, and return which fields were valid."""
+    digits = fields.astype(np.int32) - ord("0")
+    digit_columns = [0, 1, 2, 3, 5, 6, 8, 9]
+    valid = (
+        np.all((digits[:, digit_columns] >= 0) & (digits[:, digit_columns] <= 9), axis=1)
+        & (fields[:, 4] == ord("-"))
+        & (fields[:, 7] == ord("-"))
+        & (fields[:, 10] == 0)
+    )
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 5] * 10 + digits[:, 6]
+    days = digits[:, 8] * 10 + digits[:, 9]
+    valid &= (years >= 1) & (months >= 1) & (months <= 12) & (days >= 1)
+    years, months, days = np.where(valid, years, 1970), np.where(valid, months, 1), np.where(valid, days, 1)
+
+    month_starts = (years - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (months - 1)
+    days_in_month = ((month_starts + 1).astype("datetime64[D]") - month_starts.astype("datetime64[D]")).astype(int)
+    valid &= days <= days_in_month
+    ordinals = (month_starts.astype("datetime64[D]") + (days - 1)).astype(np.int64) + _UNIX_EPOCH_ORDINAL
+    return ordinals.astype(np.int32), valid
+
+
+def _parse_cents(fields: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Parse zero-padded decimal amount fields into integer cents, and return which fields were valid."""
+    texts = np.ascontiguousarray(fields).view(f"S{fields.shape[1]}").ravel()
+    try:
+        amounts = texts.astype(np.float64)
+        valid = np.isfinite(amounts)
+    except ValueError:
+        # At least one amount is malformed, so fall back to parsing this chunk one field at a time
+        amounts = np.zeros(len(texts))
+        valid = np.zeros(len(texts), dtype=bool)
+        for i, text in enumerate(texts.tolist()):
+            try:
+                amounts[i] = float(text)
+                valid[i] = np.isfinite(amounts[i])
+            except ValueError:
+                pass
+    return np.round(np.where(valid, amounts, 0) * 100).astype(np.int64), valid
+
+
+def _normalize_name(raw: bytes) -> str:
+    """Normalize a raw category or payment method field the way the other expense columns do."""
+    return raw.decode("utf-8", errors="replace").strip().strip('"').strip().casefold()
+
+
+class CsvScan:
+    """
+    Row and field boundaries of a memory-mapped expenses CSV file, with columns parsed on demand.
+
+    Usage:
+        scan = CsvScan(Path("expenses.csv"))
+        days, cents = scan.days(), scan.cents()
+        categories, category_names = scan.categories()
+        expense = scan.expense(row_id)
+        latest = [scan.expense(row_id) for row_id in scan.newest(10).tolist()]
+    """
+
+    def __init__(self, path: Path, chunk_size: int = SCAN_CHUNK_SIZE):
+        self.path = path
+        # Map under the shared lock, so the mapping never ends in a half-written row
+        with open(path, "rb") as file, file_lock(file):
+            self.signature = file_signature(os.fstat(file.fileno()))
+            size = self.signature[1]
+            self._mmap = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        buffer = np.frombuffer(self._mmap, dtype=np.uint8) if self._mmap is not None else np.empty(0, np.uint8)
+        self._buffer = buffer
+
+        # Per row: the start, plus offsets from it of the three leading commas, the last field and the end
+        chunks = list(self._scan(chunk_size))
+        if chunks:
+            self._starts = np.concatenate([starts for starts, _ in chunks])
+            self._offsets = np.concatenate([offsets for _, offsets in chunks], axis=1)
+        else:
+            self._starts = np.empty(0, np.int64)
+            self._offsets = np.empty((5, 0), np.int32)
+        del chunks
+        self._days: np.ndarray | None = None
+        self._cents: np.ndarray | None = None
+        self._categories: tuple[np.ndarray, list[str]] | None = None
+        self._payment_methods: tuple[np.ndarray, list[str]] | None = None
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def _scan(self, chunk_size: int) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield the record starts and field offsets, one row-aligned chunk of the file at a time."""
+        buffer = self._buffer
+        # The header row is never quoted, so it ends at the first newline
+        start = self._mmap.find(b"\n") + 1 if self._mmap is not None else 0
+        if not start:
+            return
+        while start < len(buffer):
+            end = min(len(buffer), start + chunk_size)
+            window = buffer[start:end]
+            newlines = np.flatnonzero(window == _NEWLINE)
+            quotes = np.flatnonzero(window == _QUOTE)
+            if len(quotes):
+                # Chunks start at a record boundary, so a newline ends a record if an even number of quotes precede it
+                newlines = newlines[np.searchsorted(quotes, newlines) % 2 == 0]
+            if end < len(buffer):
+                if not len(newlines):
+                    chunk_size *= 2
+                    continue
+                end = start + int(newlines[-1]) + 1
+                window = window[: end - start]
+            elif not len(newlines) or newlines[-1] != len(window) - 1:
+                # The last record has no trailing newline
+                newlines = np.append(newlines, len(window))
+            starts, offsets = self._fields(window, newlines, quotes)
+            yield starts + start, offsets
+            start = end
+
+    def _fields(self, window: np.ndarray, newlines: np.ndarray, quotes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find the starts and field offsets of the records ending at `newlines`, dropping malformed records."""
+        ends = newlines
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        # Strip the \r of \r\n line endings and drop blank lines
+        ends = ends - ((ends > starts) & (window[np.maximum(ends - 1, 0)] == _CARRIAGE_RETURN))
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+
+        commas = np.flatnonzero(window == _COMMA)
+        if len(quotes):
+            # Commas inside quoted fields are part of the description
+            commas = commas[np.searchsorted(quotes, commas) % 2 == 0]
+        first = np.searchsorted(commas, starts)
+        last = np.searchsorted(commas, ends) - 1
+        # A valid record has exactly four separators
+        valid = last - first == 3
+        if not valid.all():
+            logger.warning(f"Skipping {int((~valid).sum())} malformed rows in {self.path}")
+        first, last, starts, ends = first[valid], last[valid], starts[valid], ends[valid]
+        offsets = np.stack([commas[first], commas[first + 1], commas[first + 2], commas[last] + 1, ends]) - starts
+        return starts.astype(np.int64), offsets.astype(np.int32)
+
+    def _bound(self, bound: int, rows: slice) -> np.ndarray:
+        """Byte positions of one boundary (0 start, 1-3 leading commas, 4 last field, 5 end) for a block of rows."""
+        if bound == 0:
+            return self._starts[rows]
+        return self._starts[rows] + self._offsets[bound - 1, rows]
+
+    def _drop_invalid(self, valid: np.ndarray, column: str) -> None:
+        """Drop the rows whose `column` failed to parse, from the boundaries and every parsed column."""
+        logger.warning(f"Skipping {int((~valid).sum())} rows with a malformed {column} in {self.path}")
+        self._starts, self._offsets = self._starts[valid], self._offsets[:, valid]
+        if self._days is not None:
+            self._days = self._days[valid]
+        if self._cents is not None:
+            self._cents = self._cents[valid]
+        if self._categories is not None:
+            self._categories = (self._categories[0][valid], self._categories[1])
+        if self._payment_methods is not None:
+            self._payment_methods = (self._payment_methods[0][valid], self._payment_methods[1])
+
+    def validate(self) -> None:
+        """Parse the date and amount columns, dropping rows where either is malformed, so row ids are stable."""
+        self.days()
+        self.cents()
+
+    def _parse(
+        self,
+        parse: Callable[[np.ndarray], tuple[np.ndarray, np.ndarray]],
+        start_bound: int,
+        end_bound: int,
+        width: int,
+        skip: int = 0,
+        fixed_width: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Gather and parse a column in blocks of rows, so the temporary arrays stay small."""
+        values, valid = [], []
+        for block in range(0, len(self), _PARSE_BLOCK_ROWS):
+            rows = slice(block, block + _PARSE_BLOCK_ROWS)
+            starts, ends = self._bound(start_bound, rows) + skip, self._bound(end_bound, rows)
+            lengths = ends - starts
+            # Gather no more bytes than the longest field needs, plus one zero byte of padding
+            block_width = width if fixed_width else max(1, min(width, int(lengths.max()) + 1))
+            block_values, block_valid = parse(_gather(self._buffer, starts, ends, block_width))
+            values.append(block_values)
+            valid.append(block_valid & (lengths < width))
+        if not values:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+        return np.concatenate(values), np.concatenate(valid)
+
+    def days(self) -> np.ndarray:
+        """Date column as int32 day ordinals."""
+        if self._days is None:
+            self._days, valid = self._parse(_parse_days, 0, 1, 11, fixed_width=True)
+            if not valid.all():
+                self._drop_invalid(valid, "date")
+        return self._days
+
+    def cents(self) -> np.ndarray:
+        """Amount column as int64 cents."""
+        if self._cents is None:
+            self._cents, valid = self._parse(_parse_cents, 1, 2, _AMOUNT_WIDTH, skip=1)
+            if not valid.all():
+                self._drop_invalid(valid, "amount")
+        return self._cents
+
+    def categories(self) -> tuple[np.ndarray, list[str]]:
+        """Category column as int16 codes into a list of normalized names."""
+        if self._categories is None:
+            self._categories = self._names(2, 3)
+        return self._categories
+
+    def payment_methods(self) -> tuple[np.ndarray, list[str]]:
+        """Payment method column as int16 codes into a list of normalized names."""
+        if self._payment_methods is None:
+            self._payment_methods = self._names(4, 5, skip=0)
+        return self._payment_methods
+
+    def _names(self, start_bound: int, end_bound: int, skip: int = 1) -> tuple[np.ndarray, list[str]]:
+        """Dictionary-encode a short text column, normalizing only the distinct values of each block."""
+        codes: dict[str, int] = {}
+        column = np.empty(len(self), dtype=np.int16)
+        for block in range(0, len(self), _PARSE_BLOCK_ROWS):
+            rows = slice(block, block + _PARSE_BLOCK_ROWS)
+            starts = self._bound(start_bound, rows) + skip
+            ends = np.minimum(self._bound(end_bound, rows), starts + _NAME_WIDTH)
+            fields = _gather(self._buffer, starts, ends, int((ends - starts).max()))
+            distinct, inverse = _encode_fields(fields)
+            # Several raw spellings (such as AMEX and amex) can normalize to the same name
+            lookup = [codes.setdefault(_normalize_name(raw.tobytes().rstrip(b"\0")), len(codes)) for raw in distinct]
+            column[rows] = np.array(lookup, dtype=np.int16)[inverse]
+        return column, list(codes)
+
+    def descriptions(self) -> Iterator[str]:
+        """Yield the description of every row, decoded from its byte slice without parsing the rest of the row."""
+        if not len(self):
+            return
+        mapped = self._mmap
+        starts = (self._starts + self._offsets[2] + 1).tolist()
+        ends = (self._starts + self._offsets[3] - 1).tolist()
+        for start, end in zip(starts, ends):
+            raw = mapped[start:end]
+            if raw[:1] == b'"':
+                raw = raw[1:-1].replace(b'""', b'"')
+            yield raw.decode("utf-8")
+
+    def newest(self, count: int | None = None) -> np.ndarray:
+        """
+        Return the ids of the `count` most recent rows (all rows if None), most recent first.
+
+        Rows of the same date keep their file order, like a stable sort. Only the dates are
+        compared, with a partial sort, so no row is materialized.
+        """
+        days = self.days()
+        if count is None or count >= len(days):
+            row_ids = np.arange(len(days))
+        elif count <= 0:
+            return np.empty(0, dtype=np.int64)
+        else:
+            threshold = np.partition(days, len(days) - count)[len(days) - count]
+            newer = np.flatnonzero(days > threshold)
+            row_ids = np.concatenate((newer, np.flatnonzero(days == threshold)[: count - len(newer)]))
+        return row_ids[np.lexsort((row_ids, -days[row_ids].astype(np.int64)))]
+
+    def first_row_at(self, offset: int) -> int:
+        """Return the id of the first row starting at or after byte `offset`, or len(self) if there is none."""
+        return int(np.searchsorted(self._starts, offset))
+
+    def expense(self, row_id: int) -> Expense:
+        """Materialize one row, decoding its description."""
+        start = int(self._starts[row_id])
+        record = self._buffer[start : start + int(self._offsets[4, row_id])].tobytes().decode("utf-8")
+        return Expense.from_row(next(csv.reader([record])))
+
+    def close(self) -> None:
+        """Drop the mapping; it is unmapped once no parsed view of it is left."""
+        self._buffer = np.empty(0, np.uint8)
+        self._mmap = None
+
+
+class ScannedExpenses(Sequence[Expense]):
+    """
+    The rows of a scan as a sequence of expenses, materialized only when accessed.
+
+    Listings can pick the newest rows and total the categories from the parsed columns, so
+    only the rows they show are decoded (see expense_render.render_newest_expenses). The
+    sequence keeps the scan it was made from, and its mapping, alive while it is in use.
+    """
+
+    def __init__(self, scan: CsvScan):
+        self.scan = scan
+
+    def __len__(self) -> int:
+        return len(self.scan)
+
+    @overload
+    def __getitem__(self, index: int) -> Expense: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Expense]: ...
+
+    def __getitem__(self, index: int | slice) -> Expense | list[Expense]:
+        if isinstance(index, slice):
+            return [self.scan.expense(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("expense index out of range")
+        return self.scan.expense(index)
+
+    def newest(self, count: int | None = None) -> list[Expense]:
+        """Return the `count` most recent expenses (all if None), most recent first."""
+        return [self.scan.expense(row_id) for row_id in self.scan.newest(count).tolist()]
+
+    def category_totals(self) -> dict[str, list[int]]:
+        """Return the [count, cents] of every category, keyed by normalized category name."""
+        codes, names = self.scan.categories()
+        counts = np.bincount(codes, minlength=len(names))
+        cents = np.zeros(len(names), dtype=np.int64)
+        np.add.at(cents, codes, self.scan.cents())
+        return {name: [int(count), int(total)] for name, count, total in zip(names, counts, cents) if count}
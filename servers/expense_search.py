@@ -0,0 +1,115 @@
+"""
+Inverted full-text index over expense descriptions.
+
+Descriptions are split into case-folded word tokens, and every token maps to the row
+ids containing it (as compact array('i') posting lists). The vocabulary is also kept
+sorted, so a query term matches every token it is a prefix of with a binary search:
+"coff" finds "coffee" and "coffeeshop". Query terms are combined with AND.
+
+Register the index with an ExpenseCache to keep it in sync with the cached records:
+appended expenses are indexed row by row, and after the cache reloads the rebuild is
+deferred to the first search, like the date index.
+"""
+
+import bisect
+import re
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+
+from expense_cache import ExpenseLog
+from expense_records import Expense
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into case-folded word tokens, without duplicates."""
+    return list(dict.fromkeys(_TOKEN.findall(text.casefold())))
+
+
+def matches(terms: list[str], description: str) -> bool:
+    """Check whether every query term is a prefix of some token of the description."""
+    tokens = tokenize(description)
+    return all(any(token.startswith(term) for token in tokens) for term in terms)
+
+
+class ExpenseSearchIndex:
+    """
+    Inverted index from description tokens to row ids, with prefix matching.
+
+    Usage:
+        search_index = ExpenseSearchIndex()
+        expense_cache = ExpenseCache(EXPENSES_FILE, indexes=[search_index])
+        with expense_cache.locked() as expenses:
+            matches = [expenses[row_id] for row_id in search_index.search("coffee")]
+    """
+
+    def __init__(self):
+        self._expenses: Sequence[Expense] = ()
+        self._stale = False
+        self._postings: dict[str, array] = {}
+        self._vocabulary: list[str] = []
+
+    def rebuild(self, expenses: Sequence[Expense]) -> None:
+        """Mark the index for a rebuild, which is deferred until the first search."""
+        self._expenses = expenses
+        self._stale = True
+
+    def add(self, row_id: int, expense: Expense) -> None:
+        """Index the description of one appended expense."""
+        if self._stale:
+            # The pending rebuild reads the live records, which will include this expense
+            return
+        self._add(row_id, expense.description)
+
+    def index_descriptions(self, descriptions: Iterable[str]) -> None:
+        """Replace the index with the given descriptions, numbered from row id 0."""
+        self._stale = False
+        self._expenses = ()
+        self._postings = {}
+        for row_id, description in enumerate(descriptions):
+            for token in tokenize(description):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = array("i")
+                postings.append(row_id)
+        self._vocabulary = sorted(self._postings)
+
+    def search(self, text: str) -> list[int]:
+        """Return the ids of the rows whose description matches every term of the query, in row order."""
+        if self._stale:
+            self.index_descriptions(_descriptions(self._expenses))
+        terms = tokenize(text)
+        if not terms:
+            return []
+
+        row_ids: set[int] | None = None
+        for term in sorted(terms, key=len, reverse=True):
+            # Longer terms usually match fewer tokens, so they narrow the result down first
+            term_row_ids: set[int] = set()
+            start = bisect.bisect_left(self._vocabulary, term)
+            for token in self._vocabulary[start:]:
+                if not token.startswith(term):
+                    break
+                term_row_ids.update(self._postings[token])
+            row_ids = term_row_ids if row_ids is None else row_ids & term_row_ids
+            if not row_ids:
+                return []
+        return sorted(row_ids)
+
+    def _add(self, row_id: int, description: str) -> None:
+        for token in tokenize(description):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = array("i")
+                bisect.insort(self._vocabulary, token)
+            postings.append(row_id)
+
+
+def _descriptions(expenses: Sequence[Expense]) -> Iterator[str]:
+    """Yield the description of every row, reading table columns directly when possible."""
+    if isinstance(expenses, ExpenseLog):
+        yield from (expense.description for expense in expenses.base)
+        yield from expenses.tail.descriptions
+    else:
+        yield from (expense.description for expense in expenses)
@@ -0,0 +1,223 @@
+"""
+Binary columnar snapshots of the expenses CSV file for fast restarts.
+
+A compaction step parses the CSV file once and writes its rows as NumPy .npy columns
+(day ordinals, integer cents, dictionary-encoded categories and payment methods, and
+UTF-8 descriptions as one byte blob plus offsets), together with a manifest recording
+how many bytes of the CSV file the snapshot covers. The CSV file stays the source of
+truth and keeps growing by appends; everything after that byte offset is the tail.
+
+On startup the cache memory-maps the columns without copying or parsing them and only
+parses the CSV tail, so cold start cost is proportional to the rows added since the
+last compaction. The manifest also records a CRC-32 of every covered byte, which is
+checked on open, so a snapshot is ignored if the CSV file was replaced or rewritten
+since it was taken (different inode, shorter file, or any different byte before the
+offset). Checksumming the covered bytes still reads them, but costs far less than
+parsing them.
+
+Run compaction with: cd servers && python expense_snapshot.py
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import zlib
+from collections.abc import Iterator, Sequence
+from datetime import date
+from pathlib import Path
+from typing import Any, overload
+
+import numpy as np
+from expense_locks import file_lock
+from expense_records import Expense, iter_expenses
+from expense_table import ExpenseTable
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+_CHECKSUM_CHUNK_SIZE = 1 << 20
+_ITER_BLOCK_SIZE = 4096
+_COLUMNS = ("days", "cents", "categories", "payment_methods", "descriptions", "description_offsets")
+
+
+def prefix_checksum(file, offset: int, start: int = 0, checksum: int = 0) -> int:
+    """
+    Return the CRC-32 of a file's first `offset` bytes, read in chunks, to detect files rewritten in place.
+
+    To extend a known checksum, pass the checksum of the first `start` bytes; only the bytes after them are read.
+    """
+    file.seek(start)
+    remaining = offset - start
+    while remaining > 0:
+        chunk = file.read(min(remaining, _CHECKSUM_CHUNK_SIZE))
+        if not chunk:
+            break
+        checksum = zlib.crc32(chunk, checksum)
+        remaining -= len(chunk)
+    return checksum
+
+
+class ExpenseSnapshot(Sequence[Expense]):
+    """
+    Read-only, memory-mapped columnar snapshot of the expenses at the start of a CSV file.
+
+    Columns are exposed as NumPy arrays for vectorized consumers; indexing or iterating
+    the snapshot materializes Expense records on demand.
+    """
+
+    def __init__(self, directory: Path, manifest: dict[str, Any]):
+        self.directory = directory
+        self.csv_offset: int = manifest["csv_offset"]
+        self.csv_checksum: int = manifest["csv_checksum"]
+        self.category_names: list[str] = manifest["categories"]
+        self.payment_method_names: list[str] = manifest["payment_methods"]
+        self.days, self.cents, self.categories, self.payment_methods, self.descriptions, self.description_offsets = (
+            np.load(directory / f"{name}.npy", mmap_mode="r") for name in _COLUMNS
+        )
+
+    @classmethod
+    def open(cls, directory: Path, csv_path: Path) -> "ExpenseSnapshot | None":
+        """Open the snapshot if it exists and still describes the start of the CSV file, else return None."""
+        try:
+            manifest = json.loads((directory / MANIFEST_FILE).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring snapshot {directory} with unsupported version {manifest.get('version')}")
+            return None
+
+        with open(csv_path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            if (
+                stat.st_ino != manifest["csv_inode"]
+                or stat.st_size < manifest["csv_offset"]
+                or prefix_checksum(file, manifest["csv_offset"]) != manifest["csv_checksum"]
+            ):
+                logger.warning(f"Ignoring snapshot {directory}: {csv_path} was rewritten since it was taken")
+                return None
+        return cls(directory, manifest)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    @overload
+    def __getitem__(self, index: int) -> Expense: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Expense]: ...
+
+    def __getitem__(self, index: int | slice) -> Expense | list[Expense]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("snapshot index out of range")
+        start, end = self.description_offsets[index], self.description_offsets[index + 1]
+        return Expense(
+            date=date.fromordinal(int(self.days[index])),
+            cents=int(self.cents[index]),
+            category=self.category_names[self.categories[index]],
+            description=bytes(self.descriptions[start:end]).decode("utf-8"),
+            payment_method=self.payment_method_names[self.payment_methods[index]],
+        )
+
+    def __iter__(self) -> Iterator[Expense]:
+        # Convert the columns in blocks, which is much faster than indexing NumPy arrays row by row
+        for start in range(0, len(self), _ITER_BLOCK_SIZE):
+            end = min(start + _ITER_BLOCK_SIZE, len(self))
+            offsets = self.description_offsets[start : end + 1]
+            descriptions = bytes(self.descriptions[offsets[0] : offsets[-1]])
+            offsets = (offsets - offsets[0]).tolist()
+            rows = zip(
+                self.days[start:end].tolist(),
+                self.cents[start:end].tolist(),
+                self.categories[start:end].tolist(),
+                self.payment_methods[start:end].tolist(),
+                offsets,
+                offsets[1:],
+            )
+            for day, cents, category, payment_method, description_start, description_end in rows:
+                yield Expense(
+                    date=date.fromordinal(day),
+                    cents=cents,
+                    category=self.category_names[category],
+                    description=descriptions[description_start:description_end].decode("utf-8"),
+                    payment_method=self.payment_method_names[payment_method],
+                )
+
+
+def write_snapshot(csv_path: Path, directory: Path) -> int:
+    """
+    Compact the CSV file into a columnar snapshot, replacing any previous snapshot.
+
+    Returns:
+        The number of expenses in the snapshot.
+    """
+    with open(csv_path, "rb") as file, file_lock(file):
+        stat = os.fstat(file.fileno())
+        data = file.read(stat.st_size)
+        # Only cover complete lines, in case a row is being appended right now
+        csv_offset = data.rfind(b"\n") + 1
+    csv_checksum = zlib.crc32(memoryview(data)[:csv_offset])
+
+    text = data[:csv_offset].decode("utf-8")
+    table = ExpenseTable(iter_expenses(io.StringIO(text, newline=""), str(csv_path)))
+
+    descriptions = [description.encode("utf-8") for description in table.descriptions]
+    columns = {
+        "days": np.frombuffer(table.days, dtype=np.int32),
+        "cents": np.frombuffer(table.cents, dtype=np.int64),
+        "categories": np.frombuffer(table.categories, dtype=np.int16),
+        "payment_methods": np.frombuffer(table.payment_methods, dtype=np.int16),
+        "descriptions": np.frombuffer(b"".join(descriptions), dtype=np.uint8),
+        "description_offsets": np.concatenate(
+            ([0], np.cumsum([len(description) for description in descriptions], dtype=np.int64))
+        ).astype(np.int64),
+    }
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "rows": len(table),
+        "csv_offset": csv_offset,
+        "csv_inode": stat.st_ino,
+        "csv_checksum": csv_checksum,
+        "categories": table.category_codes.names,
+        "payment_methods": table.payment_method_codes.names,
+    }
+
+    # Write next to the target and swap directories, so readers never see a partial snapshot
+    staging = directory.with_name(f"{directory.name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    for name, column in columns.items():
+        np.save(staging / f"{name}.npy", column)
+    (staging / MANIFEST_FILE).write_text(json.dumps(manifest), encoding="utf-8")
+
+    previous = directory.with_name(f"{directory.name}.old")
+    if directory.exists():
+        directory.rename(previous)
+    staging.rename(directory)
+    shutil.rmtree(previous, ignore_errors=True)
+    return len(table)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Compact the expenses CSV file into a columnar snapshot.")
+    parser.add_argument("--csv", type=Path, default=script_dir / "expenses.csv", help="Expenses CSV file")
+    parser.add_argument(
+        "--snapshot-dir", type=Path, default=script_dir / "expenses.snapshot", help="Snapshot output directory"
+    )
+    args = parser.parse_args()
+
+    rows = write_snapshot(args.csv, args.snapshot_dir)
+    logger.info(f"Wrote snapshot of {rows} expenses from {args.csv} to {args.snapshot_dir}")
+
+
+if __name__ == "__main__":
+    main()
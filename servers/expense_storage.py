@@ -0,0 +1,889 @@
+"""
+Storage engines for the local expense servers.
+
+The servers talk to an ExpenseStore, which hides whether expenses live in the CSV
+file (CsvExpenseStore, the default), in a CSV file too large to cache as records
+(MmapCsvExpenseStore, which scans it through a memory map), in one CSV file per month
+next to it (PartitionedExpenseStore, see expense_partitions) or in a SQLite database
+(SqliteExpenseStore). The engine is selected with the EXPENSES_STORAGE environment
+variable ("csv", "csv-mmap", "csv-partitioned" or "sqlite").
+
+The SQLite engine runs in WAL mode, so readers never block the writer and vice versa.
+It keeps one dedicated writer connection plus one reader connection per thread, uses
+parameterized statements (which sqlite3 prepares once and caches per connection), and
+indexes dates, categories and payment methods so range queries do not scan the table.
+Description searches narrow rows down with LIKE and match word prefixes in Python; the
+CSV engines keep an in-memory inverted index instead (see expense_search). Daily rollups
+are maintained by an INSERT trigger, so period questions read the expense_daily_rollups
+table instead of the expenses; the CSV engines keep rollup tables in memory instead
+(see expense_rollups). Every engine also keeps a hash index of expense fingerprints, so
+the writer can check added expenses for duplicates without a scan (see expense_dedup).
+
+Import an existing CSV ledger into SQLite, or split it into month partitions, with:
+    cd servers && python expense_storage.py import-csv
+    cd servers && python expense_storage.py partition-csv
+"""
+
+import argparse
+import io
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterable, Sequence
+from datetime import date
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from expense_cache import ExpenseCache, append_expenses, file_signature
+from expense_columns import ExpenseColumns, SpendingSummary
+from expense_dedup import ExpenseFingerprints, expense_fingerprint, fingerprint_key
+from expense_index import ExpenseDateIndex
+from expense_pages import FIRST_PAGE_CURSOR, InvalidCursorError, decode_cursor, encode_cursor, read_csv_page
+from expense_partitions import (
+    compact_partition,
+    list_months,
+    partition_month,
+    partition_path,
+    partition_signature,
+    read_partition,
+    split_csv,
+)
+from expense_records import Expense, iter_expenses
+from expense_rollups import ExpenseRollups, RollupPeriod, SpendingRollup, group_rollups, merge_rollups
+from expense_scan import CsvScan, ScannedExpenses
+from expense_search import ExpenseSearchIndex, matches, tokenize
+from expense_table import ExpenseTable
+
+logger = logging.getLogger(__name__)
+
+
+class ExpenseStore(ABC):
+    """Interface shared by the expense storage engines."""
+
+    @abstractmethod
+    def append_many(self, expenses: list[Expense], fsync: bool = False) -> None:
+        """Durably append expenses in one write or transaction (fsync controls flushing to stable storage)."""
+
+    @abstractmethod
+    def expenses(self) -> Sequence[Expense]:
+        """Return every stored expense in insertion order."""
+
+    @abstractmethod
+    def page(self, cursor: str, limit: int) -> tuple[list[Expense], str | None]:
+        """
+        Return one page of expenses in insertion order and the cursor of the next page.
+
+        Raises:
+            InvalidCursorError: If the cursor is malformed or no longer valid.
+        """
+
+    @abstractmethod
+    def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        """Return the expenses matching every given filter, ordered by date."""
+
+    @abstractmethod
+    def summarize(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        """Return spending aggregates over the matching expenses, and the largest of them."""
+
+    @abstractmethod
+    def search(self, text: str) -> list[Expense]:
+        """Return the expenses whose description matches every word of `text` as a prefix, ordered by date."""
+
+    @abstractmethod
+    def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        """Return the spending per day, week or month of the matching expenses, ordered by period."""
+
+    @abstractmethod
+    def find_duplicates(self, expenses: list[Expense]) -> list[bool]:
+        """For each expense, whether it duplicates a stored expense or an earlier one of `expenses`."""
+
+    def close(self) -> None:
+        """Release any resources held by the store."""
+
+
+class CsvExpenseStore(ExpenseStore):
+    """Expenses stored in a CSV file, served from an in-memory cache with date and columnar indexes."""
+
+    def __init__(self, path: Path, snapshot_dir: Path | None = None):
+        self.path = path
+        self.date_index = ExpenseDateIndex()
+        self.columns = ExpenseColumns()
+        self.search_index = ExpenseSearchIndex()
+        self.rollups = ExpenseRollups()
+        self.fingerprints = ExpenseFingerprints()
+        self.cache = ExpenseCache(
+            path,
+            indexes=[self.date_index, self.columns, self.search_index, self.rollups, self.fingerprints],
+            snapshot_dir=snapshot_dir,
+        )
+
+    def append_many(self, expenses: list[Expense], fsync: bool = False) -> None:
+        self.cache.append_many(expenses, fsync)
+
+    def expenses(self) -> Sequence[Expense]:
+        return self.cache.expenses()
+
+    def page(self, cursor: str, limit: int) -> tuple[list[Expense], str | None]:
+        return read_csv_page(self.path, cursor, limit)
+
+    def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        with self.cache.locked() as expenses:
+            row_ids = self.date_index.query(start_date, end_date, category, payment_method)
+            return [expenses[row_id] for row_id in row_ids]
+
+    def summarize(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        with self.cache.locked() as expenses:
+            summary = self.columns.summarize(start_date, end_date, category)
+            largest = expenses[summary.largest_row_id] if summary.largest_row_id is not None else None
+            return summary, largest
+
+    def search(self, text: str) -> list[Expense]:
+        with self.cache.locked() as expenses:
+            matches = [expenses[row_id] for row_id in self.search_index.search(text)]
+        return sorted(matches, key=lambda expense: expense.date)
+
+    def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        with self.cache.locked():
+            return self.rollups.query(period, start_date, end_date, category, payment_method)
+
+    def find_duplicates(self, expenses: list[Expense]) -> list[bool]:
+        with self.cache.locked():
+            return self.fingerprints.find_duplicates(expenses)
+
+
+class MmapCsvExpenseStore(ExpenseStore):
+    """
+    Expenses stored in a CSV file and scanned through a memory map instead of being cached as records.
+
+    Queries and summaries only parse the columns they need (see expense_scan) and materialize
+    just the matching rows, so multi-GB ledgers never have to fit in memory as Expense objects.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._scan: CsvScan | None = None
+        self._columns: ExpenseColumns | None = None
+        self._search_index: ExpenseSearchIndex | None = None
+        self._rollups: ExpenseRollups | None = None
+        # Kept across rescans with the file signature it covers, so appends are fingerprinted row by row
+        self._fingerprints: ExpenseFingerprints | None = None
+        self._fingerprints_signature: tuple[int, int, int] | None = None
+
+    def _current_scan(self) -> CsvScan:
+        """Return the scan of the file, rescanning it if it changed. Must be called with the lock held."""
+        if self._scan is None or self._scan.signature != file_signature(os.stat(self.path)):
+            # The previous scan is not closed, since listings from expenses() may still read it;
+            # its mapping goes away with the last of them
+            self._scan = CsvScan(self.path)
+            self._scan.validate()
+            self._columns = None
+            self._search_index = None
+            self._rollups = None
+        return self._scan
+
+    def append_many(self, expenses: list[Expense], fsync: bool = False) -> None:
+        before, after, _ = append_expenses(self.path, expenses, fsync)
+        with self._lock:
+            if self._fingerprints is not None and before == self._fingerprints_signature:
+                # Nobody else wrote since the index was brought up to date, so it only lacks these expenses
+                self._fingerprints.extend(expenses)
+                self._fingerprints_signature = after
+
+    def expenses(self) -> Sequence[Expense]:
+        with self._lock:
+            # Rows are only materialized when accessed, so a listing decodes just the rows it shows
+            return ScannedExpenses(self._current_scan())
+
+    def page(self, cursor: str, limit: int) -> tuple[list[Expense], str | None]:
+        return read_csv_page(self.path, cursor, limit)
+
+    def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        with self._lock:
+            scan = self._current_scan()
+            days = scan.days()
+            mask = np.ones(len(scan), dtype=bool)
+            if start_date is not None:
+                mask &= days >= start_date.toordinal()
+            if end_date is not None:
+                mask &= days <= end_date.toordinal()
+            for value, column in ((category, scan.categories), (payment_method, scan.payment_methods)):
+                if value is not None:
+                    codes, names = column()
+                    name = value.strip().casefold()
+                    mask &= codes == (names.index(name) if name in names else -1)
+            row_ids = np.flatnonzero(mask)
+            row_ids = row_ids[np.argsort(days[row_ids], kind="stable")]
+            return [scan.expense(row_id) for row_id in row_ids.tolist()]
+
+    def summarize(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        with self._lock:
+            scan = self._current_scan()
+            if self._columns is None:
+                self._columns = ExpenseColumns()
+                self._columns.load(scan.days(), scan.cents(), *scan.categories(), *scan.payment_methods())
+            summary = self._columns.summarize(start_date, end_date, category)
+            largest = scan.expense(summary.largest_row_id) if summary.largest_row_id is not None else None
+            return summary, largest
+
+    def search(self, text: str) -> list[Expense]:
+        with self._lock:
+            scan = self._current_scan()
+            if self._search_index is None:
+                # Descriptions are only decoded here, once per scan of the file, from their own bytes
+                self._search_index = ExpenseSearchIndex()
+                self._search_index.index_descriptions(scan.descriptions())
+            row_ids = np.array(self._search_index.search(text), dtype=np.int64)
+            row_ids = row_ids[np.argsort(scan.days()[row_ids], kind="stable")]
+            return [scan.expense(row_id) for row_id in row_ids.tolist()]
+
+    def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        with self._lock:
+            scan = self._current_scan()
+            if self._rollups is None:
+                self._rollups = ExpenseRollups()
+                self._rollups.load(scan.days(), scan.cents(), *scan.categories(), *scan.payment_methods())
+            return self._rollups.query(period, start_date, end_date, category, payment_method)
+
+    def find_duplicates(self, expenses: list[Expense]) -> list[bool]:
+        with self._lock:
+            if self._fingerprints_signature != file_signature(os.stat(self.path)):
+                self._update_fingerprints()
+            return self._fingerprints.find_duplicates(expenses)
+
+    def _update_fingerprints(self) -> None:
+        """
+        Bring the fingerprint index up to date with the file. Must be called with the lock held.
+
+        If the file only grew since the index was last updated, just the rows starting past the
+        bytes it covers are fingerprinted; otherwise every row is. Like the rest of this store,
+        this trusts the file signature, so a rewrite in place that does not shrink the file is
+        not noticed by the index.
+        """
+        scan = self._current_scan()
+        previous = self._fingerprints_signature
+        if self._fingerprints is not None and previous[0] == scan.signature[0] and previous[1] <= scan.signature[1]:
+            row_ids = range(scan.first_row_at(previous[1]), len(scan))
+        else:
+            self._fingerprints = ExpenseFingerprints()
+            row_ids = range(len(scan))
+        self._fingerprints.extend(scan.expense(row_id) for row_id in row_ids)
+        self._fingerprints_signature = scan.signature
+
+    def close(self) -> None:
+        if self._scan is not None:
+            self._scan.close()
+
+
+class _Partition:
+    """One loaded month of a partitioned store, with the same lazily built indexes as the CSV cache."""
+
+    def __init__(self, expenses: list[Expense], signature: tuple):
+        self.signature = signature
+        self.expenses = ExpenseTable(expenses)
+        self.date_index = ExpenseDateIndex()
+        self.search_index = ExpenseSearchIndex()
+        self.rollups = ExpenseRollups()
+        self.fingerprints = ExpenseFingerprints()
+        for index in self._indexes():
+            index.rebuild(self.expenses)
+
+    def add(self, expenses: list[Expense]) -> None:
+        for expense in expenses:
+            for index in self._indexes():
+                index.add(len(self.expenses), expense)
+            self.expenses.append(expense)
+
+    def _indexes(self) -> tuple:
+        return self.date_index, self.search_index, self.rollups, self.fingerprints
+
+
+class PartitionedExpenseStore(ExpenseStore):
+    """
+    Expenses stored in one CSV file per month, closed months optionally compressed (see expense_partitions).
+
+    Date-bounded reads only load the months overlapping their range, and appends only touch
+    the months of the added expenses. Loaded months are cached with their own indexes, the
+    MAX_CACHED_PARTITIONS most recently used ones at most, and reloaded when their files
+    change. Reads without a date range (listings, searches) visit every month in order, so
+    the store lists expenses by month rather than in insertion order.
+    """
+
+    MAX_CACHED_PARTITIONS = 36
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._partitions: OrderedDict[date, _Partition] = OrderedDict()
+
+    def _partition(self, month: date) -> _Partition:
+        """Return a loaded month, reading it first if its files changed. Must be called with the lock held."""
+        partition = self._partitions.get(month)
+        if partition is None or partition.signature != partition_signature(self.directory, month):
+            partition = self._partitions[month] = _Partition(*read_partition(self.directory, month))
+        self._partitions.move_to_end(month)
+        while len(self._partitions) > self.MAX_CACHED_PARTITIONS:
+            self._partitions.popitem(last=False)
+        return partition
+
+    def _months(self, start_date: date | None = None, end_date: date | None = None) -> list[date]:
+        """Return the stored months overlapping the date range, in order."""
+        low = partition_month(start_date) if start_date is not None else None
+        high = partition_month(end_date) if end_date is not None else None
+        return [
+            month
+            for month in list_months(self.directory)
+            if (low is None or month >= low) and (high is None or month <= high)
+        ]
+
+    def append_many(self, expenses: list[Expense], fsync: bool = False) -> None:
+        by_month: dict[date, list[Expense]] = defaultdict(list)
+        for expense in expenses:
+            by_month[partition_month(expense.date)].append(expense)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for month, month_expenses in by_month.items():
+                before, after, _ = append_expenses(partition_path(self.directory, month), month_expenses, fsync)
+                partition = self._partitions.get(month)
+                plain_signature = partition.signature[0] if partition is not None else None
+                if partition is not None and (plain_signature == before or (plain_signature is None and not before[1])):
+                    # The file was unchanged since it was loaded, so the loaded month stays exact
+                    partition.add(month_expenses)
+                    partition.signature = (after, partition.signature[1])
+                # Otherwise the month is reloaded on its next read
+
+    def expenses(self) -> Sequence[Expense]:
+        with self._lock:
+            return [expense for month in self._months() for expense in self._partition(month).expenses]
+
+    def page(self, cursor: str, limit: int) -> tuple[list[Expense], str | None]:
+        with self._lock:
+            months = self._months()
+            position, offset = 0, 0
+            if cursor != FIRST_PAGE_CURSOR:
+                state = decode_cursor(cursor)
+                month_name, offset = state.get("month"), state.get("offset")
+                month_names = [f"{month:%Y-%m}" for month in months]
+                if month_name not in month_names or not isinstance(offset, int) or offset < 0:
+                    raise InvalidCursorError("Cursor does not match the current expense partitions")
+                position = month_names.index(month_name)
+
+            expenses: list[Expense] = []
+            while position < len(months) and len(expenses) < limit:
+                rows = self._partition(months[position]).expenses
+                if offset > len(rows):
+                    raise InvalidCursorError("Cursor does not match the current expense partitions")
+                page = rows[offset : offset + limit - len(expenses)]
+                expenses.extend(page)
+                offset += len(page)
+                if offset >= len(rows):
+                    position, offset = position + 1, 0
+            if position >= len(months):
+                return expenses, None
+            return expenses, encode_cursor({"month": f"{months[position]:%Y-%m}", "offset": offset})
+
+    def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        with self._lock:
+            matches = []
+            for month in self._months(start_date, end_date):
+                partition = self._partition(month)
+                row_ids = partition.date_index.query(start_date, end_date, category, payment_method)
+                matches.extend(partition.expenses[row_id] for row_id in row_ids)
+            return matches
+
+    def summarize(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        # Aggregate the matching rows of the overlapping months, with the same code as the other engines
+        matches = ExpenseTable(self.query(start_date, end_date, category))
+        columns = ExpenseColumns()
+        columns.rebuild(matches)
+        summary = columns.summarize(start_date, end_date, category)
+        largest = matches[summary.largest_row_id] if summary.largest_row_id is not None else None
+        return summary, largest
+
+    def search(self, text: str) -> list[Expense]:
+        with self._lock:
+            matches = []
+            for month in self._months():
+                partition = self._partition(month)
+                month_matches = [partition.expenses[row_id] for row_id in partition.search_index.search(text)]
+                matches.extend(sorted(month_matches, key=lambda expense: expense.date))
+            return matches
+
+    def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        with self._lock:
+            return merge_rollups(
+                self._partition(month).rollups.query(period, start_date, end_date, category, payment_method)
+                for month in self._months(start_date, end_date)
+            )
+
+    def find_duplicates(self, expenses: list[Expense]) -> list[bool]:
+        # Duplicates have the same date, so each expense is only checked against its own month
+        positions: dict[date, list[int]] = defaultdict(list)
+        for position, expense in enumerate(expenses):
+            positions[partition_month(expense.date)].append(position)
+        duplicates = [False] * len(expenses)
+        with self._lock:
+            for month, month_positions in positions.items():
+                month_duplicates = self._partition(month).fingerprints.find_duplicates(
+                    [expenses[position] for position in month_positions]
+                )
+                for position, duplicate in zip(month_positions, month_duplicates):
+                    duplicates[position] = duplicate
+        return duplicates
+
+    def compress(self, codec: str, before: date) -> list[tuple[date, int, int]]:
+        """
+        Compress the months before `before` into archives with `codec` (see compact_partition).
+
+        Returns:
+            The compressed months, with the size in bytes of their files before and after.
+        """
+        compressed = []
+        for month in self._months(end_date=before):
+            if month < partition_month(before):
+                sizes = compact_partition(self.directory, month, codec)
+                if sizes != (0, 0):
+                    compressed.append((month, *sizes))
+        return compressed
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    category TEXT NOT NULL COLLATE NOCASE,
+    description TEXT NOT NULL,
+    payment_method TEXT NOT NULL COLLATE NOCASE,
+    fingerprint INTEGER
+);
+CREATE INDEX IF NOT EXISTS expenses_date ON expenses (date);
+CREATE INDEX IF NOT EXISTS expenses_category_date ON expenses (category, date);
+CREATE INDEX IF NOT EXISTS expenses_payment_method_date ON expenses (payment_method, date);
+CREATE TABLE IF NOT EXISTS expense_daily_rollups (
+    date TEXT NOT NULL,
+    category TEXT NOT NULL COLLATE NOCASE,
+    payment_method TEXT NOT NULL COLLATE NOCASE,
+    count INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    PRIMARY KEY (date, category, payment_method)
+) WITHOUT ROWID;
+"""
+_ROLLUP_TRIGGER = """
+CREATE TRIGGER expenses_rollup AFTER INSERT ON expenses BEGIN
+    INSERT INTO expense_daily_rollups (date, category, payment_method, count, amount_cents)
+    VALUES (NEW.date, NEW.category, NEW.payment_method, 1, NEW.amount_cents)
+    ON CONFLICT DO UPDATE SET count = count + 1, amount_cents = amount_cents + excluded.amount_cents;
+END
+"""
+_ROLLUP_BACKFILL = """
+INSERT INTO expense_daily_rollups (date, category, payment_method, count, amount_cents)
+SELECT date, category, payment_method, COUNT(*), SUM(amount_cents) FROM expenses GROUP BY 1, 2, 3
+"""
+_ROLLUP_PERIODS = {
+    RollupPeriod.DAY: "date",
+    RollupPeriod.WEEK: "date(date, '-6 days', 'weekday 1')",
+    RollupPeriod.MONTH: "strftime('%Y-%m-01', date)",
+}
+_COLUMNS = "date, amount_cents, category, description, payment_method"
+_INSERT = f"INSERT INTO expenses ({_COLUMNS}, fingerprint) VALUES (?, ?, ?, ?, ?, ?)"
+_SELECT_FINGERPRINT = "SELECT 1 FROM expenses WHERE fingerprint = ? LIMIT 1"
+_SELECT_ALL = f"SELECT {_COLUMNS} FROM expenses ORDER BY id"
+_SELECT_PAGE = f"SELECT id, {_COLUMNS} FROM expenses WHERE id > ? ORDER BY id LIMIT ?"
+_IMPORT_CHUNK_SIZE = 10_000
+
+
+def _to_params(expense: Expense) -> tuple[str, int, str, str, str, int]:
+    """Convert an expense to INSERT parameters, storing the amount in integer cents."""
+    return (
+        expense.date.isoformat(),
+        expense.cents,
+        expense.category,
+        expense.description,
+        expense.payment_method,
+        fingerprint_key(expense_fingerprint(expense)),
+    )
+
+
+def _from_row(row: Sequence) -> Expense:
+    """Convert a (date, amount_cents, category, description, payment_method) row to an expense."""
+    date_iso, amount_cents, category, description, payment_method = row
+    return Expense(date.fromisoformat(date_iso), amount_cents, category, description, payment_method)
+
+
+def _filters(
+    start_date: date | None, end_date: date | None, category: str | None, payment_method: str | None
+) -> tuple[str, list[str]]:
+    """Build a WHERE clause and its parameters for the optional filters."""
+    clauses, params = [], []
+    if start_date is not None:
+        clauses.append("date >= ?")
+        params.append(start_date.isoformat())
+    if end_date is not None:
+        clauses.append("date <= ?")
+        params.append(end_date.isoformat())
+    if category is not None:
+        clauses.append("category = ?")
+        params.append(category)
+    if payment_method is not None:
+        clauses.append("payment_method = ?")
+        params.append(payment_method)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+class SqliteExpenseStore(ExpenseStore):
+    """Expenses stored in a SQLite database in WAL mode."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._readers = threading.local()
+        # Every reader ever opened, so close() can close them from whichever thread calls it
+        self._reader_connections: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._writer = self._connect(check_same_thread=False)
+        self._writer.executescript(_SCHEMA)
+        self._create_rollup_trigger()
+        self._create_fingerprint_index()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        """Open a connection in WAL mode. Transactions are managed explicitly (autocommit mode)."""
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=check_same_thread)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _create_rollup_trigger(self) -> None:
+        """Create the trigger maintaining the daily rollups, backfilling them for databases created without it."""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                exists = self._writer.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'expenses_rollup'"
+                ).fetchone()
+                if not exists:
+                    self._writer.execute(_ROLLUP_TRIGGER)
+                    self._writer.execute(_ROLLUP_BACKFILL)
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+
+    def _create_fingerprint_index(self) -> None:
+        """Index expense fingerprints, first adding and filling the column for databases created without it."""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in self._writer.execute("PRAGMA table_info(expenses)")}
+                if "fingerprint" not in columns:
+                    self._writer.execute("ALTER TABLE expenses ADD COLUMN fingerprint INTEGER")
+                rows = self._writer.execute(f"SELECT id, {_COLUMNS} FROM expenses WHERE fingerprint IS NULL").fetchall()
+                self._writer.executemany(
+                    "UPDATE expenses SET fingerprint = ? WHERE id = ?",
+                    ((fingerprint_key(expense_fingerprint(_from_row(row[1:]))), row[0]) for row in rows),
+                )
+                self._writer.execute("CREATE INDEX IF NOT EXISTS expenses_fingerprint ON expenses (fingerprint)")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+
+    def _reader(self) -> sqlite3.Connection:
+        """Return this thread's reader connection, opening it on first use."""
+        connection = getattr(self._readers, "connection", None)
+        if connection is None:
+            # Only this thread uses it, but close() may run in another one
+            connection = self._readers.connection = self._connect(check_same_thread=False)
+            with self._readers_lock:
+                self._reader_connections.append(connection)
+        return connection
+
+    def append_many(self, expenses: Iterable[Expense], fsync: bool = False) -> None:
+        with self._write_lock:
+            # In WAL mode, synchronous=FULL syncs the log on every commit and NORMAL only at checkpoints
+            self._writer.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.executemany(_INSERT, (_to_params(expense) for expense in expenses))
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+
+    def import_csv(self, csv_path: Path) -> int:
+        """Bulk-import a CSV ledger in chunked transactions and return the number of imported expenses."""
+        imported = 0
+        with open(csv_path, "rb") as file:
+            # Rows are parsed as they are inserted, so only one chunk is held in memory
+            expenses = iter_expenses(io.TextIOWrapper(file, encoding="utf-8", newline=""), str(csv_path))
+            while chunk := list(islice(expenses, _IMPORT_CHUNK_SIZE)):
+                self.append_many(chunk)
+                imported += len(chunk)
+        return imported
+
+    def expenses(self) -> Sequence[Expense]:
+        return [_from_row(row) for row in self._reader().execute(_SELECT_ALL)]
+
+    def page(self, cursor: str, limit: int) -> tuple[list[Expense], str | None]:
+        last_id = 0
+        if cursor != FIRST_PAGE_CURSOR:
+            last_id = decode_cursor(cursor).get("id")
+            if not isinstance(last_id, int):
+                raise InvalidCursorError(f"Malformed cursor: {cursor}")
+
+        # Fetch one extra row to learn whether there is a next page
+        rows = self._reader().execute(_SELECT_PAGE, (last_id, limit + 1)).fetchall()
+        expenses = [_from_row(row[1:]) for row in rows[:limit]]
+        if len(rows) <= limit:
+            return expenses, None
+        return expenses, encode_cursor({"id": rows[limit - 1][0]})
+
+    def query(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[Expense]:
+        where, params = _filters(start_date, end_date, category, payment_method)
+        rows = self._reader().execute(f"SELECT {_COLUMNS} FROM expenses {where} ORDER BY date, id", params)
+        return [_from_row(row) for row in rows]
+
+    def summarize(
+        self,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+    ) -> tuple[SpendingSummary, Expense | None]:
+        where, params = _filters(start_date, end_date, category, None)
+        reader = self._reader()
+        count, total_cents, first_date, last_date = reader.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(amount_cents), 0), MIN(date), MAX(date) FROM expenses {where}", params
+        ).fetchone()
+        if not count:
+            return SpendingSummary(0, 0, None, None, 0.0, 0.0, None), None
+
+        first = start_date or date.fromisoformat(first_date)
+        last = end_date or date.fromisoformat(last_date)
+        day_span = max(1, (last - first).days + 1)
+
+        by_category: dict[str, int] = defaultdict(int)
+        for name, cents in reader.execute(
+            f"SELECT lower(category), SUM(amount_cents) FROM expenses {where} GROUP BY 1", params
+        ):
+            by_category[name] += cents
+        by_payment_method = {
+            name: (payment_count, cents)
+            for name, payment_count, cents in reader.execute(
+                f"SELECT lower(payment_method), COUNT(*), SUM(amount_cents) FROM expenses {where} GROUP BY 1", params
+            )
+        }
+        largest = reader.execute(
+            f"SELECT {_COLUMNS} FROM expenses {where} ORDER BY amount_cents DESC, id LIMIT 1", params
+        ).fetchone()
+
+        summary = SpendingSummary(
+            count=count,
+            total_cents=total_cents,
+            first_date=date.fromisoformat(first_date),
+            last_date=date.fromisoformat(last_date),
+            daily_average_cents=total_cents / day_span,
+            weekly_average_cents=total_cents * 7 / day_span,
+            largest_row_id=None,
+            by_category=dict(by_category),
+            by_payment_method=by_payment_method,
+        )
+        return summary, _from_row(largest)
+
+    def search(self, text: str) -> list[Expense]:
+        terms = tokenize(text)
+        if not terms:
+            return []
+        # LIKE narrows the rows down in SQLite (it only folds ASCII case), then the terms are matched as prefixes
+        clauses, params = [], []
+        for term in terms:
+            if term.isascii():
+                clauses.append("description LIKE ? ESCAPE '\\'")
+                params.append("%" + term.replace("_", "\\_") + "%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(f"SELECT {_COLUMNS} FROM expenses {where} ORDER BY date, id", params)
+        return [expense for expense in map(_from_row, rows) if matches(terms, expense.description)]
+
+    def rollup(
+        self,
+        period: RollupPeriod,
+        start_date: date | None = None,
+        end_date: date | None = None,
+        category: str | None = None,
+        payment_method: str | None = None,
+    ) -> list[SpendingRollup]:
+        where, params = _filters(start_date, end_date, category, payment_method)
+        rows = self._reader().execute(
+            f"SELECT {_ROLLUP_PERIODS[period]}, lower(category), SUM(count), SUM(amount_cents) "
+            f"FROM expense_daily_rollups {where} GROUP BY 1, 2",
+            params,
+        )
+        return group_rollups(
+            ((date.fromisoformat(start), category, count, cents) for start, category, count, cents in rows), period
+        )
+
+    def find_duplicates(self, expenses: list[Expense]) -> list[bool]:
+        reader = self._reader()
+        duplicates, seen = [], set()
+        for expense in expenses:
+            key = fingerprint_key(expense_fingerprint(expense))
+            duplicates.append(key in seen or reader.execute(_SELECT_FINGERPRINT, (key,)).fetchone() is not None)
+            seen.add(key)
+        return duplicates
+
+    def close(self) -> None:
+        with self._readers_lock:
+            for connection in self._reader_connections:
+                connection.close()
+            self._reader_connections.clear()
+        with self._write_lock:
+            self._writer.close()
+
+
+def create_expense_store(storage: str, csv_path: Path, sqlite_path: Path, snapshot_dir: Path | None) -> ExpenseStore:
+    """
+    Create the storage engine named by `storage`.
+
+    The partitioned engine keeps its months in a directory named after the CSV file (expenses/ for expenses.csv).
+
+    Raises:
+        ValueError: If the storage engine name is unknown.
+    """
+    storage = storage.lower()
+    if storage == "csv":
+        logger.info(f"Using CSV expense storage at {csv_path}")
+        return CsvExpenseStore(csv_path, snapshot_dir=snapshot_dir)
+    if storage == "csv-mmap":
+        logger.info(f"Using memory-mapped CSV expense storage at {csv_path}")
+        return MmapCsvExpenseStore(csv_path)
+    if storage == "csv-partitioned":
+        logger.info(f"Using month-partitioned CSV expense storage in {csv_path.with_suffix('')}")
+        return PartitionedExpenseStore(csv_path.with_suffix(""))
+    if storage == "sqlite":
+        logger.info(f"Using SQLite expense storage at {sqlite_path}")
+        return SqliteExpenseStore(sqlite_path)
+    raise ValueError(
+        f"Unknown expense storage engine: {storage} (expected 'csv', 'csv-mmap', 'csv-partitioned' or 'sqlite')"
+    )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Manage the expense storage engines.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import-csv", help="Bulk-import a CSV ledger into the SQLite database")
+    import_parser.add_argument("--csv", type=Path, default=script_dir / "expenses.csv", help="Expenses CSV file")
+    import_parser.add_argument("--db", type=Path, default=script_dir / "expenses.db", help="SQLite database file")
+    partition_parser = subparsers.add_parser("partition-csv", help="Split a CSV ledger into month partitions")
+    partition_parser.add_argument("--csv", type=Path, default=script_dir / "expenses.csv", help="Expenses CSV file")
+    partition_parser.add_argument("--dir", type=Path, default=script_dir / "expenses", help="Partition directory")
+    compress_parser = subparsers.add_parser("compress-partitions", help="Compress the closed month partitions")
+    compress_parser.add_argument("--dir", type=Path, default=script_dir / "expenses", help="Partition directory")
+    compress_parser.add_argument("--codec", choices=["gzip", "zstd"], default="gzip", help="Compression codec")
+    compress_parser.add_argument(
+        "--before",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="Compress the months before this date's month (default: every month before the current one)",
+    )
+    args = parser.parse_args()
+
+    if args.command == "import-csv":
+        store = SqliteExpenseStore(args.db)
+        try:
+            imported = store.import_csv(args.csv)
+        finally:
+            store.close()
+        logger.info(f"Imported {imported} expenses from {args.csv} into {args.db}")
+    elif args.command == "partition-csv":
+        count = split_csv(args.csv, args.dir)
+        logger.info(f"Split {count} expenses from {args.csv} into {len(list_months(args.dir))} months in {args.dir}")
+    elif args.command == "compress-partitions":
+        for month, before, after in PartitionedExpenseStore(args.dir).compress(args.codec, args.before):
+            logger.info(f"Compressed {month:%Y-%m}: {before} bytes -> {after} bytes")
+
+
+if __name__ == "__main__":
+    main()
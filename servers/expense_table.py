@@ -0,0 +1,130 @@
+"""
+Compact, array-backed storage of expense records.
+
+A list of Expense instances costs a Python object per row plus a date, an int and three
+string references, and a csv.DictReader row or a Cosmos DB item costs a whole dict of
+strings. ExpenseTable instead stores the rows as parallel array.array columns: the date
+as a day ordinal in array('i'), the amount in integer cents in array('q'), and category
+and payment method codes in array('h'). Only descriptions are kept as str objects.
+
+Codes are interned in an ExpenseCodes table that starts with the values of the shared
+Category and PaymentMethod enums, so every server numbers them the same way. Values
+that are not enum members (such as rows written before a category was removed) get the
+next free code, so rows round-trip exactly. Expense records are materialized on access,
+and the columns can be wrapped as NumPy arrays without copying with np.frombuffer.
+
+Run the memory benchmark with: cd servers && python bench_records.py
+"""
+
+import sys
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import date
+from enum import Enum
+from typing import overload
+
+from expense_records import Category, Expense, PaymentMethod
+
+
+class ExpenseCodes:
+    """Interned string values numbered in order of first appearance."""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.names: list[str] = []
+        self._codes: dict[str, int] = {}
+        for value in values:
+            self.code(value)
+
+    @classmethod
+    def from_enum(cls, enum: type[Enum]) -> "ExpenseCodes":
+        """Number the values of an enum in definition order."""
+        return cls(member.value for member in enum)
+
+    def code(self, value: str) -> int:
+        """Return the code of a value, assigning the next free code to new values."""
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.names)
+            self.names.append(sys.intern(value))
+        return code
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class ExpenseTable(Sequence[Expense]):
+    """
+    Struct-of-arrays storage of expenses that materializes Expense records on access.
+
+    Usage:
+        table = ExpenseTable(parse_expenses(...))
+        table.append(Expense(...))
+        expense = table[0]
+        total_cents = sum(table.cents)
+    """
+
+    def __init__(
+        self,
+        expenses: Iterable[Expense] = (),
+        category_codes: ExpenseCodes | None = None,
+        payment_method_codes: ExpenseCodes | None = None,
+    ):
+        self.category_codes = category_codes or ExpenseCodes.from_enum(Category)
+        self.payment_method_codes = payment_method_codes or ExpenseCodes.from_enum(PaymentMethod)
+        self.days = array("i")
+        self.cents = array("q")
+        self.categories = array("h")
+        self.payment_methods = array("h")
+        self.descriptions: list[str] = []
+        self.extend(expenses)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    @overload
+    def __getitem__(self, index: int) -> Expense: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Expense]: ...
+
+    def __getitem__(self, index: int | slice) -> Expense | list[Expense]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Expense(
+            date=date.fromordinal(self.days[index]),
+            cents=self.cents[index],
+            category=self.category_codes.names[self.categories[index]],
+            description=self.descriptions[index],
+            payment_method=self.payment_method_codes.names[self.payment_methods[index]],
+        )
+
+    def __iter__(self) -> Iterator[Expense]:
+        category_names, payment_method_names = self.category_codes.names, self.payment_method_codes.names
+        rows = zip(self.days, self.cents, self.categories, self.descriptions, self.payment_methods)
+        for day, cents, category, description, payment_method in rows:
+            yield Expense(
+                date.fromordinal(day),
+                cents,
+                category_names[category],
+                description,
+                payment_method_names[payment_method],
+            )
+
+    def append(self, expense: Expense) -> None:
+        """
+        Append one expense, interning its category and payment method.
+
+        The length is the length of the days column, which is appended last, so a reader in
+        another thread never sees a row whose other columns are not written yet.
+        """
+        day = expense.date.toordinal()
+        self.cents.append(expense.cents)
+        self.categories.append(self.category_codes.code(expense.category))
+        self.payment_methods.append(self.payment_method_codes.code(expense.payment_method))
+        self.descriptions.append(expense.description)
+        self.days.append(day)
+
+    def extend(self, expenses: Iterable[Expense]) -> None:
+        """Append expenses in order, without holding them all as records at once."""
+        for expense in expenses:
+            self.append(expense)
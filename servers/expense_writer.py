@@ -0,0 +1,199 @@
+"""
+Group-commit writer for appending expenses to the expense store.
+
+Tool calls hand their expenses to a single background task through an asyncio queue
+and await an acknowledgement. The task collects everything that arrives within a
+short window (or until the batch is full), appends the whole batch with one write
+(or one transaction) in a worker thread and then acknowledges every caller in the
+batch. This keeps the event loop free during I/O and means a burst of N concurrent
+calls costs one write instead of N.
+
+Durability is controlled by the fsync policy:
+- always: the batch is fsynced before its callers are acknowledged.
+- batch: callers are acknowledged once the batch is written, and the file is fsynced
+  whenever the queue drains, so a burst of batches costs a single fsync.
+- none: the file is never fsynced explicitly; flushing is left to the OS.
+
+For the SQLite engine, fsync means committing with synchronous=FULL.
+
+Since one task writes every batch, it also checks the batch for duplicates against the
+store's fingerprint index right before appending, without racing other calls in this
+process. Callers learn which of their expenses were duplicates; under the reject policy
+those are left out of the write (see expense_dedup). The check is not made under the
+storage's file lock or transaction though, so writers in other processes (such as other
+uvicorn workers) are not covered: two processes adding the same expense at the same
+moment can both append it. Across processes, duplicate detection is best effort.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from enum import Enum
+
+from expense_dedup import DuplicatePolicy
+from expense_records import Expense
+from expense_storage import ExpenseStore
+
+logger = logging.getLogger(__name__)
+
+
+class FsyncPolicy(Enum):
+    ALWAYS = "always"
+    BATCH = "batch"
+    NONE = "none"
+
+
+class ExpenseWriter:
+    """
+    Single background writer that batches appends to an ExpenseStore.
+
+    Usage:
+        expense_writer = ExpenseWriter(expense_store, fsync_policy=FsyncPolicy.BATCH)
+        duplicate = await expense_writer.submit(Expense(...))
+        duplicates = await expense_writer.submit_many([Expense(...), Expense(...)])
+    """
+
+    def __init__(
+        self,
+        store: ExpenseStore,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCH,
+        duplicate_policy: DuplicatePolicy = DuplicatePolicy.WARN,
+        max_batch_size: int = 256,
+        max_batch_delay: float = 0.005,
+    ):
+        """
+        Initialize the writer. The background task is started lazily on the first submit.
+
+        Args:
+            store: The storage engine the expenses are appended to.
+            fsync_policy: When to fsync the file (see module docstring).
+            duplicate_policy: Whether duplicates are written (see expense_dedup).
+            max_batch_size: Number of expenses after which a batch stops taking more submissions.
+            max_batch_delay: Seconds to wait for more expenses after the first one of a batch arrives.
+        """
+        self.store = store
+        self.fsync_policy = fsync_policy
+        self.duplicate_policy = duplicate_policy
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue: asyncio.Queue[tuple[list[Expense], asyncio.Future[list[bool]]]] | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @classmethod
+    def from_env(cls, store: ExpenseStore) -> "ExpenseWriter":
+        """Create a writer configured from the EXPENSES_FSYNC_POLICY and EXPENSES_DUPLICATE_POLICY variables."""
+        fsync_policy = FsyncPolicy(os.getenv("EXPENSES_FSYNC_POLICY", FsyncPolicy.BATCH.value).lower())
+        return cls(store, fsync_policy=fsync_policy, duplicate_policy=DuplicatePolicy.from_env())
+
+    async def submit(self, expense: Expense) -> bool:
+        """
+        Queue an expense for writing and wait until its batch has been written.
+
+        Returns:
+            Whether the expense duplicates a stored one (it was not written if the policy is reject).
+
+        Raises:
+            Exception: Whatever error the batch write raised, if it failed.
+        """
+        return (await self.submit_many([expense]))[0]
+
+    async def submit_many(self, expenses: list[Expense]) -> list[bool]:
+        """
+        Queue expenses for writing together and wait until their batch has been written.
+
+        The expenses are never split across batches, so they are written with a single write.
+
+        Returns:
+            For each expense, whether it duplicates a stored one or an earlier one of the batch
+            (duplicates were not written if the policy is reject).
+
+        Raises:
+            Exception: Whatever error the batch write raised, if it failed.
+        """
+        if self._task is None or self._task.done():
+            if self._queue is not None:
+                # A task cancelled before it ever ran leaves its queued callers unanswered
+                _fail_queued(self._queue)
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(self._queue), name="expense-writer")
+
+        acknowledgement = asyncio.get_running_loop().create_future()
+        await self._queue.put((expenses, acknowledgement))
+        return await acknowledgement
+
+    async def _run(self, queue: asyncio.Queue[tuple[list[Expense], asyncio.Future[list[bool]]]]) -> None:
+        """Write batches from the queue until the task is cancelled."""
+        try:
+            while True:
+                batch = [await queue.get()]
+                try:
+                    await self._write_batch(queue, batch)
+                finally:
+                    # If the task is cancelled (or dies) mid-batch, no caller of the batch is left waiting
+                    for _, acknowledgement in batch:
+                        _fail(acknowledgement)
+        finally:
+            _fail_queued(queue)
+
+    async def _write_batch(
+        self,
+        queue: asyncio.Queue[tuple[list[Expense], asyncio.Future[list[bool]]]],
+        batch: list[tuple[list[Expense], asyncio.Future[list[bool]]]],
+    ) -> None:
+        """Collect more submissions into the batch for up to max_batch_delay, write it and acknowledge its callers."""
+        batch_size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_batch_delay
+        while batch_size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except TimeoutError:
+                break
+            batch_size += len(batch[-1][0])
+
+        fsync = self.fsync_policy == FsyncPolicy.ALWAYS or (self.fsync_policy == FsyncPolicy.BATCH and queue.empty())
+        try:
+            expenses = [expense for submitted, _ in batch for expense in submitted]
+            duplicates = await asyncio.to_thread(self._write, expenses, fsync)
+        except Exception as e:
+            logger.error(f"Error writing batch of {batch_size} expenses: {str(e)}")
+            for _, acknowledgement in batch:
+                if not acknowledgement.done():
+                    acknowledgement.set_exception(e)
+        else:
+            start = 0
+            for submitted, acknowledgement in batch:
+                if not acknowledgement.done():
+                    acknowledgement.set_result(duplicates[start : start + len(submitted)])
+                start += len(submitted)
+
+    def _write(self, expenses: list[Expense], fsync: bool) -> list[bool]:
+        """Check a batch for duplicates and append it, without the duplicates under the reject policy."""
+        if self.duplicate_policy is DuplicatePolicy.ALLOW:
+            duplicates = [False] * len(expenses)
+        else:
+            # Only exact against this process's writes: another process may append between this check and the write
+            duplicates = self.store.find_duplicates(expenses)
+        if self.duplicate_policy is DuplicatePolicy.REJECT:
+            expenses = [expense for expense, duplicate in zip(expenses, duplicates) if not duplicate]
+        if expenses:
+            self.store.append_many(expenses, fsync)
+        return duplicates
+
+
+def _fail(acknowledgement: asyncio.Future[list[bool]]) -> None:
+    """Fail a caller's acknowledgement that the writer task stopped before answering, if it is still pending."""
+    if not acknowledgement.done():
+        acknowledgement.set_exception(
+            RuntimeError("the expense writer stopped before acknowledging the write; the expenses may not be saved")
+        )
+
+
+def _fail_queued(queue: asyncio.Queue[tuple[list[Expense], asyncio.Future[list[bool]]]]) -> None:
+    """Fail the acknowledgements of every submission left in a stopped writer's queue."""
+    while not queue.empty():
+        _, acknowledgement = queue.get_nowait()
+        _fail(acknowledgement)